@@ -1,54 +1,302 @@
 
+import asyncio
+import inspect
 import os
-from typing import TypedDict, List
+import weakref
+from contextlib import asynccontextmanager
+from typing import Annotated, Dict, Optional, TypedDict, List
 from langgraph.graph import StateGraph, END
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langgraph.graph.message import add_messages
+from langgraph.checkpoint.memory import InMemorySaver
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage, RemoveMessage
 from dotenv import load_dotenv
+from llm_service import llm_executor
+from model_registry import model_registry
+from sentiment_service import score_text
+from intent_classifier import distortion_classifier, intent_classifier
+from memory_index import estimate_tokens
+from metrics import GRAPH_NODE_SECONDS, current_node, span
 
 # Load Env
 load_dotenv()
-API_KEY = os.getenv("VITE_GOOGLE_AI_KEY") or os.getenv("GOOGLE_AI_KEY") or os.getenv("GEMINI_API_KEY")
+
+# Conversation session persistence: 'memory' or 'sqlite'
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "memory")
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "sessions.sqlite3")
+
+# Prompt budget of the reply nodes: system prompt, memory, summary and recent turns together
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))
+# Newest messages are never folded into the rolling summary
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "8"))
+# Older messages are summarized once at least this many have accumulated
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "6"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "250"))
+# Risk score (0..1) from which a turn without crisis phrases is flagged as 'elevated'
+RISK_ELEVATED_THRESHOLD = float(os.getenv("RISK_ELEVATED_THRESHOLD", "0.3"))
 
 # --- State Definition ---
+def merge_analysis(current: Optional[dict], update: Optional[dict]) -> dict:
+    """Reducer for AgentState.analysis: each parallel branch writes its own keys in the same step."""
+    return {**(current or {}), **(update or {})}
+
 class AgentState(TypedDict):
-    messages: List[BaseMessage]
+    messages: Annotated[List[BaseMessage], add_messages] # each turn appends
     current_phase: str # 'start', 'cbt', 'crisis', 'general'
     sentiment_score: float
+    memory_context: str # long-term memory relevant to this turn, pinned into every prompt
+    summary: str # rolling summary of the messages pruned from `messages`
+    summarized_count: int # leading messages already in the summary but not pruned yet (older checkpoints)
+    analysis: Annotated[dict, merge_analysis] # this turn's results from the analysis branches
 
 # --- LLM Setup ---
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    google_api_key=API_KEY,
-    temperature=0.7
+def chat_llm():
+    """The shared chat model, built on first use by the model registry."""
+    return model_registry.chat(temperature=0.7)
+
+# The reply node for each conversation phase; their LLM output is streamed to the user token by token
+PHASE_NODES = {"crisis": "crisis_node", "cbt": "cbt_node", "general": "general_chat_node"}
+REPLY_NODES = set(PHASE_NODES.values())
+
+# Sent instead of a reply when the model can't be reached (deadline, open circuit breaker, upstream errors)
+CHAT_FALLBACK_MESSAGE = (
+    "I'm having a little trouble gathering my thoughts right now, but I'm still here with you. "
+    "Could you give me a moment and send that again?"
 )
 
+def chunk_text(chunk) -> str:
+    """Returns the plain text carried by a message chunk."""
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+def memory_messages(state: AgentState) -> List[BaseMessage]:
+    """The pinned memory block for a node prompt (empty when nothing relevant is known)."""
+    memory_context = state.get("memory_context")
+    if not memory_context:
+        return []
+    return [SystemMessage(content=f"Context from Memory:\n{memory_context}")]
+
+def clip_text(text: str, max_tokens: int) -> str:
+    """Cuts text down to roughly max_tokens."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(0, max_tokens - 1) * 4].rstrip() + "…"
+
+# --- Context assembly ---
+
+def assemble_context(system_prompt: str, state: AgentState, budget: int = CONTEXT_TOKEN_BUDGET) -> List[BaseMessage]:
+    """
+    Builds a node prompt within the token budget: the pinned system prompt and memory,
+    the rolling summary of older turns, then as many recent turns verbatim as still fit.
+    """
+    pinned = [SystemMessage(content=system_prompt)] + memory_messages(state)
+    if state.get("summary"):
+        pinned.append(SystemMessage(content=f"Summary of the conversation so far:\n{state['summary']}"))
+    remaining = budget - sum(estimate_tokens(chunk_text(m)) for m in pinned)
+
+    recent: List[BaseMessage] = []
+    for message in reversed(state['messages'][state.get("summarized_count", 0):]):
+        text = chunk_text(message)
+        cost = estimate_tokens(text)
+        if not recent and cost > remaining:
+            # The current message always goes in, clipped if it alone exceeds the budget
+            message = message.model_copy(update={"content": clip_text(text, max(remaining, 200))})
+            cost = remaining
+        elif cost > remaining:
+            break
+        recent.append(message)
+        remaining -= cost
+    return pinned + recent[::-1]
+
+SUMMARY_PROMPT = """You keep a running summary of a conversation between a user and Serene, a mental health companion.
+Update the summary with the new messages below. Keep what matters for continuing the conversation:
+what the user is going through, people and events they mentioned, how they feel, coping steps discussed,
+and anything Serene offered to follow up on.
+Write in the third person, plain text, at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{transcript}
+"""
+
+def pending_summary_messages(state: AgentState) -> List[BaseMessage]:
+    """Messages that left the verbatim window but are not in the summary yet (empty until a batch is due)."""
+    messages = state.get("messages", [])
+    start = state.get("summarized_count", 0)
+    end = len(messages) - SUMMARY_KEEP_RECENT
+    if end - start < SUMMARY_BATCH_MESSAGES:
+        return []
+    return messages[start:end]
+
+async def summarize_messages(summary: str, messages: List[BaseMessage]) -> str:
+    """Folds new messages into an existing summary (incremental, never re-reads the whole history)."""
+    transcript = "\n".join(
+        f"{'User' if m.type == 'human' else 'Serene'}: {chunk_text(m)}" for m in messages
+    )
+    prompt = SUMMARY_PROMPT.format(
+        max_words=SUMMARY_MAX_TOKENS * 3 // 4, summary=summary or "(none yet)", transcript=transcript
+    )
+    response = await llm_executor.invoke("conversation_summary", chat_llm(), [HumanMessage(content=prompt)])
+    return clip_text(chunk_text(response).strip(), SUMMARY_MAX_TOKENS)
+
+# One summary update at a time per session thread
+_summary_tasks: Dict[str, asyncio.Task] = {}
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def session_lock(config: dict) -> asyncio.Lock:
+    """Serializes checkpoint writes of one session thread (chat turns and summary updates)."""
+    thread_id = config["configurable"]["thread_id"]
+    lock = _session_locks.get(thread_id)
+    if lock is None:
+        lock = _session_locks[thread_id] = asyncio.Lock()
+    return lock
+
+async def _update_summary(graph, config: dict):
+    try:
+        snapshot = await graph.aget_state(config)
+        values = snapshot.values or {}
+        pending = pending_summary_messages(values)
+        if not pending:
+            return
+        summary = await summarize_messages(values.get("summary", ""), pending)
+        # Summarized messages leave the state, so checkpoints stay bounded like the prompt.
+        # Removal is by message id: turns that landed meanwhile are unaffected, and the
+        # write itself waits for any turn in progress
+        summarized = values["messages"][:values.get("summarized_count", 0) + len(pending)]
+        async with session_lock(config):
+            # Several nodes finish the turn's last step (reply and analysis branches), so the
+            # write is attributed to the reply node; every node of that step leads to END
+            await graph.aupdate_state(config, {
+                "messages": [RemoveMessage(id=m.id) for m in summarized],
+                "summary": summary,
+                "summarized_count": 0,
+            }, as_node=PHASE_NODES.get(values.get("current_phase"), "general_chat_node"))
+    except Exception as e:
+        print(f"Conversation summary update failed: {e}")
+
+def schedule_summary_update(graph, config: dict):
+    """Updates the session's rolling summary in the background after a turn."""
+    thread_id = config["configurable"]["thread_id"]
+    if thread_id in _summary_tasks:
+        return
+    task = asyncio.create_task(_update_summary(graph, config))
+    _summary_tasks[thread_id] = task
+    task.add_done_callback(lambda _: _summary_tasks.pop(thread_id, None))
+
+async def save_crisis_turn(graph, config: dict, user_message: str, reply: str):
+    """Appends a crisis fast-path exchange, which never runs the graph, to the session's history."""
+    try:
+        async with session_lock(config):
+            await graph.aupdate_state(config, {
+                "messages": [HumanMessage(content=user_message), AIMessage(content=reply)],
+                "current_phase": "crisis",
+            }, as_node="crisis_node")
+    except Exception as e:
+        print(f"Saving crisis turn to session failed: {e}")
+
+_crisis_writes: set = set()
+
+def schedule_crisis_turn_save(graph, config: dict, user_message: str, reply: str):
+    """Saves a crisis turn in the background, so a client that disconnects can't cancel the write."""
+    task = asyncio.create_task(save_crisis_turn(graph, config, user_message, reply))
+    _crisis_writes.add(task)
+    task.add_done_callback(_crisis_writes.discard)
+
+async def wait_for_summaries():
+    """Lets in-flight summary updates and crisis turn saves finish (called before the checkpointer closes)."""
+    pending = list(_summary_tasks.values()) + list(_crisis_writes)
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+async def _stream_reply(messages: List[BaseMessage]):
+    """Streams the LLM reply so LangGraph can forward tokens, returning the merged message."""
+    response = None
+    async for chunk in llm_executor.stream("chat", chat_llm(), messages):
+        response = chunk if response is None else response + chunk
+    return response
+
 # --- Nodes ---
 
 def detect_intent(state: AgentState):
     """Analyzes user input to route to correct node."""
-    last_msg = state['messages'][-1].content.lower()
-    
-    # Simple keyword detection for robustness
-    crisis_keywords = ["kill myself", "suicide", "hurt myself", "end it all", "don't want to live"]
-    cbt_trigger_keywords = ["anxious", "depressed", "stuck", "overwhelmed", "hopeless"]
-    
-    if any(k in last_msg for k in crisis_keywords):
+    last_msg = state['messages'][-1].content
+
+    # Compiled lexicon classifier (data/intent_lexicon.json, hot-reloaded)
+    intents = intent_classifier.classify(last_msg)
+
+    if intents.has("crisis"):
         return {"current_phase": "crisis"}
     
     if state.get("current_phase") == "cbt":
-        if "stop" in last_msg or "exit" in last_msg:
+        # Leave the CBT flow only when the exit request outweighs distress cues in the same message
+        if intents.has("exit") and intents.score("exit") > intents.score("cbt"):
              return {"current_phase": "general"}
         return {"current_phase": "cbt"}
 
-    if any(k in last_msg for k in cbt_trigger_keywords):
+    if intents.has("cbt"):
         return {"current_phase": "cbt"}
     
     return {"current_phase": "general"}
 
-def crisis_node(state: AgentState):
+# --- Analysis branches ---
+# Run in the same graph step as the reply node, so they finish while the reply is still streaming.
+# All local (lexicons, no network calls); each writes its own key of `analysis`.
+
+def sentiment_node(state: AgentState):
+    """Lexicon sentiment of the user's message."""
+    scored = score_text(state['messages'][-1].content)
+    return {
+        "sentiment_score": scored["score"],
+        "analysis": {"sentiment": {
+            "score": scored["score"], "label": scored["label"],
+            "emotions": scored["emotions"], "confidence": scored["confidence"],
+        }},
+    }
+
+def risk_node(state: AgentState):
+    """Safety risk of the user's message: crisis phrases weigh most, then distress cues and negative tone."""
+    text = state['messages'][-1].content
+    intents = intent_classifier.classify(text)
+    negativity = max(0.0, -score_text(text)["score"])
+    score = min(1.0, 0.6 * min(1.0, intents.score("crisis")) + 0.25 * min(1.0, intents.score("cbt")) + 0.15 * negativity)
+    if intents.has("crisis"):
+        level = "high"
+    elif score >= RISK_ELEVATED_THRESHOLD:
+        level = "elevated"
+    else:
+        level = "low"
+    # Negation never clears a crisis phrase (the lexicon keeps its full weight), so neither does it here
+    signals = sorted({phrase for intent, phrase, negated in intents.matches
+                      if intent == "crisis" or (intent == "cbt" and not negated)})
+    return {"analysis": {"risk": {"level": level, "score": round(score, 3), "signals": signals}}}
+
+def distortion_node(state: AgentState):
+    """CBT cognitive distortions in the user's message (data/distortion_lexicon.json)."""
+    result = distortion_classifier.classify(state['messages'][-1].content)
+    return {"analysis": {"distortions": [
+        {"distortion": name, "score": round(result.score(name), 2)} for name in result.triggered
+    ]}}
+
+ANALYSIS_NODES = {
+    "sentiment_node": sentiment_node,
+    "risk_node": risk_node,
+    "distortion_node": distortion_node,
+}
+
+def analyze_message(text: str) -> dict:
+    """Every analysis branch run inline, for replies that don't go through the graph (crisis fast path)."""
+    state = {"messages": [HumanMessage(content=text)]}
+    analysis = {}
+    for node in ANALYSIS_NODES.values():
+        analysis = merge_analysis(analysis, node(state)["analysis"])
+    return analysis
+
+async def crisis_node(state: AgentState):
     """Handles high-risk safety scenarios."""
-    response = llm.invoke([
+    response = await _stream_reply([
         SystemMessage(content="""CRITICAL SAFETY PROTOCOL ACTIVATED.
         The user has expressed intent of self-harm.
         1. Acknowledge their pain immediately and with deep empathy.
@@ -60,7 +308,34 @@ def crisis_node(state: AgentState):
     ])
     return {"messages": [response]}
 
-def cbt_node(state: AgentState):
+# --- Crisis fast path (used by /chat before any memory or history work) ---
+
+# Sent verbatim in the first bytes of a crisis reply, before any LLM call
+CRISIS_SAFETY_MESSAGE = (
+    "I'm really sorry you're feeling this much pain, and I'm glad you told me. You don't have to face this alone.\n\n"
+    "If you might act on these thoughts or are in immediate danger, please call 911 (or your local emergency number) now.\n"
+    "You can call or text 988 (Suicide & Crisis Lifeline, US) any time, day or night, "
+    "or text HOME to 741741 to reach the Crisis Text Line.\n\n"
+)
+
+CRISIS_CONTINUATION_PROMPT = """CRITICAL SAFETY PROTOCOL ACTIVATED.
+The user has expressed intent of self-harm. They have ALREADY been shown crisis resources (988, 911, Crisis Text Line).
+Continue the reply that follows those resources:
+1. Acknowledge their pain with deep empathy, speaking directly to what they said.
+2. Do NOT try to 'fix' it and do NOT repeat the phone numbers.
+3. Gently encourage them to reach out to 988 or someone they trust right now, and ask if they are safe.
+4. Keep it to 2-3 short sentences.
+"""
+
+async def stream_crisis_continuation(user_message: str):
+    """Streams a short personalized follow-up to CRISIS_SAFETY_MESSAGE."""
+    messages = [SystemMessage(content=CRISIS_CONTINUATION_PROMPT), HumanMessage(content=user_message)]
+    async for chunk in llm_executor.stream("crisis", chat_llm(), messages):
+        text = chunk_text(chunk)
+        if text:
+            yield text
+
+async def cbt_node(state: AgentState):
     """Executes a structured CBT investigation."""
     system_prompt = """You are Serene, a compassionate CBT Therapist.
     Your goal is to help the user Identify, Challenge, and Reframe negative thoughts found in the conversation.
@@ -78,13 +353,11 @@ def cbt_node(state: AgentState):
     - Reference past struggles from Memory to show you remember their journey.
     """
     
-    response = llm.invoke([
-        SystemMessage(content=system_prompt),
-    ] + state['messages'][-5:])
+    response = await _stream_reply(assemble_context(system_prompt, state))
     
     return {"messages": [response]}
 
-def general_chat_node(state: AgentState):
+async def general_chat_node(state: AgentState):
     """Standard empathetic conversational partner."""
     system_prompt = """You are Serene, a deeply empathetic mental health companion.
     You are not just a bot; you are a 'friend in the pocket' who genuinely cares.
@@ -100,9 +373,7 @@ def general_chat_node(state: AgentState):
     - Keep responses concise (under 3 sentences) essentially purely conversational unless asked for a list.
     """
     
-    response = llm.invoke([
-        SystemMessage(content=system_prompt),
-    ] + state['messages'][-5:])
+    response = await _stream_reply(assemble_context(system_prompt, state))
     
     return {"messages": [response]}
 
@@ -115,11 +386,27 @@ def router(state: AgentState):
 
 workflow = StateGraph(AgentState)
 
+def instrumented(name: str, node):
+    """Times a node and labels the LLM calls made inside it with the node name."""
+    async def run(state: AgentState):
+        token = current_node.set(name)
+        try:
+            with span(name, GRAPH_NODE_SECONDS, node=name):
+                result = node(state)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+        finally:
+            current_node.reset(token)
+    return run
+
 # Add Nodes
-workflow.add_node("detect_intent", detect_intent)
-workflow.add_node("crisis_node", crisis_node)
-workflow.add_node("cbt_node", cbt_node)
-workflow.add_node("general_chat_node", general_chat_node)
+workflow.add_node("detect_intent", instrumented("detect_intent", detect_intent))
+workflow.add_node("crisis_node", instrumented("crisis_node", crisis_node))
+workflow.add_node("cbt_node", instrumented("cbt_node", cbt_node))
+workflow.add_node("general_chat_node", instrumented("general_chat_node", general_chat_node))
+for name, node in ANALYSIS_NODES.items():
+    workflow.add_node(name, instrumented(name, node))
 
 # Set Entry Point
 workflow.set_entry_point("detect_intent")
@@ -128,16 +415,40 @@ workflow.set_entry_point("detect_intent")
 workflow.add_conditional_edges(
     "detect_intent",
     router,
-    {
-        "crisis": "crisis_node",
-        "cbt": "cbt_node",
-        "general": "general_chat_node"
-    }
+    PHASE_NODES
 )
 
 workflow.add_edge("crisis_node", END)
 workflow.add_edge("cbt_node", END)
 workflow.add_edge("general_chat_node", END)
 
-# Compile
-agent_graph = workflow.compile()
+# Fan-out: the analysis branches run next to whichever reply node the router picks
+for name in ANALYSIS_NODES:
+    workflow.add_edge("detect_intent", name)
+    workflow.add_edge(name, END)
+
+# Compiled on first use (stateless: the caller passes the whole history)
+_agent_graph = None
+
+def get_agent_graph():
+    global _agent_graph
+    if _agent_graph is None:
+        _agent_graph = workflow.compile()
+    return _agent_graph
+
+@asynccontextmanager
+async def open_checkpointer(backend: str = CHECKPOINT_BACKEND, path: str = CHECKPOINT_PATH):
+    """Yields the checkpointer that persists server-side conversation sessions."""
+    if backend == "sqlite":
+        # Optional dependency: langgraph-checkpoint-sqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        async with AsyncSqliteSaver.from_conn_string(path) as saver:
+            yield saver
+    elif backend == "memory":
+        yield InMemorySaver()
+    else:
+        raise ValueError(f"Unknown CHECKPOINT_BACKEND: {backend}")
+
+def compile_session_graph(checkpointer):
+    """Graph whose state (history, current_phase) persists per thread_id between requests."""
+    return workflow.compile(checkpointer=checkpointer)
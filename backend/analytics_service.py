@@ -0,0 +1,193 @@
+import datetime
+import os
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from memory_index import STOPWORDS, TOKEN_RE
+from sentiment_service import score_text
+
+# Size limits of the digest, so report prompts stay roughly constant however long the history
+REPORT_EXCERPTS = int(os.getenv("REPORT_EXCERPTS", "3"))
+REPORT_EXCERPT_CHARS = int(os.getenv("REPORT_EXCERPT_CHARS", "240"))
+REPORT_TOP_THEMES = int(os.getenv("REPORT_TOP_THEMES", "8"))
+REPORT_MAX_QA_PAIRS = int(os.getenv("REPORT_MAX_QA_PAIRS", "5"))
+
+# Valence of the frontend MoodType values
+MOOD_VALUES = {"Happy": 2.0, "Calm": 1.0, "Neutral": 0.0, "Anxious": -1.5, "Angry": -1.5, "Sad": -2.0}
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+DAY_MS = 86_400_000
+# Words common to almost any journal entry, never reported as themes
+THEME_STOPWORDS = STOPWORDS | {
+    "feel", "felt", "feeling", "today", "day", "like", "know", "think", "want", "got", "get", "went",
+    "going", "because", "then", "there", "they", "them", "were", "when", "some", "much", "more", "also",
+    "still", "time", "things", "thing", "not", "all", "out", "one", "him", "her", "she", "his", "our",
+}
+
+
+def excerpt(text: str, limit: int = REPORT_EXCERPT_CHARS) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def _timestamp(entry: dict) -> Optional[float]:
+    """Epoch milliseconds of an entry ('timestamp' as sent by the app, or a parseable 'date')."""
+    value = entry.get("timestamp")
+    if isinstance(value, (int, float)):
+        return float(value)
+    date = entry.get("date")
+    if isinstance(date, str):
+        try:
+            return datetime.datetime.fromisoformat(date).timestamp() * 1000
+        except ValueError:
+            return None
+    return None
+
+
+def mood_features(mood_history: list) -> dict:
+    """Averages, trend, volatility and weekday pattern of the mood log."""
+    rows = [
+        (_timestamp(e), MOOD_VALUES[e.get("mood")], e.get("mood"), e.get("note") or "")
+        for e in mood_history if isinstance(e, dict) and e.get("mood") in MOOD_VALUES
+    ]
+    if not rows:
+        return {"entries": 0}
+    labels = Counter(r[2] for r in rows)
+    values = np.array([r[1] for r in rows], dtype=float)
+    features = {
+        "entries": len(rows),
+        "mean": round(float(values.mean()), 2),
+        "distribution": dict(labels.most_common()),
+    }
+
+    timed = sorted((r for r in rows if r[0] is not None), key=lambda r: r[0])
+    series = np.array([r[1] for r in timed]) if len(timed) == len(rows) else values
+    # Standard deviation of the change between consecutive logs: how much the mood swings
+    features["volatility"] = round(float(np.diff(series).std()), 2) if len(series) > 2 else 0.0
+    if len(timed) >= 2:
+        ts = np.array([r[0] for r in timed])
+        vs = np.array([r[1] for r in timed])
+        days = (ts - ts[0]) / DAY_MS
+        features["span_days"] = int(round(days[-1]))
+        if days[-1] > 0:
+            features["trend_per_week"] = round(float(np.polyfit(days, vs, 1)[0] * 7), 3)
+
+        # Weekly averages, most recent week last
+        week = ((ts[-1] - ts) // (7 * DAY_MS)).astype(int)
+        counts = np.bincount(week)
+        sums = np.bincount(week, weights=vs)
+        weekly = [round(float(s / c), 2) for s, c in zip(sums, counts) if c][:8]
+        features["weekly_averages"] = weekly[::-1]
+
+        weekday = ((ts // DAY_MS).astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+        day_counts = np.bincount(weekday, minlength=7)
+        day_sums = np.bincount(weekday, weights=vs, minlength=7)
+        logged = day_counts > 0
+        if logged.sum() >= 3:
+            day_means = np.where(logged, day_sums / np.maximum(day_counts, 1), np.nan)
+            features["best_weekday"] = WEEKDAYS[int(np.nanargmax(day_means))]
+            features["worst_weekday"] = WEEKDAYS[int(np.nanargmin(day_means))]
+
+    notes = [r for r in (timed or rows) if r[3].strip()]
+    features["recent_notes"] = [f"{r[2]}: {excerpt(r[3], 120)}" for r in notes[-REPORT_EXCERPTS:]]
+    return features
+
+
+def task_features(tasks: list) -> dict:
+    """Completion rate overall and per category."""
+    rows = [t for t in tasks if isinstance(t, dict)]
+    if not rows:
+        return {"total": 0}
+    completed = np.array([bool(t.get("completed")) for t in rows])
+    categories, index = np.unique([str(t.get("category") or "Other") for t in rows], return_inverse=True)
+    per_category = np.bincount(index, weights=completed) / np.bincount(index)
+    return {
+        "total": len(rows),
+        "completed": int(completed.sum()),
+        "completion_rate": round(float(completed.mean()), 2),
+        "by_category": {str(c): round(float(r), 2) for c, r in zip(categories, per_category)},
+        "pending_examples": [excerpt(t.get("title", ""), 60) for t in rows if not t.get("completed")][-REPORT_EXCERPTS:],
+    }
+
+
+def _journal_text(entry) -> str:
+    if isinstance(entry, dict):
+        return f"{entry.get('title') or ''}. {entry.get('content') or ''}".strip(". ")
+    return str(entry)
+
+
+def journal_features(journal_history: list) -> dict:
+    """Recurring themes, sentiment and a few representative excerpts of the journal."""
+    texts = [t for t in (_journal_text(e) for e in journal_history) if t]
+    if not texts:
+        return {"entries": 0}
+    scores = np.array([score_text(t)["score"] for t in texts])
+
+    # Themes: terms that recur across entries (document frequency), not within one long entry
+    document_frequency = Counter()
+    for text in texts:
+        document_frequency.update({
+            w for w in TOKEN_RE.findall(text.lower()) if len(w) > 2 and w not in THEME_STOPWORDS
+        })
+    themes = [term for term, count in document_frequency.most_common(REPORT_TOP_THEMES) if count > 1 or len(texts) == 1]
+
+    # Representative excerpts: the most negative, the most positive and the latest entry
+    picks = []
+    for i in (int(scores.argmin()), int(scores.argmax()), len(texts) - 1):
+        if i not in picks:
+            picks.append(i)
+    return {
+        "entries": len(texts),
+        "mean_sentiment": round(float(scores.mean()), 2),
+        "negative_share": round(float((scores <= -0.2).mean()), 2),
+        "themes": themes,
+        "excerpts": [excerpt(texts[i]) for i in sorted(picks)[:REPORT_EXCERPTS]],
+    }
+
+
+def build_digest(mood_history: list, journal_history: list, tasks: list) -> str:
+    """Compact plain-text digest of the user's history for report prompts."""
+    mood = mood_features(mood_history)
+    journal = journal_features(journal_history)
+    task = task_features(tasks)
+
+    lines = ["MOOD (scale -2 sad .. +2 happy):"]
+    if mood["entries"]:
+        lines.append(f"- {mood['entries']} logs over {mood.get('span_days', 0)} days, mean {mood['mean']}, "
+                     f"volatility {mood['volatility']}, distribution {mood['distribution']}")
+        if "trend_per_week" in mood:
+            lines.append(f"- Trend: {mood['trend_per_week']:+} per week; weekly averages (oldest to newest) {mood['weekly_averages']}")
+        if "best_weekday" in mood:
+            lines.append(f"- Best weekday {mood['best_weekday']}, hardest weekday {mood['worst_weekday']}")
+        lines.extend(f"- Note: {note}" for note in mood["recent_notes"])
+    else:
+        lines.append("- No mood logs")
+
+    lines.append("JOURNAL:")
+    if journal["entries"]:
+        lines.append(f"- {journal['entries']} entries, mean sentiment {journal['mean_sentiment']} (-1..1), "
+                     f"{int(journal['negative_share'] * 100)}% negative")
+        lines.append(f"- Recurring themes: {', '.join(journal['themes']) or 'none'}")
+        lines.extend(f"- Excerpt: \"{excerpt}\"" for excerpt in journal["excerpts"])
+    else:
+        lines.append("- No journal entries")
+
+    lines.append("TASKS:")
+    if task["total"]:
+        lines.append(f"- {task['completed']}/{task['total']} completed ({int(task['completion_rate'] * 100)}%), "
+                     f"completion by category {task['by_category']}")
+        if task["pending_examples"]:
+            lines.append(f"- Pending, e.g.: {'; '.join(task['pending_examples'])}")
+    else:
+        lines.append("- No tasks")
+    return "\n".join(lines)
+
+
+def format_qa_pairs(qa_pairs: list) -> str:
+    """Self-reflection answers for the wellness prompt, clipped to a fixed size."""
+    lines = [
+        f"- Q: {excerpt(pair.get('question', ''), 200)} A: {excerpt(pair.get('answer', ''), 400)}"
+        for pair in qa_pairs[:REPORT_MAX_QA_PAIRS] if isinstance(pair, dict)
+    ]
+    return "\n".join(lines) or "- None"
@@ -0,0 +1,54 @@
+"""
+Memory dedup check.
+
+Replays the labelled fact pairs in benchmarks/dedup_pairs.jsonl through NearDuplicateIndex
+(store the first fact, look up the second) and reports precision/recall of the duplicate
+decision. A pair labelled distinct but merged is a fact lost, so the script exits non-zero
+when that happens.
+
+Run from the backend directory:
+    python benchmarks/bench_dedup.py
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup_index import NearDuplicateIndex, jaccard, shingles  # noqa: E402
+
+PAIRS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dedup_pairs.jsonl")
+
+
+def main():
+    with open(PAIRS_PATH, "r") as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+
+    tp = fp = fn = 0
+    errors = []
+    for pair in pairs:
+        index = NearDuplicateIndex()
+        index.add("a", pair["a"])
+        merged = index.find_duplicate(pair["b"]) is not None
+        if merged and pair["duplicate"]:
+            tp += 1
+        elif merged:
+            fp += 1
+            errors.append(("merged distinct facts", pair))
+        elif pair["duplicate"]:
+            fn += 1
+            errors.append(("kept a duplicate", pair))
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    print(f"Pairs: {len(pairs)} labelled ({sum(p['duplicate'] for p in pairs)} duplicates)")
+    print(f"precision {precision:.3f}  recall {recall:.3f}")
+    for kind, pair in errors:
+        score = jaccard(shingles(pair["a"]), shingles(pair["b"]))
+        print(f"  {kind} (jaccard {score:.2f}): {pair['a']!r} / {pair['b']!r}")
+    if fp:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Intent classifier benchmark.
+
+Replays the labelled corpus in benchmarks/intent_corpus.jsonl through the compiled lexicon
+classifier and reports single-core throughput and per-intent precision/recall.
+
+Run from the backend directory:
+    python benchmarks/bench_intent.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_classifier import IntentClassifier  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_corpus.jsonl")
+THROUGHPUT_MESSAGES = 200_000
+
+
+def predict(classifier: IntentClassifier, text: str) -> str:
+    return classifier.classify(text).primary or "general"
+
+
+def main():
+    with open(CORPUS_PATH, "r") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    classifier = IntentClassifier(reload_interval=0)
+
+    labels = sorted({row["intent"] for row in corpus})
+    stats = {label: {"tp": 0, "fp": 0, "fn": 0} for label in labels}
+    errors = []
+    for row in corpus:
+        predicted = predict(classifier, row["text"])
+        if predicted == row["intent"]:
+            stats[row["intent"]]["tp"] += 1
+        else:
+            stats[row["intent"]]["fn"] += 1
+            if predicted in stats:
+                stats[predicted]["fp"] += 1
+            errors.append((row["intent"], predicted, row["text"]))
+
+    print(f"Corpus: {len(corpus)} labelled messages")
+    print(f"{'intent':<10} {'precision':>9} {'recall':>7} {'support':>8}")
+    for label in labels:
+        s = stats[label]
+        precision = s["tp"] / (s["tp"] + s["fp"]) if s["tp"] + s["fp"] else 0.0
+        recall = s["tp"] / (s["tp"] + s["fn"]) if s["tp"] + s["fn"] else 0.0
+        print(f"{label:<10} {precision:>9.3f} {recall:>7.3f} {s['tp'] + s['fn']:>8}")
+    for expected, predicted, text in errors:
+        print(f"  miss: expected {expected}, got {predicted}: {text!r}")
+
+    texts = [row["text"] for row in corpus]
+    engine = classifier.engine
+    start = time.perf_counter()
+    for i in range(THROUGHPUT_MESSAGES):
+        engine.classify(texts[i % len(texts)])
+    elapsed = time.perf_counter() - start
+    print(f"Throughput: {THROUGHPUT_MESSAGES / elapsed:,.0f} messages/sec on one core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Memory retrieval benchmark.
+
+Compares the memory context injected into /chat when every memory is dumped into the
+prompt (the old behaviour) against BM25 top-k retrieval under a token budget.
+
+Run from the backend directory:
+    python benchmarks/bench_memory_retrieval.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_index import estimate_tokens  # noqa: E402
+from memory_service import UserMemoryShard  # noqa: E402
+from memory_store import SQLiteMemoryStore  # noqa: E402
+
+SIZES = [10, 1_000, 50_000]
+QUERIES = 200
+
+SUBJECTS = ["cat", "dog", "sister", "brother", "mom", "dad", "partner", "manager", "therapist", "friend"]
+NAMES = ["Luna", "Max", "Sam", "Priya", "Jordan", "Alex", "Mia", "Noah", "Kai", "Zoe"]
+TOPICS = ["running", "painting", "chess", "yoga", "gardening", "baking", "guitar", "hiking", "reading", "swimming"]
+FEELINGS = ["anxious", "calm", "stressed", "hopeful", "tired", "lonely", "excited", "overwhelmed"]
+TEMPLATES = [
+    "User has a {subject} named {name}",
+    "User enjoys {topic} on weekends",
+    "User feels {feeling} before work meetings",
+    "User's {subject} {name} lives nearby",
+    "User started {topic} to manage stress",
+    "User gets {feeling} when talking about {topic}",
+]
+MESSAGES = [
+    "I went {topic} today and felt {feeling}",
+    "My {subject} {name} called me again",
+    "Work has me feeling {feeling} lately",
+    "Thinking about picking up {topic} again",
+]
+
+
+def fill(template: str, rng: random.Random) -> str:
+    return template.format(
+        subject=rng.choice(SUBJECTS), name=rng.choice(NAMES),
+        topic=rng.choice(TOPICS), feeling=rng.choice(FEELINGS),
+    )
+
+
+def full_dump_context(service: UserMemoryShard) -> str:
+    return "LONG TERM MEMORY (Facts about the user):\n" + "\n".join(f"- {m['text']}" for m in service.memories)
+
+
+def bench(size: int, rng: random.Random):
+    with tempfile.TemporaryDirectory() as tmp:
+        service = UserMemoryShard("bench", SQLiteMemoryStore(os.path.join(tmp, "bench.sqlite3")))
+        for i in range(size):
+            memory = {"id": str(i), "text": fill(rng.choice(TEMPLATES), rng), "created_at": str(time.time())}
+            service._index_memory(memory)
+
+        queries = [fill(rng.choice(MESSAGES), rng) for _ in range(QUERIES)]
+        start = time.perf_counter()
+        contexts = [service.get_context(q) for q in queries]
+        elapsed = time.perf_counter() - start
+
+        full_tokens = estimate_tokens(full_dump_context(service))
+        avg_tokens = sum(estimate_tokens(c) for c in contexts) / len(contexts)
+        print(f"{size:>7} memories | full dump {full_tokens:>9} tokens | top-k {avg_tokens:>6.0f} tokens "
+              f"| query {elapsed / QUERIES * 1000:>7.3f} ms")
+
+
+if __name__ == "__main__":
+    rng = random.Random(42)
+    for size in SIZES:
+        bench(size, rng)
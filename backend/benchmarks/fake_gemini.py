@@ -0,0 +1,260 @@
+"""
+Local stand-in for the Gemini API, for load tests that must not spend real quota.
+
+Provides fakes for both client libraries the backend uses:
+  - FakeGenerativeModel mimics `google.generativeai.GenerativeModel`
+    (generate_content / generate_content_async, streaming, usage_metadata, count_tokens_async)
+  - FakeChatModel is a LangChain chat model standing in for `ChatGoogleGenerativeAI`
+
+Latency (log-normal), output speed and injected failures come from a FakeProfile.
+install() routes the backend's model registry to the fakes.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.api_core import exceptions as google_exceptions  # noqa: E402
+from langchain_core.language_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult  # noqa: E402
+
+from memory_index import estimate_tokens  # noqa: E402
+
+WORDS = (
+    "I hear how heavy that feels and I am here with you. It makes sense to feel this way after a long week. "
+    "What is one small thing that usually helps you feel a little more grounded? Take a slow breath with me. "
+    "You have handled hard days before, and noticing this pattern is already a meaningful step."
+).split()
+
+FAILURES = {
+    "unavailable": lambda: google_exceptions.ServiceUnavailable("fake Gemini: service unavailable"),
+    "rate_limit": lambda: google_exceptions.ResourceExhausted("fake Gemini: quota exceeded"),
+    "deadline": lambda: google_exceptions.DeadlineExceeded("fake Gemini: deadline exceeded"),
+}
+
+
+class FakeProfile:
+    """
+    How the fake behaves: time to first token is log-normal around latency_ms (sigma spreads the
+    tail), text then arrives at tokens_per_second, and failure_rate of the calls raise one of
+    failure_kinds after the latency has elapsed.
+    """
+
+    def __init__(self, latency_ms: float = 350, latency_sigma: float = 0.4, tokens_per_second: float = 120,
+                 completion_tokens: int = 60, failure_rate: float = 0.0,
+                 failure_kinds: tuple = ("unavailable", "rate_limit"), seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.failure_rate = failure_rate
+        self.failure_kinds = failure_kinds
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    def first_token_delay(self) -> float:
+        return self.latency_ms / 1000 * math.exp(self.random.gauss(0, self.latency_sigma))
+
+    def token_delay(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def maybe_fail(self):
+        self.calls += 1
+        if self.failure_rate > 0 and self.random.random() < self.failure_rate:
+            self.failures += 1
+            raise FAILURES[self.random.choice(self.failure_kinds)]()
+
+    def text(self) -> str:
+        n = max(1, int(self.random.gauss(self.completion_tokens, self.completion_tokens * 0.25)))
+        start = self.random.randrange(len(WORDS))
+        return " ".join(WORDS[(start + i) % len(WORDS)] for i in range(n))
+
+
+def json_answer(prompt: str, profile: FakeProfile) -> str:
+    """A plausible JSON answer for each JSON-mode prompt the backend sends."""
+    rnd = profile.random
+    if "each text in this JSON array" in prompt:
+        items = json.loads(re.search(r"JSON array: (\[.*?\])\n", prompt, re.S).group(1))
+        return json.dumps([
+            {"i": item["i"], "score": round(rnd.uniform(-1, 1), 2), "label": "Neutral", "emotions": ["Calm"]}
+            for item in items
+        ])
+    if "Analyze the sentiment" in prompt:
+        return json.dumps({"score": round(rnd.uniform(-1, 1), 2), "label": "Neutral", "emotions": ["Reflective"]})
+    if "PERMANENT facts" in prompt:
+        conversations = re.findall(r"Conversation (\d+):", prompt)
+        return json.dumps({c: ([f"User mentioned topic {rnd.randrange(1000)}"] if rnd.random() < 0.3 else [])
+                           for c in conversations})
+    if "open-ended questions" in prompt:
+        return json.dumps(["What felt heaviest this week?", "When did you feel most at ease?", "What would help tomorrow?"])
+    if "self-assessment report" in prompt:
+        return json.dumps({
+            "currentVibe": "Tired but hopeful",
+            "emotionalPatterns": profile.text(),
+            "keyInsights": ["Sleep affects your mood", "Work stress peaks midweek"],
+            "recommendations": ["Short evening walks", "Journal before bed", "One task at a time"],
+        })
+    if "as many distinct items as its count" in prompt:
+        wanted = json.loads(re.search(r"audience described:\n(\{.*\})\n", prompt).group(1))
+        return json.dumps({key: [f"{' '.join(profile.text().split()[:12])} ({key} {rnd.randrange(10**6)})"
+                                 for _ in range(spec["count"])]
+                           for key, spec in wanted.items()})
+    if "distortion" in prompt:
+        return json.dumps({"distortion": "Catastrophizing", "explanation": profile.text(), "reframe": profile.text()})
+    return "{}"
+
+
+def split_chunks(text: str, tokens_per_chunk: int = 4) -> List[str]:
+    words = text.split(" ")
+    step = max(1, tokens_per_chunk)
+    return [" ".join(words[i:i + step]) + (" " if i + step < len(words) else "") for i in range(0, len(words), step)]
+
+
+# --- google.generativeai stand-in ---
+
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = completion_tokens
+        self.total_token_count = prompt_tokens + completion_tokens
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage: FakeUsage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeStream:
+    """Async iterable of response chunks, like `generate_content_async(..., stream=True)`."""
+
+    def __init__(self, profile: FakeProfile, text: str, prompt_tokens: int):
+        self.profile = profile
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+
+    async def __aiter__(self):
+        produced = 0
+        for chunk in split_chunks(self.text):
+            tokens = estimate_tokens(chunk)
+            await asyncio.sleep(self.profile.token_delay(tokens))
+            produced += tokens
+            # Like Gemini, usage on streamed chunks is cumulative
+            yield FakeResponse(chunk, FakeUsage(self.prompt_tokens, produced))
+
+
+class FakeGenerativeModel:
+    def __init__(self, profile: FakeProfile, model_name: str = "fake-gemini", json_mode: bool = False):
+        self.profile = profile
+        self.model_name = model_name
+        self.json_mode = json_mode
+
+    def _answer(self, prompt) -> str:
+        prompt = str(prompt)
+        return json_answer(prompt, self.profile) if self.json_mode else self.profile.text()
+
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        await asyncio.sleep(self.profile.first_token_delay())
+        self.profile.maybe_fail()
+        text = self._answer(prompt)
+        prompt_tokens = estimate_tokens(str(prompt))
+        if stream:
+            return FakeStream(self.profile, text, prompt_tokens)
+        completion_tokens = estimate_tokens(text)
+        await asyncio.sleep(self.profile.token_delay(completion_tokens))
+        return FakeResponse(text, FakeUsage(prompt_tokens, completion_tokens))
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.profile.first_token_delay())
+        self.profile.maybe_fail()
+        text = self._answer(prompt)
+        time.sleep(self.profile.token_delay(estimate_tokens(text)))
+        return FakeResponse(text, FakeUsage(estimate_tokens(str(prompt)), estimate_tokens(text)))
+
+    async def count_tokens_async(self, contents, **kwargs):
+        return {"total_tokens": estimate_tokens(str(contents))}
+
+
+# --- langchain_google_genai stand-in ---
+
+class FakeChatModel(BaseChatModel):
+    profile: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _prompt_tokens(self, messages: List[BaseMessage]) -> int:
+        return sum(estimate_tokens(str(m.content)) for m in messages)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.profile.first_token_delay())
+        self.profile.maybe_fail()
+        text = self.profile.text()
+        time.sleep(self.profile.token_delay(estimate_tokens(text)))
+        return self._result(messages, text)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.profile.first_token_delay())
+        self.profile.maybe_fail()
+        text = self.profile.text()
+        await asyncio.sleep(self.profile.token_delay(estimate_tokens(text)))
+        return self._result(messages, text)
+
+    def _result(self, messages, text: str) -> ChatResult:
+        prompt_tokens, completion_tokens = self._prompt_tokens(messages), estimate_tokens(text)
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunk(self, i: int, text: str, prompt_tokens: int) -> ChatGenerationChunk:
+        # LangChain chunks carry usage deltas: prompt tokens once, completion tokens per chunk
+        tokens = estimate_tokens(text)
+        return ChatGenerationChunk(message=AIMessageChunk(content=text, usage_metadata={
+            "input_tokens": prompt_tokens if i == 0 else 0, "output_tokens": tokens,
+            "total_tokens": (prompt_tokens if i == 0 else 0) + tokens,
+        }))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.profile.first_token_delay())
+        self.profile.maybe_fail()
+        prompt_tokens = self._prompt_tokens(messages)
+        for i, text in enumerate(split_chunks(self.profile.text())):
+            if i:
+                time.sleep(self.profile.token_delay(estimate_tokens(text)))
+            chunk = self._chunk(i, text, prompt_tokens)
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.profile.first_token_delay())
+        self.profile.maybe_fail()
+        prompt_tokens = self._prompt_tokens(messages)
+        for i, text in enumerate(split_chunks(self.profile.text())):
+            if i:
+                await asyncio.sleep(self.profile.token_delay(estimate_tokens(text)))
+            chunk = self._chunk(i, text, prompt_tokens)
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+
+def install(profile: FakeProfile):
+    """Routes every model the backend builds through the fakes."""
+    from model_registry import model_registry
+    model_registry.override(
+        generative_factory=lambda model_name, json_mode: FakeGenerativeModel(profile, model_name, json_mode),
+        chat_factory=lambda model_name, temperature: FakeChatModel(profile=profile),
+    )
@@ -0,0 +1,339 @@
+"""
+Offline load test of the backend.
+
+Starts the app with the fake Gemini from benchmarks/fake_gemini.py (no API key or quota needed),
+replays a weighted mix of /chat, /analyze-sentiment, /daily-insight, /journal-prompt,
+/clinical-summary and /memories traffic at a fixed concurrency, and reports latency percentiles, time to first byte
+and requests/sec per endpoint.
+
+Run from the backend directory:
+    python benchmarks/load_test.py --concurrency 32 --duration 30
+    python benchmarks/load_test.py --json results.json                        # record a baseline
+    python benchmarks/load_test.py --baseline results.json --max-regression 0.15  # regression gate
+
+--url points the driver at an already running server instead (the fake is then not used).
+Exits with status 1 when --baseline is given and any endpoint regressed past the threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_corpus.jsonl")
+DEFAULT_MIX = "chat=50,analyze-sentiment=20,daily-insight=10,clinical-summary=5,memories=15"
+MOODS = ["Happy", "Calm", "Neutral", "Anxious", "Angry", "Sad"]
+READY_TIMEOUT = 60
+DAY_MS = 86_400_000
+
+
+# --- Server side ---
+
+def serve(args):
+    """Runs the app in this process with every model routed to the fake Gemini."""
+    import uvicorn
+
+    import fake_gemini
+    import main
+
+    fake_gemini.install(fake_gemini.FakeProfile(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens, failure_rate=args.failure_rate, seed=args.seed,
+    ))
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir: str):
+    port = free_port()
+    env = dict(
+        os.environ,
+        GEMINI_API_KEY="fake-key",
+        MEMORY_DIR=os.path.join(workdir, "memories"),
+        CHECKPOINT_BACKEND="memory",
+        RESPONSE_CACHE_BACKEND="memory",
+        CONTENT_POOL_PATH=os.path.join(workdir, "content_pools.json"),
+        # Virtual users identify themselves with X-User-Id instead of Firebase ID tokens
+        TRUST_USER_ID_HEADER="1",
+        PYTHONUNBUFFERED="1",
+    )
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+        "--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma),
+        "--tokens-per-second", str(args.tokens_per_second), "--completion-tokens", str(args.completion_tokens),
+        "--failure-rate", str(args.failure_rate), "--seed", str(args.seed),
+    ]
+    log_path = os.path.join(workdir, "server.log")
+    log = open(log_path, "w")
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, f"http://127.0.0.1:{port}", log_path
+
+
+async def wait_ready(url: str, process=None):
+    deadline = time.monotonic() + READY_TIMEOUT
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            try:
+                if (await client.get(f"{url}/ready")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server not ready after {READY_TIMEOUT}s")
+
+
+# --- Traffic ---
+
+def load_texts() -> list:
+    with open(CORPUS_PATH, "r") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(REQUESTS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def history(rnd: random.Random, texts: list, days: int = 60) -> dict:
+    """Synthetic mood log, journal and task list like the frontend keeps."""
+    now = int(time.time() * 1000)
+    return {
+        "mood_history": [
+            {"mood": rnd.choice(MOODS), "timestamp": now - rnd.randrange(days * DAY_MS), "note": rnd.choice(texts)}
+            for _ in range(rnd.randint(10, 120))
+        ],
+        "journal_history": [
+            {"title": "Entry", "content": " ".join(rnd.sample(texts, 3))} for _ in range(rnd.randint(5, 40))
+        ],
+        "tasks": [
+            {"title": rnd.choice(texts)[:40], "category": rnd.choice(["Work", "Health", "Personal"]),
+             "completed": rnd.random() < 0.6}
+            for _ in range(rnd.randint(5, 30))
+        ],
+    }
+
+
+# name -> (method, path, body builder(user, rnd, texts))
+REQUESTS = {
+    "chat": ("POST", "/chat", lambda user, rnd, texts: {
+        "message": rnd.choice(texts), "conversation_id": f"{user}-conversation",
+    }),
+    "analyze-sentiment": ("POST", "/analyze-sentiment", lambda user, rnd, texts: {"text": rnd.choice(texts)}),
+    "daily-insight": ("POST", "/daily-insight", lambda user, rnd, texts: {"recent_mood": rnd.choice(MOODS + [None])}),
+    "journal-prompt": ("POST", "/journal-prompt", lambda user, rnd, texts: None),
+    "clinical-summary": ("POST", "/clinical-summary", lambda user, rnd, texts: {
+        **history(rnd, texts), "user_name": user, "stream": True,
+    }),
+    "memories": ("GET", "/memories", lambda user, rnd, texts: None),
+}
+
+
+class Results:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.first_byte = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name: str, status, latency: float, first_byte: float):
+        self.statuses[name][status] += 1
+        if status != 200:
+            self.errors[name] += 1
+            return
+        self.latency[name].append(latency)
+        self.first_byte[name].append(first_byte)
+
+
+async def virtual_user(client: httpx.AsyncClient, index: int, names: list, weights: list, texts: list,
+                       deadline: float, results: Results, seed: int):
+    rnd = random.Random(seed * 1000 + index)
+    user = f"loadtest-{index}"
+    while time.monotonic() < deadline:
+        name = rnd.choices(names, weights)[0]
+        method, path, body = REQUESTS[name]
+        payload = body(user, rnd, texts)
+        start = time.perf_counter()
+        first_byte = None
+        try:
+            async with client.stream(method, path, json=payload, headers={"X-User-Id": user}) as response:
+                async for chunk in response.aiter_bytes():
+                    if first_byte is None and chunk:
+                        first_byte = time.perf_counter() - start
+                status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        latency = time.perf_counter() - start
+        results.record(name, status, latency, first_byte if first_byte is not None else latency)
+
+
+async def run_load(url: str, concurrency: int, duration: float, mix: dict, seed: int) -> dict:
+    texts = load_texts()
+    names = [n for n, w in mix.items() if w > 0]
+    weights = [mix[n] for n in names]
+    results = Results()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(
+            virtual_user(client, i, names, weights, texts, deadline, results, seed) for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    return summarize(results, names, elapsed, concurrency)
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+
+
+def summarize(results: Results, names: list, elapsed: float, concurrency: int) -> dict:
+    endpoints = {}
+    for name in names:
+        ok = len(results.latency[name])
+        total = ok + results.errors[name]
+        endpoints[name] = {
+            "requests": total,
+            "errors": results.errors[name],
+            "error_rate": round(results.errors[name] / total, 4) if total else 0.0,
+            "rps": round(total / elapsed, 2),
+            "latency_ms": percentiles(results.latency[name]),
+            "ttfb_ms": percentiles(results.first_byte[name]),
+            "statuses": {str(k): v for k, v in results.statuses[name].items()},
+        }
+    total = sum(e["requests"] for e in endpoints.values())
+    errors = sum(e["errors"] for e in endpoints.values())
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "rps": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(report: dict):
+    print(f"{report['requests']} requests in {report['duration_s']}s at concurrency {report['concurrency']}: "
+          f"{report['rps']} req/s, {report['errors']} errors")
+    print(f"{'endpoint':<18} {'reqs':>6} {'err%':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'ttfb50':>8} {'ttfb95':>8}  (ms)")
+
+    def ms(value):
+        return "-" if value is None else f"{value:.0f}"
+
+    for name, e in report["endpoints"].items():
+        lat, ttfb = e["latency_ms"], e["ttfb_ms"]
+        print(f"{name:<18} {e['requests']:>6} {e['error_rate'] * 100:>6.1f} {e['rps']:>7.1f} {ms(lat['p50']):>8} "
+              f"{ms(lat['p95']):>8} {ms(lat['p99']):>8} {ms(ttfb['p50']):>8} {ms(ttfb['p95']):>8}")
+
+
+def regressions(report: dict, baseline: dict, max_regression: float) -> list:
+    """Endpoints whose p95 latency, throughput or error rate got worse than the baseline allows."""
+    problems = []
+    if report["rps"] < baseline["rps"] * (1 - max_regression):
+        problems.append(f"throughput {report['rps']} req/s < baseline {baseline['rps']} req/s")
+    for name, base in baseline["endpoints"].items():
+        current = report["endpoints"].get(name)
+        if current is None:
+            continue
+        for metric in ("latency_ms", "ttfb_ms"):
+            now, before = current[metric]["p95"], base[metric]["p95"]
+            if now is not None and before and now > before * (1 + max_regression):
+                problems.append(f"{name} {metric} p95 {now} > baseline {before}")
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            problems.append(f"{name} error rate {current['error_rate']} > baseline {base['error_rate']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users sending requests back to back")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. %(default)s")
+    parser.add_argument("--url", help="load an already running server instead of starting one with the fake")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--seed", type=int, default=7)
+    fake = parser.add_argument_group("fake Gemini")
+    fake.add_argument("--latency-ms", type=float, default=350, help="median time to first token")
+    fake.add_argument("--latency-sigma", type=float, default=0.4, help="log-normal spread of the latency")
+    fake.add_argument("--tokens-per-second", type=float, default=120)
+    fake.add_argument("--completion-tokens", type=int, default=60, help="mean reply length")
+    fake.add_argument("--failure-rate", type=float, default=0.0, help="share of calls failing with 503/429")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as workdir:
+        process = log_path = None
+        url = args.url
+        if url is None:
+            process, url, log_path = start_server(args, workdir)
+        try:
+            asyncio.run(wait_ready(url, process))
+            report = asyncio.run(run_load(url, args.concurrency, args.duration, mix, args.seed))
+        except RuntimeError as e:
+            if log_path:
+                with open(log_path) as f:
+                    print(f.read())
+            raise SystemExit(f"Load test failed: {e}")
+        finally:
+            if process is not None:
+                process.terminate()
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(report, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"No regression beyond {args.max_regression:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
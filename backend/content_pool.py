@@ -0,0 +1,302 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from memory_store import atomic_write_json
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: every worker refills its own pools
+    fcntl = None
+
+# Precomputed answers for the endpoints whose input is a small vocabulary (or nothing)
+CONTENT_POOLS = os.getenv("CONTENT_POOLS", "1") == "1"
+CONTENT_POOL_PATH = os.getenv("CONTENT_POOL_PATH", "content_pools.json")
+# Entries kept per bucket, and the count of fresh entries below which a bucket is refilled
+CONTENT_POOL_SIZE = int(os.getenv("CONTENT_POOL_SIZE", "12"))
+CONTENT_POOL_LOW_WATER = int(os.getenv("CONTENT_POOL_LOW_WATER", "4"))
+# Most items asked for in one LLM call; larger refills are split into concurrent calls
+CONTENT_POOL_BATCH_ITEMS = int(os.getenv("CONTENT_POOL_BATCH_ITEMS", "30"))
+# Entries older than this are replaced on the next refill (and served until then)
+CONTENT_POOL_MAX_AGE = float(os.getenv("CONTENT_POOL_MAX_AGE", str(6 * 3600)))
+# Seconds between scheduler passes; a request that drains a bucket wakes it early
+CONTENT_POOL_REFRESH_INTERVAL = float(os.getenv("CONTENT_POOL_REFRESH_INTERVAL", "60"))
+
+
+class PoolSpec:
+    """One pool: the instruction for its items and its buckets (bucket -> who the items are for)."""
+
+    def __init__(self, instruction: str, buckets: Dict[str, str]):
+        self.instruction = instruction
+        self.buckets = buckets
+
+
+def refill_prompt(spec: PoolSpec, counts: Dict[str, int]) -> str:
+    """One JSON-mode prompt that fills every listed bucket of a pool at once."""
+    wanted = {bucket: {"count": n, "audience": spec.buckets[bucket]} for bucket, n in counts.items()}
+    return (
+        f"{spec.instruction}\n"
+        f"For each key below, write as many distinct items as its count, for the audience described:\n"
+        f"{json.dumps(wanted)}\n"
+        f"Return a JSON object mapping each key to a list of strings."
+    )
+
+
+class ContentPools:
+    """
+    Pools of pregenerated answers, served round-robin in O(1) from memory. A background
+    scheduler tops up every bucket whose fresh entries fell below the low-water mark, with a
+    few batched LLM calls, retires the oldest entries as new ones arrive, and saves the
+    pools to `path` so a restart serves immediately. Entries past max_age are still served
+    until a refill replaces them, so an LLM outage never empties a pool.
+
+    With several worker processes sharing `path`, only the one holding the lock file
+    `<path>.lock` refills; the others reload the saved pools on each pass and take over the
+    lock if that worker exits.
+    """
+
+    def __init__(self, specs: Dict[str, PoolSpec], generate: Callable[[str, str], Awaitable[str]],
+                 path: str = CONTENT_POOL_PATH, size: int = CONTENT_POOL_SIZE,
+                 low_water: int = CONTENT_POOL_LOW_WATER, max_age: float = CONTENT_POOL_MAX_AGE,
+                 interval: float = CONTENT_POOL_REFRESH_INTERVAL, batch_items: int = CONTENT_POOL_BATCH_ITEMS):
+        self.specs = specs
+        self.generate = generate  # (pool, prompt) -> JSON text
+        self.path = path
+        self.size = size
+        self.low_water = low_water
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_items = batch_items
+        self._pools: Dict[str, Dict[str, Deque[dict]]] = {
+            pool: {bucket: deque() for bucket in spec.buckets} for pool, spec in specs.items()
+        }
+        self._mtime: Optional[float] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._first_pass_done = False
+        self._lock_file = None
+        self.served: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.refills: Dict[str, int] = {}
+        self.refill_failures: Dict[str, int] = {}
+        self.load()
+
+    # --- Serving (request path) ---
+
+    def take(self, pool: str, bucket: str) -> Optional[str]:
+        """Next entry of a bucket in rotation, or None when it is empty (the caller generates live)."""
+        entries = self._pools.get(pool, {}).get(bucket)
+        if entries is None:
+            return None
+        if not entries:
+            self.misses[pool] = self.misses.get(pool, 0) + 1
+            self.wake()
+            return None
+        entry = entries[0]
+        entries.rotate(-1)
+        self.served[pool] = self.served.get(pool, 0) + 1
+        return entry["text"]
+
+    @property
+    def primed(self) -> bool:
+        """Every bucket can serve, or the scheduler's first pass ended (whether or not the LLM answered)."""
+        return self._first_pass_done or all(e for buckets in self._pools.values() for e in buckets.values())
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # --- Refilling (background) ---
+
+    def _fresh(self, entries: Deque[dict], now: float) -> int:
+        return sum(1 for e in entries if now - e["created_at"] < self.max_age)
+
+    def needs(self, pool: str) -> Dict[str, int]:
+        """Items to request per bucket: enough to bring low buckets back to `size` fresh entries."""
+        now = time.time()
+        counts = {}
+        for bucket, entries in self._pools[pool].items():
+            fresh = self._fresh(entries, now)
+            if fresh < self.low_water:
+                counts[bucket] = self.size - fresh
+        return counts
+
+    def batches(self, counts: Dict[str, int]) -> List[Dict[str, int]]:
+        """Splits a refill into groups of buckets asking for at most batch_items items each."""
+        batches, current, items = [], {}, 0
+        for bucket, n in counts.items():
+            if current and items + n > self.batch_items:
+                batches.append(current)
+                current, items = {}, 0
+            current[bucket] = n
+            items += n
+        if current:
+            batches.append(current)
+        return batches
+
+    async def refill(self, pool: str) -> int:
+        """Tops up one pool's low buckets in batched LLM calls; returns the entries added."""
+        counts = self.needs(pool)
+        if not counts:
+            return 0
+        added = await asyncio.gather(*(self._refill_batch(pool, batch) for batch in self.batches(counts)))
+        return sum(added)
+
+    async def _refill_batch(self, pool: str, counts: Dict[str, int]) -> int:
+        try:
+            answer = json.loads(await self.generate(pool, refill_prompt(self.specs[pool], counts)))
+        except Exception as e:
+            self.refill_failures[pool] = self.refill_failures.get(pool, 0) + 1
+            print(f"Content pool refill failed for {pool}: {e}")
+            return 0
+        self.refills[pool] = self.refills.get(pool, 0) + 1
+        now = time.time()
+        added = 0
+        for bucket in counts:
+            items = answer.get(bucket) if isinstance(answer, dict) else None
+            if not isinstance(items, list):
+                continue
+            entries = self._pools[pool][bucket]
+            known = {e["text"] for e in entries}
+            for text in items:
+                if isinstance(text, str) and text.strip() and text.strip() not in known:
+                    known.add(text.strip())
+                    entries.append({"text": text.strip(), "created_at": now})
+                    added += 1
+            # Rotate by age: the oldest entries make room for the new ones
+            while len(entries) > self.size:
+                oldest = min(entries, key=lambda e: e["created_at"])
+                entries.remove(oldest)
+        return added
+
+    async def refill_all(self) -> int:
+        # Another worker process may have refilled (and saved) the pools since we last looked
+        self._reload_if_changed()
+        added = sum(await asyncio.gather(*(self.refill(pool) for pool in self.specs)))
+        if added:
+            # Copied on the loop (requests rotate the deques), written to disk off it
+            await asyncio.to_thread(self.save, self.snapshot())
+        return added
+
+    def _try_lead(self) -> bool:
+        """Takes (or keeps) the refill lock shared by the worker processes; True when this one refills."""
+        if fcntl is None or self._lock_file is not None:
+            return True
+        try:
+            lock_file = open(f"{self.path}.lock", "a")
+        except OSError as e:
+            print(f"Could not open the content pool lock, refilling in this worker: {e}")
+            return True
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _release_lead(self):
+        if self._lock_file is not None:
+            # Closing the file drops the flock
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def leader(self) -> bool:
+        return fcntl is None or self._lock_file is not None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            failures = sum(self.refill_failures.values())
+            try:
+                if self._try_lead():
+                    await self.refill_all()
+                else:
+                    # Another worker refills and saves; serve what it wrote
+                    self._reload_if_changed()
+            except Exception as e:
+                print(f"Content pool scheduler error: {e}")
+            self._first_pass_done = True
+            if sum(self.refill_failures.values()) > failures:
+                # Don't let requests on an empty pool retry a failing LLM before the next pass
+                await asyncio.sleep(self.interval)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Starts the refill scheduler on the running event loop (first pass right away)."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._release_lead()
+
+    # --- Persistence ---
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            mtime = os.path.getmtime(self.path)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skipping unreadable content pool file {self.path}: {e}")
+            return
+        for pool, buckets in self._pools.items():
+            for bucket in buckets:
+                entries = data.get(pool, {}).get(bucket, [])
+                buckets[bucket] = deque(entries[-self.size:])
+        self._mtime = mtime
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    def snapshot(self) -> dict:
+        return {pool: {bucket: list(entries) for bucket, entries in buckets.items()}
+                for pool, buckets in self._pools.items()}
+
+    def save(self, data: Optional[dict] = None):
+        data = self.snapshot() if data is None else data
+        try:
+            atomic_write_json(self.path, data)
+            self._mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            print(f"Could not save content pools to {self.path}: {e}")
+
+    def sizes(self) -> Dict[tuple, int]:
+        return {(pool, bucket): len(entries) for pool, buckets in self._pools.items() for bucket, entries in buckets.items()}
+
+    def stats(self) -> dict:
+        now = time.time()
+        pools = {}
+        for pool, buckets in self._pools.items():
+            pools[pool] = {
+                "served": self.served.get(pool, 0),
+                "misses": self.misses.get(pool, 0),
+                "refills": self.refills.get(pool, 0),
+                "refill_failures": self.refill_failures.get(pool, 0),
+                "buckets": {b: {"size": len(e), "fresh": self._fresh(e, now)} for b, e in buckets.items()},
+            }
+        return {"enabled": self._task is not None, "leader": self.leader, "primed": self.primed, "size": self.size, "low_water": self.low_water, "pools": pools}
@@ -0,0 +1,138 @@
+import random
+import re
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words that carry no identity for a fact ("User has a cat" == "The user's cat")
+DEDUP_STOPWORDS = {
+    "a", "an", "the", "user", "users", "s", "is", "am", "are", "was", "were", "be", "has", "have", "had",
+    "owns", "own", "of", "to", "in", "on", "at", "as", "for", "with", "and", "their", "his", "her", "they", "he",
+    "she", "who", "that", "which", "currently", "really", "very",
+}
+
+# Paraphrases folded onto one canonical word before shingling
+CANONICAL_WORDS = {
+    "called": "named", "name": "named", "names": "named",
+    "loves": "likes", "love": "likes", "enjoys": "likes", "enjoy": "likes", "like": "likes", "fond": "likes",
+    "dislikes": "hates", "hate": "hates",
+    "works": "work", "working": "work", "job": "work", "employed": "work",
+    "lives": "live", "living": "live", "resides": "live",
+    "kitty": "cat", "cats": "cat", "dogs": "dog", "puppy": "dog",
+    "mom": "mother", "mum": "mother", "dad": "father",
+}
+
+# People a fact can be about instead of the user ("User's sister works as a nurse")
+OTHER_PEOPLE = {
+    "mother", "father", "parent", "parents", "sister", "brother", "sibling", "son", "daughter", "child",
+    "children", "kids", "wife", "husband", "partner", "boyfriend", "girlfriend", "fiance", "fiancee",
+    "grandmother", "grandfather", "grandma", "grandpa", "aunt", "uncle", "cousin", "niece", "nephew",
+    "friend", "roommate", "boss", "manager", "coworker", "colleague", "therapist", "neighbor", "neighbour",
+}
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def shingles(text: str) -> Set[str]:
+    """Canonical unigram + bigram shingles of a fact."""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in DEDUP_STOPWORDS:
+            continue
+        tokens.append(CANONICAL_WORDS.get(token, token))
+    result = set(tokens)
+    result.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return result
+
+
+def fact_subject(text: str) -> str:
+    """Whom a fact is about: 'user', or the person a possessive opens with ("User's sister ...")."""
+    tokens = TOKEN_RE.findall(text.lower())
+    if tokens[:1] == ["the"]:
+        tokens = tokens[1:]
+    if tokens[:2] == ["user", "s"]:
+        rest = tokens[2:]
+    elif tokens[:1] == ["users"]:
+        rest = tokens[1:]
+    else:
+        return "user"
+    person = CANONICAL_WORDS.get(rest[0], rest[0]) if rest else ""
+    return person if person in OTHER_PEOPLE else "user"
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index for spotting paraphrased facts.
+    Lookups only compare against documents sharing an LSH band, so cost stays sub-linear in
+    the number of stored facts; candidates are confirmed with exact Jaccard similarity and
+    must be about the same person (a relative's job is not the user's job).
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.6, seed: int = 7):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+        self._buckets: List[Dict[Tuple[int, ...], Set[str]]] = [{} for _ in range(bands)]
+        self._docs: Dict[str, Tuple[Set[str], List[Tuple[int, ...]], str]] = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _band_keys(self, doc_shingles: Set[str]) -> List[Tuple[int, ...]]:
+        hashes = [zlib.crc32(s.encode("utf-8")) for s in doc_shingles] or [0]
+        signature = [
+            min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes)
+            for a, b in self._perms
+        ]
+        return [tuple(signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def add(self, doc_id: str, text: str):
+        if doc_id in self._docs:
+            self.remove(doc_id)
+        doc_shingles = shingles(text)
+        keys = self._band_keys(doc_shingles)
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, set()).add(doc_id)
+        self._docs[doc_id] = (doc_shingles, keys, fact_subject(text))
+
+    def remove(self, doc_id: str):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        for band, key in enumerate(entry[1]):
+            bucket = self._buckets[band].get(key)
+            if bucket is None:
+                continue
+            bucket.discard(doc_id)
+            if not bucket:
+                del self._buckets[band][key]
+
+    def find_duplicate(self, text: str) -> Optional[str]:
+        """Returns the id of a stored near-duplicate of `text`, or None."""
+        doc_shingles = shingles(text)
+        subject = fact_subject(text)
+        candidates: Set[str] = set()
+        for band, key in enumerate(self._band_keys(doc_shingles)):
+            candidates.update(self._buckets[band].get(key, ()))
+        best_id, best_score = None, self.threshold
+        for doc_id in candidates:
+            candidate_shingles, _keys, candidate_subject = self._docs[doc_id]
+            if candidate_subject != subject:
+                continue
+            score = jaccard(doc_shingles, candidate_shingles)
+            if score >= best_score:
+                best_id, best_score = doc_id, score
+        return best_id
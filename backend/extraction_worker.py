@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+from contextlib import suppress
+from typing import Dict, List, Optional, Tuple
+
+from llm_service import ENDPOINT_LIMITS
+
+# Sizing (overridable through the environment)
+EXTRACTION_QUEUE_SIZE = int(os.getenv("EXTRACTION_QUEUE_SIZE", "1000"))
+EXTRACTION_DEBOUNCE_TURNS = int(os.getenv("EXTRACTION_DEBOUNCE_TURNS", "3"))
+EXTRACTION_DEBOUNCE_SECONDS = float(os.getenv("EXTRACTION_DEBOUNCE_SECONDS", "20"))
+EXTRACTION_MAX_BATCH = int(os.getenv("EXTRACTION_MAX_BATCH", "8"))
+# Batches extracted at once; more would only wait for a memory_extraction LLM slot
+EXTRACTION_MAX_INFLIGHT = int(os.getenv("EXTRACTION_MAX_INFLIGHT", str(ENDPOINT_LIMITS["memory_extraction"])))
+
+
+class PendingConversation:
+    """Turns of one conversation waiting to be sent to the extractor."""
+
+    def __init__(self, user_id: str, enqueued_at: float):
+        self.user_id = user_id
+        self.turns: List[dict] = []
+        self.exchanges = 0
+        self.first_enqueued_at = enqueued_at
+
+
+class ExtractionWorker:
+    """
+    Background memory extraction with a bounded queue.
+
+    Chat turns are coalesced per (user, conversation) and flushed once a conversation has
+    EXTRACTION_DEBOUNCE_TURNS exchanges or its oldest turn is EXTRACTION_DEBOUNCE_SECONDS old.
+    Ready conversations, across users, are extracted together in one LLM call of up to
+    EXTRACTION_MAX_BATCH conversations, at most EXTRACTION_MAX_INFLIGHT batches at a time; the
+    rest stays pending, so the stats show the real backlog. Everything pending is flushed on stop().
+    """
+
+    def __init__(self, memory_service, max_queue: int = EXTRACTION_QUEUE_SIZE,
+                 debounce_turns: int = EXTRACTION_DEBOUNCE_TURNS,
+                 debounce_seconds: float = EXTRACTION_DEBOUNCE_SECONDS,
+                 max_batch: int = EXTRACTION_MAX_BATCH, max_inflight: int = EXTRACTION_MAX_INFLIGHT):
+        self.memory_service = memory_service
+        self.debounce_turns = debounce_turns
+        self.debounce_seconds = debounce_seconds
+        self.max_batch = max_batch
+        self.max_inflight = max_inflight
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.pending: Dict[Tuple[str, str], PendingConversation] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        self.submitted = 0
+        self.dropped = 0
+        self.batches = 0
+        self.conversations_processed = 0
+        self.last_lag_seconds = 0.0
+
+    def submit(self, user_id: str, conversation_id: str, turns: List[dict]) -> bool:
+        """Queues new turns for extraction without blocking; returns False when the queue is full."""
+        try:
+            self.queue.put_nowait((user_id, conversation_id, turns, time.monotonic()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the loop and flushes everything still queued or pending."""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        self._drain_queue()
+        while self.pending or self._inflight:
+            self._dispatch(self._take_ready(force=True))
+            if self._inflight:
+                await asyncio.wait(set(self._inflight), return_when=asyncio.FIRST_COMPLETED)
+
+    def _add_pending(self, item):
+        user_id, conversation_id, turns, enqueued_at = item
+        key = (user_id, conversation_id)
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = PendingConversation(user_id, enqueued_at)
+        pending.turns.extend(turns)
+        pending.exchanges += 1
+
+    def _drain_queue(self):
+        while True:
+            try:
+                self._add_pending(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return
+
+    def _free_batches(self) -> int:
+        return self.max_inflight - len(self._inflight)
+
+    def _next_timeout(self) -> Optional[float]:
+        # With every batch slot busy, the loop wakes up when one finishes instead
+        if not self.pending or self._free_batches() <= 0:
+            return None
+        oldest = min(p.first_enqueued_at for p in self.pending.values())
+        return max(0.0, oldest + self.debounce_seconds - time.monotonic())
+
+    def _take_ready(self, force: bool = False) -> List[PendingConversation]:
+        """Oldest ready conversations, as many as the free batch slots can take."""
+        capacity = self._free_batches() * self.max_batch
+        if capacity <= 0:
+            return []
+        now = time.monotonic()
+        ready = [
+            key for key, pending in self.pending.items()
+            if force or pending.exchanges >= self.debounce_turns or now - pending.first_enqueued_at >= self.debounce_seconds
+        ]
+        ready.sort(key=lambda key: self.pending[key].first_enqueued_at)
+        return [self.pending.pop(key) for key in ready[:capacity]]
+
+    def _dispatch(self, ready: List[PendingConversation]):
+        for i in range(0, len(ready), self.max_batch):
+            task = asyncio.create_task(self._process(ready[i:i + self.max_batch]))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run(self):
+        getter = None
+        try:
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(self.queue.get())
+                # Wakes up on a new turn, a finished batch or the next debounce deadline
+                await asyncio.wait({getter, *self._inflight}, timeout=self._next_timeout(),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    self._add_pending(getter.result())
+                    getter = None
+                    self._drain_queue()
+                self._dispatch(self._take_ready())
+        finally:
+            if getter is not None:
+                getter.cancel()
+                if getter.done() and not getter.cancelled():
+                    self._add_pending(getter.result())
+
+    async def _process(self, batch: List[PendingConversation]):
+        self.last_lag_seconds = time.monotonic() - min(p.first_enqueued_at for p in batch)
+        try:
+            await self.memory_service.extract_memories_batch([(p.user_id, p.turns) for p in batch])
+        except Exception as e:
+            print(f"Memory extraction batch failed: {e}")
+        self.batches += 1
+        self.conversations_processed += len(batch)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        oldest = min((p.first_enqueued_at for p in self.pending.values()), default=None)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "pending_conversations": len(self.pending),
+            "inflight_batches": len(self._inflight),
+            "max_inflight_batches": self.max_inflight,
+            "oldest_pending_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "last_lag_seconds": round(self.last_lag_seconds, 3),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "conversations_processed": self.conversations_processed,
+        }
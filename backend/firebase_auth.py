@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+import re
+import time
+import urllib.request
+from typing import Dict, Optional
+
+from google.auth import exceptions as google_auth_exceptions
+from google.auth import jwt
+
+# Public keys that sign Firebase ID tokens, rotated by Google (cached for their Cache-Control max-age)
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+FIREBASE_CERTS_TIMEOUT = float(os.getenv("FIREBASE_CERTS_TIMEOUT", "5"))
+# Seconds of clock skew tolerated on a token's iat/exp
+FIREBASE_CLOCK_SKEW = int(os.getenv("FIREBASE_CLOCK_SKEW", "10"))
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class AuthError(Exception):
+    """The caller's credentials are missing or invalid (401)."""
+
+
+class AuthUnavailableError(Exception):
+    """Tokens can't be checked right now: the signing keys could not be fetched (503)."""
+
+
+class FirebaseTokenVerifier:
+    """
+    Verifies Firebase ID tokens in process, as the Admin SDK does: RS256 signature against
+    Google's public keys, expiry, audience (the project id) and issuer. The keys are fetched
+    off the event loop and cached for as long as Google's Cache-Control allows; a failed
+    refresh keeps using the previous keys.
+    """
+
+    def __init__(self, project_id: Optional[str], certs_url: str = FIREBASE_CERTS_URL,
+                 clock_skew: int = FIREBASE_CLOCK_SKEW):
+        self.project_id = project_id
+        self.certs_url = certs_url
+        self.clock_skew = clock_skew
+        self._certs: Optional[Dict[str, str]] = None
+        self._certs_expire = 0.0
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    def _fetch_certs(self):
+        with urllib.request.urlopen(self.certs_url, timeout=FIREBASE_CERTS_TIMEOUT) as response:
+            certs = json.loads(response.read())
+            match = _MAX_AGE.search(response.headers.get("Cache-Control", ""))
+        return certs, int(match.group(1)) if match else 3600
+
+    async def certs(self) -> Dict[str, str]:
+        if self._certs is not None and time.time() < self._certs_expire:
+            return self._certs
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            # Concurrent requests wait for one refresh
+            if self._certs is not None and time.time() < self._certs_expire:
+                return self._certs
+            try:
+                certs, max_age = await asyncio.to_thread(self._fetch_certs)
+            except (OSError, ValueError) as e:
+                if self._certs is None:
+                    raise AuthUnavailableError("Could not fetch the token signing keys") from e
+                print(f"Firebase key refresh failed, keeping the previous keys: {e}")
+                self._certs_expire = time.time() + 60
+                return self._certs
+            self._certs, self._certs_expire = certs, time.time() + max_age
+            return self._certs
+
+    async def verify(self, token: str) -> str:
+        """Returns the uid of a valid ID token; raises AuthError otherwise."""
+        if not self.project_id:
+            raise AuthError("ID token verification is not configured on this server")
+        certs = await self.certs()
+        try:
+            claims = jwt.decode(token, certs=certs, audience=self.project_id, clock_skew_in_seconds=self.clock_skew)
+        except (ValueError, google_auth_exceptions.GoogleAuthError) as e:
+            raise AuthError(f"Invalid ID token: {e}") from e
+        if claims.get("iss") != f"https://securetoken.google.com/{self.project_id}":
+            raise AuthError("Invalid ID token: wrong issuer")
+        uid = claims.get("sub")
+        if not isinstance(uid, str) or not uid or len(uid) > 128:
+            raise AuthError("Invalid ID token: no user id")
+        return uid
@@ -0,0 +1,175 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+INTENT_LEXICON_PATH = os.getenv(
+    "INTENT_LEXICON_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_lexicon.json")
+)
+# Cognitive distortion tags for chat turns, in the same lexicon format
+DISTORTION_LEXICON_PATH = os.getenv(
+    "DISTORTION_LEXICON_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "distortion_lexicon.json")
+)
+# How often (seconds) the lexicon file is checked for changes
+INTENT_RELOAD_INTERVAL = float(os.getenv("INTENT_RELOAD_INTERVAL", "2"))
+
+_CLAUSE_BREAK = re.compile(r"[.!?;,:\n]")
+_WORD = re.compile(r"[\w']+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Lowercases and folds curly quotes, hyphens and whitespace so phrases match one way."""
+    text = text.lower().replace("’", "'").replace("‘", "'").replace("-", " ")
+    return _SPACES.sub(" ", text)
+
+
+def trie_pattern(phrases: List[str]) -> str:
+    """Builds one regex alternation shaped like a prefix tree, so matching cost doesn't grow with the lexicon."""
+    trie: dict = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        optional = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != ""]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if optional else body
+
+    return build(trie)
+
+
+class IntentResult:
+    """Weighted score per intent plus the intents that crossed their threshold."""
+
+    def __init__(self, scores: Dict[str, float], triggered: List[str], matches: List[Tuple[str, str, bool]]):
+        self.scores = scores
+        self.triggered = triggered
+        self.matches = matches
+
+    def score(self, intent: str) -> float:
+        return self.scores.get(intent, 0.0)
+
+    def has(self, intent: str) -> bool:
+        return intent in self.triggered
+
+    @property
+    def primary(self) -> Optional[str]:
+        """First triggered intent in lexicon priority order."""
+        return self.triggered[0] if self.triggered else None
+
+
+class IntentEngine:
+    """A compiled lexicon: every phrase of every intent in a single token-bounded regex."""
+
+    def __init__(self, lexicon: dict):
+        self.version = lexicon.get("version")
+        self.negation_window = lexicon.get("negation_window", 3)
+        negations = [normalize(n) for n in lexicon.get("negations", [])]
+        self.single_negations = {n for n in negations if " " not in n}
+        self.multi_negations = [n for n in negations if " " in n]
+
+        self.intents: List[str] = []
+        self.thresholds: Dict[str, float] = {}
+        self.negation_factors: Dict[str, float] = {}
+        self.negation_windows: Dict[str, int] = {}
+        self.phrase_weights: Dict[str, List[Tuple[str, float]]] = {}
+        for intent, spec in lexicon["intents"].items():
+            self.intents.append(intent)
+            self.thresholds[intent] = spec.get("threshold", 1.0)
+            self.negation_factors[intent] = spec.get("negation_factor", 0.0)
+            self.negation_windows[intent] = spec.get("negation_window", self.negation_window)
+            for phrase, weight in spec["phrases"].items():
+                entries = self.phrase_weights.setdefault(normalize(phrase).strip(), [])
+                # Spelling variants ("self-harm" / "self harm") collapse onto one phrase; keep the highest weight
+                existing = next((e for e in entries if e[0] == intent), None)
+                if existing is None:
+                    entries.append((intent, weight))
+                elif weight > existing[1]:
+                    entries[entries.index(existing)] = (intent, weight)
+
+        self.pattern = re.compile(r"(?<![\w'])(" + trie_pattern(list(self.phrase_weights)) + r")(?![\w'])")
+
+    def _is_negated(self, text: str, start: int, window: int) -> bool:
+        if window <= 0:
+            return False
+        # Negation scope ends at clause punctuation ("I'm not okay, I want to ...")
+        clause_start = 0
+        for m in _CLAUSE_BREAK.finditer(text, max(0, start - 80), start):
+            clause_start = m.end()
+        tokens = _WORD.findall(text, clause_start, start)[-window:]
+        if not tokens:
+            return False
+        if any(t in self.single_negations for t in tokens):
+            return True
+        joined = " ".join(tokens)
+        return any(n in joined for n in self.multi_negations)
+
+    def classify(self, text: str) -> IntentResult:
+        text = normalize(text)
+        scores: Dict[str, float] = {}
+        matches = []
+        for m in self.pattern.finditer(text):
+            phrase = m.group(1)
+            for intent, weight in self.phrase_weights.get(phrase, ()):
+                negated = self._is_negated(text, m.start(), self.negation_windows[intent])
+                if negated:
+                    weight *= self.negation_factors[intent]
+                scores[intent] = scores.get(intent, 0.0) + weight
+                matches.append((intent, phrase, negated))
+        triggered = [i for i in self.intents if scores.get(i, 0.0) >= self.thresholds[i]]
+        return IntentResult(scores, triggered, matches)
+
+
+class IntentClassifier:
+    """
+    Intent classification backed by a JSON lexicon file.
+    The file is re-read when its mtime changes (checked at most every INTENT_RELOAD_INTERVAL
+    seconds); a lexicon that fails to load leaves the current engine in place.
+    """
+
+    def __init__(self, path: str = INTENT_LEXICON_PATH, reload_interval: float = INTENT_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = os.path.getmtime(path)
+        self.engine = self._load()
+        self._next_check = time.monotonic() + reload_interval
+
+    def _load(self) -> IntentEngine:
+        with open(self.path, "r") as f:
+            return IntentEngine(json.load(f))
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.reload_interval
+            try:
+                mtime = os.path.getmtime(self.path)
+                if mtime == self._mtime:
+                    return
+                self.engine = self._load()
+                self._mtime = mtime
+                print(f"🔁 Reloaded {os.path.basename(self.path)} (version {self.engine.version})")
+            except Exception as e:
+                print(f"Intent lexicon reload failed, keeping previous version: {e}")
+
+    def classify(self, text: str) -> IntentResult:
+        if self.reload_interval > 0:
+            self.maybe_reload()
+        return self.engine.classify(text)
+
+
+intent_classifier = IntentClassifier()
+distortion_classifier = IntentClassifier(DISTORTION_LEXICON_PATH)
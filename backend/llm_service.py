@@ -0,0 +1,431 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Tuple
+
+from metrics import (
+    LLM_CALL_SECONDS, LLM_COMPLETION_TOKENS, LLM_ERRORS, LLM_FIRST_TOKEN_SECONDS, LLM_HEDGES, LLM_PROMPT_TOKENS,
+    LLM_QUEUE_SECONDS, LLM_RETRIES, current_node, span,
+)
+from resilience import (
+    LLM_MAX_RETRIES, LLM_STREAM_IDLE_TIMEOUT, CircuitBreaker, LatencyTracker, backoff_delay, endpoint_deadline,
+    is_retryable,
+)
+
+# --- Limits (overridable through the environment) ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "128"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "15"))
+LLM_THREAD_POOL_SIZE = int(os.getenv("LLM_THREAD_POOL_SIZE", "16"))
+
+# Per-endpoint in-flight limits; anything not listed gets DEFAULT_ENDPOINT_LIMIT
+ENDPOINT_LIMITS = {
+    "chat": 24,
+    # Separate pool so crisis replies never queue behind regular chat traffic
+    "crisis": 8,
+    "memory_extraction": 4,
+    "conversation_summary": 4,
+    "analyze_sentiment_batch": 6,
+    "clinical_summary": 4,
+    "wellness_assessment": 4,
+    "assessment_questions": 4,
+}
+DEFAULT_ENDPOINT_LIMIT = 8
+
+
+class LLMSaturatedError(Exception):
+    """Raised when an LLM call cannot get an execution slot in time."""
+
+
+class LLMTimeoutError(Exception):
+    """Raised when an LLM call misses its endpoint's deadline."""
+
+
+class LLMUnavailableError(Exception):
+    """Raised without calling Gemini while the circuit breaker is open."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def token_usage(response) -> Optional[Tuple[int, int]]:
+    """(prompt, completion) tokens reported by a genai response or a LangChain message, if any."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None
+    if isinstance(usage, dict):
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    return getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+
+
+class CallRecorder:
+    """Latency, time to first token, token usage and errors of one LLM call, labelled by endpoint and graph node."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.node = current_node.get() or "none"
+        self.start = time.perf_counter()
+        self._first_token = False
+
+    def first_token(self):
+        if not self._first_token:
+            self._first_token = True
+            LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - self.start, endpoint=self.endpoint, node=self.node)
+
+    def usage(self, usage: Optional[Tuple[int, int]]):
+        if usage:
+            LLM_PROMPT_TOKENS.inc(usage[0], endpoint=self.endpoint, node=self.node)
+            LLM_COMPLETION_TOKENS.inc(usage[1], endpoint=self.endpoint, node=self.node)
+
+
+@contextmanager
+def record_call(endpoint: str):
+    call = CallRecorder(endpoint)
+    with span(f"llm:{endpoint}", LLM_CALL_SECONDS, endpoint=endpoint, node=call.node):
+        try:
+            yield call
+        except Exception as e:
+            LLM_ERRORS.inc(endpoint=endpoint, error=type(e).__name__)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # Lost hedge, missed deadline or client disconnect (a stream closed before its end)
+            LLM_ERRORS.inc(endpoint=endpoint, error="Cancelled")
+            raise
+
+
+class CallBudget:
+    """
+    Queue budget of one LLM call: its deadline (event loop time) and where its attempts were when
+    they got cancelled, so a missed deadline spent queueing locally isn't blamed on Gemini.
+    """
+
+    def __init__(self, deadline: float):
+        self.expires = asyncio.get_running_loop().time() + deadline
+        self.cancelled_queued = False
+        self.cancelled_running = False
+
+    def remaining(self) -> float:
+        return self.expires - asyncio.get_running_loop().time()
+
+    @property
+    def queued_only(self) -> bool:
+        """The deadline hit while attempts waited for a slot and none was talking to Gemini."""
+        return self.cancelled_queued and not self.cancelled_running
+
+
+class LLMExecutor:
+    """
+    Runs every LLM call of the backend without blocking the event loop.
+    Calls use the clients' native async APIs (or a sized thread pool as a fallback)
+    and are admitted through a global and a per-endpoint semaphore.
+
+    Every call gets its endpoint's deadline, jittered retries on retryable upstream errors and
+    goes through a shared circuit breaker; non-streaming calls of hedged endpoints send a duplicate
+    request once the first is slower than the endpoint's recent p95 (see resilience).
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, endpoint_limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = LLM_MAX_QUEUE, queue_timeout: float = LLM_QUEUE_TIMEOUT,
+                 thread_pool_size: int = LLM_THREAD_POOL_SIZE, max_retries: int = LLM_MAX_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.endpoint_limits = dict(ENDPOINT_LIMITS if endpoint_limits is None else endpoint_limits)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._endpoints: Dict[str, asyncio.Semaphore] = {}
+        self._pool = ThreadPoolExecutor(max_workers=thread_pool_size, thread_name_prefix="llm")
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _endpoint_semaphore(self, endpoint: str) -> asyncio.Semaphore:
+        if endpoint not in self._endpoints:
+            limit = self.endpoint_limits.get(endpoint, DEFAULT_ENDPOINT_LIMIT)
+            self._endpoints[endpoint] = asyncio.Semaphore(limit)
+        return self._endpoints[endpoint]
+
+    def check_admission(self, endpoint: str):
+        """Rejects up front when the wait queue is already full."""
+        if self.waiting >= self.max_queue:
+            raise LLMSaturatedError(f"LLM capacity exhausted ({endpoint}), please retry shortly")
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, budget: Optional[CallBudget] = None):
+        """
+        Holds one global and one per-endpoint slot for the duration of the block. With a budget,
+        queueing never outlasts the call's deadline.
+        """
+        queue_timeout = self.queue_timeout if budget is None else min(self.queue_timeout, budget.remaining())
+        try:
+            self.check_admission(endpoint)
+            if queue_timeout <= 0:
+                raise LLMSaturatedError(f"No time left to wait for an LLM slot ({endpoint})")
+        except LLMSaturatedError:
+            LLM_ERRORS.inc(endpoint=endpoint, error="LLMSaturatedError")
+            raise
+        endpoint_sem = self._endpoint_semaphore(endpoint)
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            # finally/BaseException: a cancel while queued (lost hedge, deadline, disconnect)
+            # must undo the queue count and the endpoint permit too
+            await asyncio.wait_for(endpoint_sem.acquire(), queue_timeout)
+            try:
+                await asyncio.wait_for(self._global.acquire(), queue_timeout)
+            except BaseException:
+                endpoint_sem.release()
+                raise
+        except asyncio.TimeoutError:
+            LLM_ERRORS.inc(endpoint=endpoint, error="LLMSaturatedError")
+            raise LLMSaturatedError(f"Timed out waiting for an LLM slot ({endpoint})") from None
+        except asyncio.CancelledError:
+            if budget is not None:
+                budget.cancelled_queued = True
+            raise
+        finally:
+            self.waiting -= 1
+        LLM_QUEUE_SECONDS.observe(time.perf_counter() - queued_at, endpoint=endpoint)
+        self.in_flight += 1
+        try:
+            yield
+        except asyncio.CancelledError:
+            if budget is not None:
+                budget.cancelled_running = True
+            raise
+        finally:
+            self.in_flight -= 1
+            self._global.release()
+            endpoint_sem.release()
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """Offloads a blocking call to the LLM thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, lambda: fn(*args, **kwargs))
+
+    # --- Single attempts ---
+
+    async def _generate_once(self, endpoint: str, budget: Optional[CallBudget], model, prompt, **kwargs):
+        async with self.slot(endpoint, budget):
+            with record_call(endpoint) as call:
+                if hasattr(model, "generate_content_async"):
+                    response = await model.generate_content_async(prompt, **kwargs)
+                else:
+                    response = await self.run_sync(model.generate_content, prompt, **kwargs)
+                call.usage(token_usage(response))
+                self.latency.observe(endpoint, time.perf_counter() - call.start)
+                return response
+
+    async def _generate_stream_once(self, endpoint: str, budget: Optional[CallBudget], model, prompt, **kwargs):
+        async with self.slot(endpoint, budget):
+            with record_call(endpoint) as call:
+                if hasattr(model, "generate_content_async"):
+                    response = await model.generate_content_async(prompt, stream=True, **kwargs)
+                    usage = None
+                    async for chunk in response:
+                        # Usage on streamed chunks is cumulative; the last one holds the totals
+                        usage = token_usage(chunk) or usage
+                        if chunk.text:
+                            call.first_token()
+                            yield chunk.text
+                    call.usage(usage)
+                else:
+                    response = await self.run_sync(model.generate_content, prompt, **kwargs)
+                    call.first_token()
+                    call.usage(token_usage(response))
+                    yield response.text
+
+    async def _invoke_once(self, endpoint: str, budget: Optional[CallBudget], llm, messages, **kwargs):
+        async with self.slot(endpoint, budget):
+            with record_call(endpoint) as call:
+                response = await llm.ainvoke(messages, **kwargs)
+                call.usage(token_usage(response))
+                self.latency.observe(endpoint, time.perf_counter() - call.start)
+                return response
+
+    async def _stream_once(self, endpoint: str, budget: Optional[CallBudget], llm, messages, **kwargs):
+        async with self.slot(endpoint, budget):
+            with record_call(endpoint) as call:
+                prompt_tokens = completion_tokens = 0
+                async for chunk in llm.astream(messages, **kwargs):
+                    call.first_token()
+                    # LangChain chunks carry usage deltas
+                    usage = token_usage(chunk)
+                    if usage:
+                        prompt_tokens += usage[0]
+                        completion_tokens += usage[1]
+                    yield chunk
+                call.usage((prompt_tokens, completion_tokens) if prompt_tokens or completion_tokens else None)
+
+    # --- Resilience ---
+
+    def _admit(self, endpoint: str):
+        """Fails fast while the circuit breaker is open."""
+        if not self.breaker.allow():
+            LLM_ERRORS.inc(endpoint=endpoint, error="LLMUnavailableError")
+            raise LLMUnavailableError("The AI service is temporarily unavailable", self.breaker.retry_after())
+
+    def _record_outcome(self, error: Optional[BaseException]):
+        if error is None:
+            self.breaker.record_success()
+        elif is_retryable(error) or isinstance(error, LLMTimeoutError):
+            self.breaker.record_failure()
+        else:
+            # Our own rejection (saturation) or a bad request says nothing about upstream health
+            self.breaker.release_probe()
+
+    async def _hedged(self, endpoint: str, attempt):
+        """Runs attempt(); if it is slower than the endpoint's p95, races a duplicate and keeps the first answer."""
+        self.latency.calls[endpoint] = self.latency.calls.get(endpoint, 0) + 1
+        delay = self.latency.hedge_delay(endpoint)
+        if delay is None:
+            return await attempt()
+        pending = {asyncio.create_task(attempt())}
+        hedged = False
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=None if hedged else delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not hedged and not done and self.waiting == 0 and self.latency.hedge_allowed(endpoint):
+                    # Only with idle capacity, and for a bounded share of calls
+                    hedged = True
+                    LLM_HEDGES.inc(endpoint=endpoint)
+                    self.latency.hedges[endpoint] = self.latency.hedges.get(endpoint, 0) + 1
+                    pending.add(asyncio.create_task(attempt()))
+                elif not hedged and not done:
+                    hedged = True  # no capacity to hedge: just wait for the first request
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, endpoint: str, attempt):
+        """attempt(budget) under the endpoint's deadline, with hedging, jittered retries and the circuit breaker."""
+        self._admit(endpoint)
+        deadline = endpoint_deadline(endpoint)
+        budget = CallBudget(deadline)
+        try:
+            async with asyncio.timeout(deadline):
+                for retry in range(self.max_retries + 1):
+                    try:
+                        response = await self._hedged(endpoint, lambda: attempt(budget))
+                        break
+                    except Exception as e:
+                        if retry == self.max_retries or not is_retryable(e):
+                            raise
+                        print(f"LLM call failed ({endpoint}), retrying: {e}")
+                        LLM_RETRIES.inc(endpoint=endpoint)
+                        await asyncio.sleep(backoff_delay(retry))
+        except TimeoutError:
+            if budget.queued_only:
+                # Spent the deadline in our own queue: a 429 like any saturation, not a Gemini failure
+                error = LLMSaturatedError(f"Timed out waiting for an LLM slot ({endpoint})")
+            else:
+                error = LLMTimeoutError(f"LLM call exceeded its {deadline:g}s deadline ({endpoint})")
+            LLM_ERRORS.inc(endpoint=endpoint, error=type(error).__name__)
+            self._record_outcome(error)
+            raise error from None
+        except Exception as e:
+            self._record_outcome(e)
+            raise
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        self._record_outcome(None)
+        return response
+
+    async def _call_stream(self, endpoint: str, open_stream):
+        """
+        Chunks of open_stream(budget) with the endpoint's deadline for the first chunk and an idle timeout
+        after it. Failures before the first chunk are retried; once text went out they end the stream.
+        """
+        self._admit(endpoint)
+        deadline = endpoint_deadline(endpoint)
+        budget = CallBudget(deadline)
+        retry = 0
+        while True:
+            chunks = open_stream(budget)
+            yielded = False
+            try:
+                while True:
+                    timeout = LLM_STREAM_IDLE_TIMEOUT if yielded else budget.remaining()
+                    try:
+                        async with asyncio.timeout(max(timeout, 0)):
+                            chunk = await chunks.__anext__()
+                    except TimeoutError:
+                        if not yielded and budget.queued_only:
+                            LLM_ERRORS.inc(endpoint=endpoint, error="LLMSaturatedError")
+                            raise LLMSaturatedError(f"Timed out waiting for an LLM slot ({endpoint})") from None
+                        LLM_ERRORS.inc(endpoint=endpoint, error="LLMTimeoutError")
+                        raise LLMTimeoutError(
+                            f"LLM stream stalled ({endpoint})" if yielded
+                            else f"LLM call exceeded its {deadline:g}s deadline ({endpoint})"
+                        ) from None
+                    yielded = True
+                    yield chunk
+            except StopAsyncIteration:
+                self._record_outcome(None)
+                return
+            except Exception as e:
+                if yielded or retry == self.max_retries or not is_retryable(e):
+                    self._record_outcome(e)
+                    raise
+                print(f"LLM stream failed before its first chunk ({endpoint}), retrying: {e}")
+                LLM_RETRIES.inc(endpoint=endpoint)
+                await asyncio.sleep(backoff_delay(retry))
+                retry += 1
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            finally:
+                await chunks.aclose()
+
+    # --- Public API ---
+
+    async def generate(self, endpoint: str, model, prompt, **kwargs):
+        """`genai.GenerativeModel.generate_content` without blocking the event loop."""
+        # The SDK's own retries (up to 600s on 503) are replaced by ours
+        kwargs.setdefault("request_options", {"retry": None, "timeout": endpoint_deadline(endpoint)})
+        return await self._call(endpoint, lambda budget: self._generate_once(endpoint, budget, model, prompt, **kwargs))
+
+    async def generate_stream(self, endpoint: str, model, prompt, **kwargs):
+        """Streaming `generate_content`, yielding text as it arrives; the slot is held until the end."""
+        kwargs.setdefault("request_options", {"retry": None, "timeout": endpoint_deadline(endpoint)})
+        async for text in self._call_stream(endpoint, lambda budget: self._generate_stream_once(endpoint, budget, model, prompt, **kwargs)):
+            yield text
+
+    async def invoke(self, endpoint: str, llm, messages, **kwargs):
+        """LangChain chat model `invoke`, awaited natively."""
+        return await self._call(endpoint, lambda budget: self._invoke_once(endpoint, budget, llm, messages, **kwargs))
+
+    async def stream(self, endpoint: str, llm, messages, **kwargs):
+        """LangChain chat model `astream`; the slot is held until the stream ends."""
+        async for chunk in self._call_stream(endpoint, lambda budget: self._stream_once(endpoint, budget, llm, messages, **kwargs)):
+            yield chunk
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "circuit_breaker": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+# Shared executor used by main, agent_service and memory_service
+llm_executor = LLMExecutor()
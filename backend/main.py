@@ -1,17 +1,31 @@
 
 import os
-import google.generativeai as genai
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+import json
+import asyncio
+import hashlib
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
+from contextlib import aclosing, asynccontextmanager, nullcontext
 from dotenv import load_dotenv
-from memory_service import MemoryService
-import asyncio
+from memory_service import MemoryService, DEFAULT_USER_ID
+from llm_service import llm_executor, LLMSaturatedError, LLMTimeoutError, LLMUnavailableError
+from model_registry import model_registry, MODEL_WARMUP
+from metrics import CHAT_STAGE_SECONDS, CHAT_TURNS, MetricsMiddleware, recent_traces, registry as metrics_registry, span
+from resilience import CancelOnDisconnectMiddleware, is_retryable
+from extraction_worker import ExtractionWorker
+from intent_classifier import intent_classifier
+from sentiment_service import score_text, pack_chunks, SENTIMENT_BATCH_CONCURRENCY, SENTIMENT_CONFIDENCE_THRESHOLD
+from response_cache import ResponseCache, CachePolicy, create_cache_backend, normalize_key
+from content_pool import CONTENT_POOLS, ContentPools, PoolSpec
+from single_flight import SingleFlight, prompt_key
+from analytics_service import build_digest, format_qa_pairs
+from firebase_auth import AuthError, AuthUnavailableError, FirebaseTokenVerifier
 
 from pathlib import Path
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage
 import agent_service
 
 # Load environment variables
@@ -40,13 +54,112 @@ if not API_KEY:
 else:
     print(f"✅ API Key loaded successfully (Length: {len(API_KEY)})")
 
-genai.configure(api_key=API_KEY)
+# Authentication: users are identified by their verified Firebase ID token
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID") or os.getenv("VITE_FIREBASE_PROJECT_ID")
+# Requests without an ID token get 401 (default once a project is set); otherwise they share the default user
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "1" if FIREBASE_PROJECT_ID else "0") == "1"
+# Local development and load tests only: take the user id from the unverified X-User-Id header
+TRUST_USER_ID_HEADER = os.getenv("TRUST_USER_ID_HEADER", "0") == "1"
+
+if not FIREBASE_PROJECT_ID:
+    print("⚠️ FIREBASE_PROJECT_ID not set: ID tokens can't be verified and every caller uses the default user")
+if TRUST_USER_ID_HEADER:
+    print("⚠️ TRUST_USER_ID_HEADER=1: X-User-Id is accepted without verification (development only)")
 
-# Models
-MODEL_TEXT = 'gemini-2.0-flash'
+# Clients are built lazily (and warmed up on startup) by the shared model registry
+model_registry.configure(API_KEY)
+
+# Append a personalized LLM follow-up after the pre-rendered crisis resources
+CRISIS_LLM_CONTINUATION = os.getenv("CRISIS_LLM_CONTINUATION", "1") == "1"
 
 # Services
 memory_service = MemoryService()
+token_verifier = FirebaseTokenVerifier(FIREBASE_PROJECT_ID)
+extraction_worker = ExtractionWorker(memory_service)
+
+# Response cache for the generative utility endpoints (TTL in seconds, pool = distinct answers rotated)
+RESPONSE_CACHE_POLICIES = {
+    "journal_prompt": CachePolicy(ttl=6 * 3600, pool_size=12),
+    "daily_insight": CachePolicy(ttl=6 * 3600, pool_size=6),
+    "task_breakdown": CachePolicy(ttl=7 * 86400),
+    "task_insight": CachePolicy(ttl=7 * 86400, pool_size=3),
+    "analyze_thought_pattern": CachePolicy(ttl=86400),
+}
+response_cache = ResponseCache(create_cache_backend(), RESPONSE_CACHE_POLICIES)
+# Identical concurrent LLM calls (e.g. a push notification's burst of /daily-insight) share one upstream call
+single_flight = SingleFlight()
+
+# Pregenerated answers for endpoints whose input is a small vocabulary, refilled in the background
+MOOD_BUCKETS = ("Happy", "Calm", "Neutral", "Sad", "Anxious", "Angry")  # the frontend's MoodType
+CONTENT_POOL_SPECS = {
+    "daily_insight": PoolSpec(
+        "Write short, 1-sentence comforting or motivating insights based on CBT principles. Do not use quotes.",
+        {
+            "general": "anyone, as a mindfulness tip or motivating insight for the day",
+            **{mood.lower(): f"someone who is feeling {mood}" for mood in MOOD_BUCKETS},
+        },
+    ),
+    "journal_prompt": PoolSpec(
+        "Write deep, reflective journaling prompts for mental wellness. Each one is a single question.",
+        {"general": "anyone keeping a wellness journal"},
+    ),
+}
+
+async def generate_pool_batch(pool: str, prompt: str) -> str:
+    response = await llm_executor.generate("content_pool", model_registry.generative(json_mode=True), prompt)
+    return response.text
+
+content_pools = ContentPools(CONTENT_POOL_SPECS, generate_pool_batch)
+
+def mood_bucket(mood: Optional[str]) -> str:
+    """Pool bucket of a mood; moods outside the vocabulary get no bucket and are generated live."""
+    return mood.strip().lower() if mood and mood.strip() else "general"
+
+# Metrics read from the services' own counters at scrape time
+metrics_registry.callback(
+    "serene_response_cache_requests_total", "Response cache lookups by endpoint and result",
+    lambda: {
+        **{(e, "hit"): n for e, n in response_cache.hits.items()},
+        **{(e, "miss"): n for e, n in response_cache.misses.items()},
+    },
+    ("endpoint", "result"), type="counter")
+metrics_registry.callback(
+    "serene_single_flight_requests_total", "LLM requests that started an upstream call or joined one in flight",
+    lambda: {
+        **{(e, "upstream"): n for e, n in single_flight.leaders.items()},
+        **{(e, "coalesced"): n for e, n in single_flight.joined.items()},
+    },
+    ("endpoint", "result"), type="counter")
+metrics_registry.callback(
+    "serene_content_pool_requests_total", "Requests answered from a content pool or generated live",
+    lambda: {
+        **{(p, "served"): n for p, n in content_pools.served.items()},
+        **{(p, "miss"): n for p, n in content_pools.misses.items()},
+    },
+    ("pool", "result"), type="counter")
+metrics_registry.callback(
+    "serene_content_pool_entries", "Entries held per content pool bucket",
+    content_pools.sizes, ("pool", "bucket"))
+metrics_registry.callback(
+    "serene_extraction_queue", "Memory extraction backlog",
+    lambda: {(k,): extraction_worker.stats()[k] for k in ("queue_depth", "pending_conversations", "inflight_batches")},
+    ("state",))
+metrics_registry.callback(
+    "serene_extraction_lag_seconds", "Age of the oldest conversation waiting for memory extraction",
+    lambda: extraction_worker.stats()["oldest_pending_seconds"])
+metrics_registry.callback(
+    "serene_llm_slots", "LLM calls in flight and waiting for a slot",
+    lambda: {("in_flight",): llm_executor.in_flight, ("waiting",): llm_executor.waiting}, ("state",))
+metrics_registry.callback(
+    "serene_llm_circuit_open", "1 while the LLM circuit breaker rejects calls",
+    lambda: 0.0 if llm_executor.breaker.state == "closed" else 1.0)
+
+# Served by the cached utility endpoints when Gemini fails and nothing is cached yet
+LOCAL_FALLBACKS = {
+    "daily_insight": "Be gentle with yourself today; small steps still count.",
+    "journal_prompt": "What is something you have been carrying lately that you would like to set down?",
+    "task_insight": "Well done. Finishing a task, however small, clears a little mental space and builds momentum.",
+}
 
 # System Instruction (Replicated from frontend)
 SYSTEM_INSTRUCTION_BASE = """You are Serene, a highly trained, compassionate, and empathetic mental wellness companion. 
@@ -96,7 +209,34 @@ create_task_tool = {
     ]
 }
 
-app = FastAPI()
+# Agent graph with server-side sessions, compiled at startup once the checkpointer is open
+session_graph = None
+# Background model warmup started on startup (None when MODEL_WARMUP is off)
+warmup_task = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global session_graph, warmup_task
+    async with agent_service.open_checkpointer() as checkpointer:
+        session_graph = agent_service.compile_session_graph(checkpointer)
+        extraction_worker.start()
+        if MODEL_WARMUP:
+            # Runs in the background so the server accepts connections (and answers /) right away
+            warmup_task = asyncio.create_task(model_registry.warmup())
+        if CONTENT_POOLS:
+            content_pools.start()
+        yield
+        if warmup_task is not None:
+            warmup_task.cancel()
+        await content_pools.stop()
+        # Flush pending memory extraction before shutting down
+        await extraction_worker.stop()
+        await agent_service.wait_for_summaries()
+
+app = FastAPI(lifespan=lifespan)
+# Inside the metrics middleware, so requests abandoned by the client are still recorded
+app.add_middleware(CancelOnDisconnectMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # CORS Configuration
 app.add_middleware(
@@ -113,8 +253,13 @@ class ChatMessage(BaseModel):
     parts: List[dict]
 
 class ChatRequest(BaseModel):
-    messages: List[ChatMessage]
+    # Either the full client-side history (stateless), or a conversation_id plus only the new message
+    messages: Optional[List[ChatMessage]] = None
+    message: Optional[str] = None
     user_context: Optional[str] = ""
+    conversation_id: Optional[str] = None
+    # Append the turn's analysis (sentiment, risk, distortions) as a trailing frame after the reply
+    include_analysis: bool = False
 
 class TaskGenRequest(BaseModel):
     task_title: str
@@ -122,83 +267,388 @@ class TaskGenRequest(BaseModel):
 class SentimentRequest(BaseModel):
     text: str
 
+class BatchSentimentRequest(BaseModel):
+    texts: List[str] = Field(..., max_length=2000)
+
+def llm_http_error(e: Exception) -> HTTPException:
+    """
+    Maps failures of an LLM-backed endpoint to an HTTP error: 429 when saturated, 503 while the
+    upstream is failing or the circuit breaker is open, 504 past the deadline. Details are logged, not returned.
+    """
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, LLMSaturatedError):
+        return HTTPException(status_code=429, detail=str(e))
+    print(f"LLM request failed: {type(e).__name__}: {e}")
+    if isinstance(e, LLMUnavailableError):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    if isinstance(e, LLMTimeoutError):
+        return HTTPException(status_code=504, detail="The AI service took too long to answer, please retry")
+    if is_retryable(e):
+        return HTTPException(status_code=503, detail="The AI service is temporarily unavailable, please retry")
+    return HTTPException(status_code=500, detail="The AI service could not complete this request")
+
+async def get_user_id(authorization: Optional[str] = Header(default=None),
+                      x_user_id: Optional[str] = Header(default=None)) -> str:
+    """
+    The caller's user id: the uid of the Firebase ID token sent as `Authorization: Bearer`,
+    verified here. X-User-Id is only honoured with TRUST_USER_ID_HEADER (local development,
+    load tests); callers without a token share the default user unless AUTH_REQUIRED.
+    """
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        try:
+            if scheme.lower() != "bearer" or not token.strip():
+                raise AuthError("Expected 'Authorization: Bearer <Firebase ID token>'")
+            return await token_verifier.verify(token.strip())
+        except AuthError as e:
+            raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+        except AuthUnavailableError as e:
+            print(f"ID token verification unavailable: {e.__cause__}")
+            raise HTTPException(status_code=503, detail=str(e))
+    if TRUST_USER_ID_HEADER and x_user_id:
+        return x_user_id
+    if AUTH_REQUIRED:
+        raise HTTPException(status_code=401, detail="Sign in required", headers={"WWW-Authenticate": "Bearer"})
+    return DEFAULT_USER_ID
+
+async def coalesced_generate(endpoint: str, model, prompt: str, key: Optional[str] = None) -> str:
+    """Text of an LLM call, shared with identical requests already in flight."""
+    async def generate():
+        response = await llm_executor.generate(endpoint, model, prompt)
+        return response.text
+    return await single_flight.do(endpoint, key or prompt_key(endpoint, prompt), generate)
+
+async def cached_generate(endpoint: str, key_parts: tuple, prompt: str, model=None) -> str:
+    """Answers a prompt from the response cache, calling the LLM only on a miss."""
+    async def generate():
+        # Concurrent misses for the same key wait on one call instead of each calling Gemini
+        return await coalesced_generate(endpoint, model or model_registry.generative(), prompt,
+                                        key=normalize_key(endpoint, *key_parts))
+    try:
+        return await response_cache.get_or_generate(endpoint, key_parts, generate)
+    except Exception as e:
+        if endpoint not in LOCAL_FALLBACKS:
+            raise
+        print(f"Serving local fallback for {endpoint}: {e}")
+        return LOCAL_FALLBACKS[endpoint]
+
 # Endpoints
 
 @app.get("/")
 def read_root():
     return {"status": "Serene Backend Online"}
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 503 until the session store is open, model warmup and the first content pool fill have finished."""
+    checks = {
+        "session_store": session_graph is not None,
+        "model_warmup": warmup_task is None or warmup_task.done(),
+        # Pools loaded from disk or filled once, so the pooled endpoints don't start on the slow live path
+        "content_pools": not CONTENT_POOLS or content_pools.primed,
+    }
+    ready = all(checks.values())
+    body = {"ready": ready, "checks": checks, "models": model_registry.stats()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+# Starts the trailing metadata frame of a /chat reply (ASCII record separator, never in model text)
+ANALYSIS_FRAME_SEPARATOR = "\x1e"
+# Seconds between SSE keep-alive comments while a reply is being generated
+CHAT_SSE_HEARTBEAT = float(os.getenv("CHAT_SSE_HEARTBEAT", "10"))
+
+def analysis_frame(analysis: dict) -> str:
+    """Trailing frame after the reply text: separator, one JSON object, newline."""
+    return ANALYSIS_FRAME_SEPARATOR + json.dumps({"analysis": analysis}) + "\n"
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def crisis_stream(user_message_text: str):
+    """Pre-rendered safety response first, then an optional personalized continuation."""
+    yield agent_service.CRISIS_SAFETY_MESSAGE
+    if not CRISIS_LLM_CONTINUATION:
+        return
+    try:
+        async with aclosing(agent_service.stream_crisis_continuation(user_message_text)) as continuation:
+            async for text in continuation:
+                yield text
+    except Exception as e:
+        # The resources are already delivered; a failed follow-up must not break the reply
+        print(f"Crisis continuation failed: {e}")
+
+def session_config(user_id: str, conversation_id: str) -> dict:
+    # Threads are namespaced by user so one user can never resume another's conversation
+    return {"configurable": {"thread_id": f"{user_id}:{conversation_id}"}}
+
+class ChatTurn:
+    """
+    One /chat turn, prepared on the request path and streamed by a transport as ("token", text)
+    and ("analysis", dict) events. Follow-up work (memory extraction, session summary) only runs
+    from finish(), once the client has received the whole reply: a client that disconnects
+    cancels the stream, the LLM call behind it and the follow-up together.
+    """
+
+    def __init__(self, user_id: str, request: ChatRequest, user_message_text: str,
+                 graph=None, config: Optional[dict] = None, graph_input: Optional[dict] = None,
+                 crisis: bool = False):
+        self.user_id = user_id
+        self.request = request
+        self.user_message_text = user_message_text
+        self.graph = graph
+        self.config = config
+        self.graph_input = graph_input
+        self.crisis = crisis  # fast path: pre-rendered resources, the graph never runs
+        self.reply = ""
+        self.failed = False
+        self.finished = False
+
+    async def events(self):
+        if self.crisis:
+            try:
+                async with aclosing(crisis_stream(self.user_message_text)) as stream:
+                    async for text in stream:
+                        self.reply += text
+                        yield "token", text
+            finally:
+                if self.config is not None:
+                    # Kept in the session even if the client left mid-reply: the resources went out first
+                    agent_service.schedule_crisis_turn_save(self.graph, self.config, self.user_message_text, self.reply)
+            if self.request.include_analysis:
+                yield "analysis", agent_service.analyze_message(self.user_message_text)
+            return
+
+        analysis = {}
+        # A session takes one turn at a time, so concurrent writes can't fork its checkpoint
+        lock = agent_service.session_lock(self.config) if self.config is not None else nullcontext()
+        try:
+            with span("graph", CHAT_STAGE_SECONDS, stage="graph"):
+                # Reply tokens arrive as "messages"; the analysis branches report through "updates"
+                stream = self.graph.astream(self.graph_input, self.config, stream_mode=["messages", "updates"])
+                async with lock, aclosing(stream):
+                    async for mode, payload in stream:
+                        if mode == "updates":
+                            for node, update in payload.items():
+                                if node in agent_service.ANALYSIS_NODES and isinstance(update, dict):
+                                    analysis = agent_service.merge_analysis(analysis, update.get("analysis"))
+                            continue
+                        chunk, metadata = payload
+                        if metadata.get("langgraph_node") not in agent_service.REPLY_NODES:
+                            continue
+                        text = agent_service.chunk_text(chunk)
+                        if text:
+                            self.reply += text
+                            yield "token", text
+        except Exception as e:
+            print(f"Error while streaming chat response: {e}")
+            self.failed = True
+            if not self.reply:
+                yield "token", agent_service.CHAT_FALLBACK_MESSAGE
+            analysis = analysis or agent_service.analyze_message(self.user_message_text)
+        if self.request.include_analysis:
+            yield "analysis", analysis
+
+    def finish(self):
+        """Follow-up work for a reply the client received in full."""
+        self.finished = True
+        if self.crisis or self.failed:
+            return
+        # Queue this exchange for (coalesced, batched) memory extraction
+        with span("extraction_enqueue", CHAT_STAGE_SECONDS, stage="extraction_enqueue"):
+            extraction_worker.submit(self.user_id, self.request.conversation_id or "default", [
+                {"role": "user", "parts": [{"text": self.user_message_text}]},
+                {"role": "model", "parts": [{"text": self.reply}]},
+            ])
+        if self.config is not None:
+            # Fold turns that left the verbatim window into the session's rolling summary
+            agent_service.schedule_summary_update(self.graph, self.config)
+
+    def record(self, transport: str):
+        if self.failed:
+            outcome = "fallback"
+        else:
+            outcome = "completed" if self.finished else "disconnected"
+        CHAT_TURNS.inc(transport=transport, outcome=outcome)
+
+async def run_turn(turn: ChatTurn, heartbeat: Optional[float] = None):
+    """
+    Drives the turn in its own task and yields its events, then ("done", None); a failure is
+    yielded as ("error", e), and ("keep-alive", None) after `heartbeat` idle seconds. Closing
+    this generator (a client disconnect) cancels the task, which stops the graph and its LLM
+    call mid-reply; closing the graph's stream alone leaves its node task running.
+    """
+    events: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    async def produce():
+        try:
+            async with aclosing(turn.events()) as stream:
+                async for item in stream:
+                    await events.put(item)
+            await events.put(("done", None))
+        except Exception as e:
+            await events.put(("error", e))
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(events.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield "keep-alive", None
+                continue
+            yield item
+            if item[0] in ("done", "error"):
+                return
+    finally:
+        producer.cancel()
+
+async def plain_text_stream(turn: ChatTurn):
+    """Reply text as it is generated, then the optional analysis frame."""
+    try:
+        async with aclosing(run_turn(turn)) as events:
+            async for event, data in events:
+                if event == "token":
+                    yield data
+                elif event == "analysis":
+                    yield analysis_frame(data)
+                elif event == "error":
+                    raise data
+        turn.finish()
+    finally:
+        turn.record("text")
+
+async def sse_stream(turn: ChatTurn):
+    """
+    Server-sent events: `token` ({"text"}), `analysis` and a final `done` ({"fallback"}), so the
+    client can tell a complete reply from a cut-off one. Keep-alive comments go out while the
+    model is thinking, which stops proxies from closing the idle stream and surfaces a dead
+    connection on write instead of after the whole reply was generated.
+    """
+    try:
+        async with aclosing(run_turn(turn, CHAT_SSE_HEARTBEAT)) as events:
+            async for event, data in events:
+                if event == "keep-alive":
+                    yield ": keep-alive\n\n"
+                elif event == "token":
+                    yield sse_event("token", {"text": data})
+                elif event == "analysis":
+                    yield sse_event("analysis", data)
+                elif event == "error":
+                    print(f"Error in chat event stream: {data}")
+                    turn.failed = True
+                    yield sse_event("error", {"detail": "The reply could not be completed"})
+                    return
+                else:
+                    yield sse_event("done", {"fallback": turn.failed})
+        turn.finish()
+    finally:
+        turn.record("sse")
+
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
+async def chat_endpoint(request: ChatRequest, http_request: Request, user_id: str = Depends(get_user_id)):
+    """
+    Streams the reply as text/plain, or as server-sent events when the client sends
+    `Accept: text/event-stream`.
+    """
     try:
-        # 1. Get Memory Context
-        memory_context = memory_service.get_context()
-        
-        # 2. Add User Message
-        user_message_text = request.messages[-1].parts[0]['text']
-        
-        # 3. Invoke Agent Graph
-        # We construct the initial state
-        initial_history_langchain = []
-        for msg in request.messages[:-1]:
-            if msg.role == 'user':
-                initial_history_langchain.append(HumanMessage(content=msg.parts[0]['text']))
+        # 1. Add User Message
+        if request.message is not None:
+            user_message_text = request.message
+        elif request.messages:
+            user_message_text = request.messages[-1].parts[0]['text']
+        else:
+            raise HTTPException(status_code=422, detail="Provide 'message' or 'messages'")
+
+        # Crisis fast path: classify first and put safety resources in the first bytes,
+        # skipping memory lookup, history assembly and memory extraction entirely
+        with span("classify", CHAT_STAGE_SECONDS, stage="classify"):
+            is_crisis = intent_classifier.classify(user_message_text).has("crisis")
+        if is_crisis:
+            if request.conversation_id:
+                # The exchange still goes into the session's history (and sets its phase)
+                turn = ChatTurn(user_id, request, user_message_text, session_graph,
+                                session_config(user_id, request.conversation_id), crisis=True)
             else:
-                initial_history_langchain.append(AIMessage(content=msg.parts[0]['text']))
-        
-        # Inject Memory into System Prompt (Implicitly, via graph nodes, or we prepend here)
-        # For this version, we prepend a System Message to history so all nodes see it
-        initial_history_langchain.insert(0, SystemMessage(content=f"Context from Memory:\n{memory_context}"))
-        
-        # Add current message
-        initial_history_langchain.append(HumanMessage(content=user_message_text))
-        
-        initial_state = {
-            "messages": initial_history_langchain,
-            "current_phase": "start",
-            "sentiment_score": 0.0
-        }
-        
-        # Run Graph (Synchronous for now, or we can use astream for tokens if graph supports it)
-        # Simple invoke for v1
-        result = agent_service.agent_graph.invoke(initial_state)
-        ai_response_text = result['messages'][-1].content
-        
-        # 4. Stream Response (Fake streaming for frontend compatibility/UX)
-        async def stream_generator():
-            chunk_size = 10
-            for i in range(0, len(ai_response_text), chunk_size):
-                yield ai_response_text[i:i+chunk_size]
-                await asyncio.sleep(0.01) # fast typing
-            
-            # Extract Memories
-            combined_history = request.messages[:-1] + [
-                ChatMessage(role='user', parts=[{'text': user_message_text}]).model_dump(),
-                ChatMessage(role='model', parts=[{'text': ai_response_text}]).model_dump() 
-            ]
-            # Background task needs dicts, we constructed manually above or:
-            # Reconstruct for background task
-            bg_history = []
-            for m in request.messages[:-1]:
-                bg_history.append({"role": m.role, "parts": [{"text": m.parts[0]['text']}]})
-            bg_history.append({"role": "user", "parts": [{"text": user_message_text}]})
-            bg_history.append({"role": "model", "parts": [{"text": ai_response_text}]})
-            
-            background_tasks.add_task(memory_service.extract_memories, bg_history)
-
-        return StreamingResponse(stream_generator(), media_type="text/plain")
-
+                turn = ChatTurn(user_id, request, user_message_text, crisis=True)
+        else:
+            # Reject before doing any work when the LLM layer is saturated
+            llm_executor.check_admission("chat")
+
+            # 2. Get Memory Context (only the memories relevant to this message)
+            with span("memory_context", CHAT_STAGE_SECONDS, stage="memory_context"):
+                # Off the loop: the shard may catch up with other workers' writes first
+                memory_context = await asyncio.to_thread(memory_service.get_context, user_id, user_message_text)
+
+            # 3. Invoke Agent Graph
+            with span("history", CHAT_STAGE_SECONDS, stage="history"):
+                if request.conversation_id:
+                    # Server-side session: the checkpointer holds history and current_phase,
+                    # so only the new message goes in
+                    graph = session_graph
+                    config = session_config(user_id, request.conversation_id)
+                    graph_input = {
+                        "messages": [HumanMessage(content=user_message_text)],
+                        "memory_context": memory_context,
+                    }
+                else:
+                    # Stateless: rebuild the history the client sent
+                    graph = agent_service.get_agent_graph()
+                    config = None
+                    history = []
+                    for msg in (request.messages or [])[:-1]:
+                        if msg.role == 'user':
+                            history.append(HumanMessage(content=msg.parts[0]['text']))
+                        else:
+                            history.append(AIMessage(content=msg.parts[0]['text']))
+                    history.append(HumanMessage(content=user_message_text))
+                    graph_input = {
+                        "messages": history,
+                        "current_phase": "start",
+                        "sentiment_score": 0.0,
+                        "memory_context": memory_context,
+                    }
+            turn = ChatTurn(user_id, request, user_message_text, graph, config, graph_input)
+
+        # 4. Stream Response: forward reply tokens as the model produces them
+        if "text/event-stream" in http_request.headers.get("accept", ""):
+            return StreamingResponse(
+                sse_stream(turn), media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+        return StreamingResponse(plain_text_stream(turn), media_type="text/plain")
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise llm_http_error(e)
+
+@app.get("/chat/sessions/{conversation_id}")
+async def get_chat_session(conversation_id: str, user_id: str = Depends(get_user_id)):
+    """Phase, rolling summary and recent history of a server-side conversation session."""
+    snapshot = await session_graph.aget_state(session_config(user_id, conversation_id))
+    values = snapshot.values or {}
+    # Messages folded into the summary are pruned from the session, so only later ones are listed
+    return {
+        "conversation_id": conversation_id,
+        "current_phase": values.get("current_phase", "start"),
+        "summary": values.get("summary", ""),
+        "messages": [
+            {"role": "user" if m.type == "human" else "model", "parts": [{"text": agent_service.chunk_text(m)}]}
+            for m in values.get("messages", [])[values.get("summarized_count", 0):]
+        ],
+    }
 
 @app.post("/analyze-sentiment")
 async def analyze_sentiment(request: SentimentRequest):
     try:
-        model = genai.GenerativeModel(
-            model_name=MODEL_TEXT,
-            generation_config={"response_mime_type": "application/json"}
-        )
+        # Tier 1: local lexicon scorer; only unclear texts go to Gemini
+        local = score_text(request.text)
+        if local["confidence"] >= SENTIMENT_CONFIDENCE_THRESHOLD:
+            result = {"score": local["score"], "label": local["label"], "emotions": local["emotions"]}
+            return {"result": json.dumps(result), "source": "local"} # Frontend parses JSON
+
+        model = model_registry.generative(json_mode=True)
         
         prompt = f"""
         Analyze the sentiment of this text: "{request.text}"
@@ -208,20 +658,95 @@ async def analyze_sentiment(request: SentimentRequest):
         - emotions: list of strings (e.g., "Anxious", "Hopeful")
         """
         
-        response = model.generate_content(prompt)
-        return {"result": response.text} # Frontend parses JSON
+        try:
+            text = await coalesced_generate("analyze_sentiment", model, prompt)
+        except Exception as e:
+            # Gemini unavailable: the local score is a usable answer
+            print(f"Sentiment LLM tier failed, using local score: {e}")
+            return {"result": json.dumps(local_sentiment_result(local)), "source": "local"}
+        return {"result": text, "source": "llm"} # Frontend parses JSON
+    except Exception as e:
+        raise llm_http_error(e)
+
+def local_sentiment_result(scored: dict) -> dict:
+    return {"score": scored["score"], "label": scored["label"], "emotions": scored["emotions"]}
+
+async def analyze_sentiment_chunk(chunk: List[tuple], local: dict) -> List[dict]:
+    """Scores one packed chunk of texts with a single LLM call; unanswered texts keep their local score."""
+    model = model_registry.generative(json_mode=True)
+    prompt = f"""
+    Analyze the sentiment of each text in this JSON array: {json.dumps([{"i": i, "text": t} for i, t in chunk])}
+    Return a JSON array with one object per text:
+    - i: the text's "i" value
+    - score: number from -1.0 (negative) to 1.0 (positive)
+    - label: "Positive", "Neutral", or "Negative"
+    - emotions: list of strings (e.g., "Anxious", "Hopeful")
+    """
+    answered = {}
+    try:
+        response = await llm_executor.generate("analyze_sentiment_batch", model, prompt)
+        for item in json.loads(response.text):
+            if isinstance(item, dict) and item.get("i") in local:
+                answered[item["i"]] = {
+                    "score": item.get("score", 0.0),
+                    "label": item.get("label", "Neutral"),
+                    "emotions": item.get("emotions", []),
+                }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"Batch sentiment chunk failed, using local scores: {e}")
+    results = []
+    for i, _text in chunk:
+        if i in answered:
+            results.append({"index": i, "result": answered[i], "source": "llm"})
+        else:
+            results.append({"index": i, "result": local_sentiment_result(local[i]), "source": "local"})
+    return results
+
+@app.post("/analyze-sentiment/batch")
+async def analyze_sentiment_batch(request: BatchSentimentRequest):
+    """
+    Scores many texts, streaming NDJSON lines ({index, result, source}) as they complete. At most
+    SENTIMENT_BATCH_CONCURRENCY chunks of a request wait on the LLM at once.
+    """
+    local = {i: score_text(text) for i, text in enumerate(request.texts)}
+    unsure = [(i, text) for i, text in enumerate(request.texts) if local[i]["confidence"] < SENTIMENT_CONFIDENCE_THRESHOLD]
+    unsure_ids = {i for i, _text in unsure}
+    if unsure:
+        try:
+            # Reject before streaming anything when the LLM layer is saturated
+            llm_executor.check_admission("analyze_sentiment_batch")
+        except Exception as e:
+            raise llm_http_error(e)
+    chunk_slots = asyncio.Semaphore(SENTIMENT_BATCH_CONCURRENCY)
+
+    async def analyze_chunk(chunk: List[tuple]) -> List[dict]:
+        async with chunk_slots:
+            return await analyze_sentiment_chunk(chunk, local)
+
+    async def stream_results():
+        # Confident local results go out first, before any LLM round-trip
+        for i in range(len(request.texts)):
+            if i not in unsure_ids:
+                yield json.dumps({"index": i, "result": local_sentiment_result(local[i]), "source": "local"}) + "\n"
+        tasks = [asyncio.create_task(analyze_chunk(chunk)) for chunk in pack_chunks(unsure)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                for line in await finished:
+                    yield json.dumps(line) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
 @app.post("/generate-task-breakdown")
 async def generate_task_breakdown(request: TaskGenRequest):
     try:
-        model = genai.GenerativeModel(model_name=MODEL_TEXT)
         prompt = f"Provide a brief, 3-step actionable breakdown for the task: '{request.task_title}'. Keep it encouraging."
-        response = model.generate_content(prompt)
-        return {"description": response.text}
+        text = await cached_generate("task_breakdown", (request.task_title,), prompt)
+        return {"description": text}
     except Exception as e:
-         raise HTTPException(status_code=500, detail=str(e))
+         raise llm_http_error(e)
 
 class InsightRequest(BaseModel):
     recent_mood: Optional[str] = None
@@ -229,21 +754,24 @@ class InsightRequest(BaseModel):
 @app.post("/daily-insight")
 async def daily_insight(request: InsightRequest):
     try:
-        model = genai.GenerativeModel(model_name=MODEL_TEXT)
-        prompt = f"The user is feeling {request.recent_mood}. Generate a short, 1-sentence comforting or motivating insight based on CBT principles. Do not use quotes." if request.recent_mood else "Generate a short, 1-sentence mindfulness tip or motivating insight for the day. Do not use quotes."
-        response = model.generate_content(prompt)
-        return {"text": response.text}
+        text = content_pools.take("daily_insight", mood_bucket(request.recent_mood)) if CONTENT_POOLS else None
+        if text is None:
+            # Pool empty (or a mood outside the vocabulary): generate on the request path
+            prompt = f"The user is feeling {request.recent_mood}. Generate a short, 1-sentence comforting or motivating insight based on CBT principles. Do not use quotes." if request.recent_mood else "Generate a short, 1-sentence mindfulness tip or motivating insight for the day. Do not use quotes."
+            text = await cached_generate("daily_insight", (request.recent_mood,), prompt)
+        return {"text": text}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise llm_http_error(e)
 
 @app.post("/journal-prompt")
 async def journal_prompt():
     try:
-        model = genai.GenerativeModel(model_name=MODEL_TEXT)
-        response = model.generate_content("Generate a single, deep, and reflective journaling prompt for mental wellness. It should be a question. Return ONLY the question.")
-        return {"text": response.text}
+        text = content_pools.take("journal_prompt", "general") if CONTENT_POOLS else None
+        if text is None:
+            text = await cached_generate("journal_prompt", (), "Generate a single, deep, and reflective journaling prompt for mental wellness. It should be a question. Return ONLY the question.")
+        return {"text": text}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise llm_http_error(e)
 
 class TaskInsightRequest(BaseModel):
     task_title: str
@@ -252,85 +780,129 @@ class TaskInsightRequest(BaseModel):
 @app.post("/task-insight")
 async def task_insight(request: TaskInsightRequest):
     try:
-        model = genai.GenerativeModel(model_name=MODEL_TEXT)
         prompt = f"""The user just completed the task: "{request.task_title}" in the category "{request.task_category}".
         Generate a short, encouraging message (max 2 sentences).
         1. Briefly explain why completing this type of task is good for mental clarity or wellbeing.
         2. Congratulate them warmly."""
-        response = model.generate_content(prompt)
-        return {"text": response.text}
+        text = await cached_generate("task_insight", (request.task_title, request.task_category), prompt)
+        return {"text": text}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise llm_http_error(e)
+
+# --- Reports ---
+# Prompts carry a fixed-size NumPy digest of the history (analytics_service) instead of the raw
+# lists, so their size stays about the same however long the user has been logging.
+
+async def history_digest(request) -> str:
+    # Long histories take a moment to aggregate; keep that off the event loop
+    return await asyncio.to_thread(build_digest, request.mood_history, request.journal_history, request.tasks)
+
+# Ends a streamed report that failed after its first bytes went out (the 200 status is already sent)
+REPORT_ERROR_FRAME = ANALYSIS_FRAME_SEPARATOR + json.dumps({"error": "The report could not be completed"}) + "\n"
+
+async def report_response(endpoint: str, model, prompt: str, media_type: str) -> StreamingResponse:
+    """
+    Streams a report's text as Gemini produces it; identical requests share the stream, late ones
+    replay it. The first chunk is awaited before answering, so saturation, an open circuit breaker
+    or an upstream failure still gets its error status; a failure after that ends the body with
+    REPORT_ERROR_FRAME, which the client checks for.
+    """
+    llm_executor.check_admission(endpoint)
+    stream = single_flight.stream(endpoint, prompt_key(endpoint, prompt),
+                                  lambda: llm_executor.generate_stream(endpoint, model, prompt))
+    try:
+        first = await anext(stream, "")
+    except BaseException:
+        await stream.aclose()
+        raise
+    return StreamingResponse(report_stream(endpoint, first, stream), media_type=media_type)
+
+async def report_stream(endpoint: str, first: str, stream):
+    try:
+        async with aclosing(stream):
+            yield first
+            async for text in stream:
+                yield text
+    except Exception as e:
+        print(f"Error while streaming {endpoint}: {e}")
+        yield REPORT_ERROR_FRAME
 
 class ClinicalSummaryRequest(BaseModel):
     mood_history: list
     journal_history: list
     tasks: list
     user_name: str
+    stream: bool = False
 
 @app.post("/clinical-summary")
 async def clinical_summary(request: ClinicalSummaryRequest):
     try:
-        model = genai.GenerativeModel(model_name=MODEL_TEXT)
+        model = model_registry.generative()
+        digest = await history_digest(request)
         context = f"""
         Patient Name: {request.user_name}
-        Data Provided:
-        - Recent Mood Logs: {request.mood_history}
-        - Recent Journal Snippets: {request.journal_history}
-        - Functional Status (Tasks): {request.tasks}
+        Data Summary (computed from the full history):
+{digest}
         
         Task: Act as a Clinical Assistant. Write a professional, concise summary report for a psychologist/therapist.
         """
-        response = model.generate_content(context)
-        return {"text": response.text}
+        if request.stream:
+            return await report_response("clinical_summary", model, context, "text/plain")
+        text = await coalesced_generate("clinical_summary", model, context)
+        return {"text": text}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise llm_http_error(e)
 
 class AssessmentQuestionsRequest(BaseModel):
     mood_history: list
     journal_history: list
     tasks: list
+    stream: bool = False
 
 @app.post("/assessment-questions")
 async def assessment_questions(request: AssessmentQuestionsRequest):
     try:
-        model = genai.GenerativeModel(model_name=MODEL_TEXT, generation_config={"response_mime_type": "application/json"})
+        model = model_registry.generative(json_mode=True)
+        digest = await history_digest(request)
         context = f"""
-        User Data:
-        - Recent Moods: {request.mood_history}
-        - Recent Journals: {request.journal_history}
-        - Pending Tasks: {len([t for t in request.tasks if not t.get('completed', False)])}
+        User Data Summary:
+{digest}
         
         Generate 3 specific, empathetic, and short open-ended questions to help the user reflect on their mental state.
         Return строго JSON array of strings."""
-        response = model.generate_content(context)
-        return {"questions": response.text} # Frontend parses JSON
+        if request.stream:
+            return await report_response("assessment_questions", model, context, "application/json")
+        text = await coalesced_generate("assessment_questions", model, context)
+        return {"questions": text} # Frontend parses JSON
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise llm_http_error(e)
 
 class WellnessAssessmentRequest(BaseModel):
     mood_history: list
     journal_history: list
     tasks: list
     qa_pairs: list
+    stream: bool = False
 
 @app.post("/wellness-assessment")
 async def wellness_assessment(request: WellnessAssessmentRequest):
     try:
-        model = genai.GenerativeModel(model_name=MODEL_TEXT, generation_config={"response_mime_type": "application/json"})
+        model = model_registry.generative(json_mode=True)
+        digest = await history_digest(request)
         context = f"""
         User Data Analysis:
-        - Moods: {request.mood_history}
-        - Journals: {request.journal_history}
-        - Tasks: {request.tasks}
-        - Self-Reflection: {request.qa_pairs}
+{digest}
+        Self-Reflection:
+{format_qa_pairs(request.qa_pairs)}
         
         Provide a compassionate, psychological self-assessment report in JSON with: currentVibe, emotionalPatterns, keyInsights, recommendations.
         """
-        response = model.generate_content(context)
-        return {"result": response.text}
+        if request.stream:
+            return await report_response("wellness_assessment", model, context, "application/json")
+        text = await coalesced_generate("wellness_assessment", model, context)
+        return {"result": text}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise llm_http_error(e)
 
 class ThoughtPatternRequest(BaseModel):
     thought: str
@@ -338,28 +910,96 @@ class ThoughtPatternRequest(BaseModel):
 @app.post("/analyze-thought-pattern")
 async def analyze_thought_pattern(request: ThoughtPatternRequest):
     try:
-        model = genai.GenerativeModel(model_name=MODEL_TEXT, generation_config={"response_mime_type": "application/json"})
         prompt = f"""Analyze this negative thought based on CBT principles: "{request.thought}".
         Return JSON with: distortion, explanation, reframe.
         """
-        response = model.generate_content(prompt)
-        return {"result": response.text}
+        text = await cached_generate("analyze_thought_pattern", (request.thought,), prompt, model=model_registry.generative(json_mode=True))
+        return {"result": text}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise llm_http_error(e)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+async def traces(limit: int = 50):
+    """Most recent sampled request traces (see TRACE_SAMPLE_RATE)."""
+    return {"traces": list(recent_traces)[-limit:][::-1]}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the response cache, the single-flight coalescing and the content pools."""
+    return {**response_cache.stats(), "single_flight": single_flight.stats(), "content_pools": content_pools.stats()}
 
 # --- Memory Management Endpoints ---
 
+# Largest page GET /memories?limit= returns
+MEMORIES_PAGE_MAX = 500
+
+def memories_etag(user_id: str, version: int) -> str:
+    """Versions count per user, so the tag names the user too: one user's tag never validates another's list."""
+    user_tag = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:16]
+    return f'"m{user_tag}-{version}"'
+
 @app.get("/memories")
-async def get_memories():
-    """Fetch all memories."""
-    return {"memories": memory_service.get_all()}
+async def get_memories(user_id: str = Depends(get_user_id), limit: Optional[int] = Query(None, ge=1, le=MEMORIES_PAGE_MAX),
+                       cursor: Optional[str] = None, if_none_match: Optional[str] = Header(default=None)):
+    """
+    Memories of the calling user: all of them, or `limit` at a time (pass `next_cursor` back as
+    `cursor` for the next page). The ETag is the user's memory version (tagged with the user), so a
+    client revalidating an unchanged list with If-None-Match gets a bodiless 304.
+    """
+    # Vary: a browser signed in as another user must not be served this user's cached list
+    headers = {"ETag": memories_etag(user_id, await asyncio.to_thread(memory_service.version, user_id)),
+               "Cache-Control": "private, no-cache", "Vary": "Authorization, X-User-Id"}
+    if if_none_match and (if_none_match.strip() == "*" or headers["ETag"] in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    if limit is None and cursor is None:
+        version, memories = await asyncio.to_thread(memory_service.get_all_versioned, user_id)
+        next_cursor = None
+    else:
+        try:
+            after = int(cursor) if cursor else 0
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        version, memories, next_after = await asyncio.to_thread(
+            memory_service.page, user_id, after, limit or MEMORIES_PAGE_MAX
+        )
+        next_cursor = str(next_after) if next_after is not None else None
+    # The list may have changed since the version check above
+    headers["ETag"] = memories_etag(user_id, version)
+    return JSONResponse({"memories": memories, "version": version, "next_cursor": next_cursor}, headers=headers)
+
+@app.get("/memories/changes")
+async def get_memory_changes(since: int = Query(..., ge=0), user_id: str = Depends(get_user_id)):
+    """
+    Memories added and ids deleted after version `since` (the `version` of an earlier response).
+    `reset: true` means the changes can't be reconstructed that far back: fetch /memories again.
+    """
+    changes = await asyncio.to_thread(memory_service.changes, user_id, since)
+    if changes is None:
+        return {"version": await asyncio.to_thread(memory_service.version, user_id), "reset": True, "added": [], "deleted": []}
+    version, added, deleted = changes
+    return {"version": version, "reset": False, "added": added, "deleted": deleted}
+
+@app.get("/memories/extraction-stats")
+async def memory_extraction_stats():
+    """Queue depth and lag of the background memory extraction worker."""
+    return extraction_worker.stats()
 
 @app.delete("/memories/{memory_id}")
-async def delete_memory(memory_id: str):
-    """Delete a specific memory."""
-    success = memory_service.delete(memory_id)
+async def delete_memory(memory_id: str, user_id: str = Depends(get_user_id)):
+    """Delete a specific memory of the calling user."""
+    success = await asyncio.to_thread(memory_service.delete, user_id, memory_id)
     return {"success": success}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Memories are shared through SQLite, so several worker processes can serve the same users
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and agent_service.CHECKPOINT_BACKEND == "memory":
+        print("⚠️ CHECKPOINT_BACKEND=memory keeps sessions per worker; use sqlite with WEB_CONCURRENCY > 1")
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=8000, workers=workers)
@@ -0,0 +1,91 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "at", "for", "with", "by", "from",
+    "is", "am", "are", "was", "were", "be", "been", "being", "has", "have", "had", "do", "does", "did",
+    "i", "me", "my", "you", "your", "it", "its", "this", "that", "these", "those", "so", "as", "about",
+    "user", "user's", "s", "what", "how", "just", "really", "very", "can", "will", "would", "could",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases, splits on non-word characters, drops stopwords and folds simple plurals."""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        token = token.strip("'")
+        if not token or token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+class MemoryIndex:
+    """
+    In-process BM25 inverted index over memory texts.
+    Documents are added and removed incrementally, so the index never needs a rebuild.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        # Terms per document, so removal only touches that document's postings
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: str, text: str):
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        length = sum(terms.values())
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+        self.doc_terms[doc_id] = list(terms)
+
+    def remove(self, doc_id: str):
+        if doc_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(doc_id, []):
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int = 8) -> List[Tuple[str, float]]:
+        """Returns up to k (doc_id, score) pairs, best first."""
+        n_docs = len(self.doc_lengths)
+        if n_docs == 0:
+            return []
+        avg_len = self.total_length / n_docs or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
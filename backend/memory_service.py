@@ -1,93 +1,336 @@
+import asyncio
+import hashlib
 import json
 import os
-import google.generativeai as genai
-from typing import List
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from llm_service import llm_executor
+from model_registry import model_registry
+from dedup_index import NearDuplicateIndex
+from memory_index import MemoryIndex, estimate_tokens
+from memory_store import MemoryLogStore, SQLiteMemoryStore
 
+# Legacy single-file store, migrated into the default user's shard on first access
 MEMORY_FILE = "memories.json"
+MEMORY_DIR = os.getenv("MEMORY_DIR", "memories")
+# Database shared by every worker process (default: memories.sqlite3 inside MEMORY_DIR)
+MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH")
+DEFAULT_USER_ID = "default"
 
-class MemoryService:
-    def __init__(self):
-        self.memories: List[dict] = self._load_memories()
+# Maximum number of user shards kept in RAM
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", "256"))
 
-    def _load_memories(self) -> List[dict]:
-        if not os.path.exists(MEMORY_FILE):
-            return []
-        try:
-            with open(MEMORY_FILE, "r") as f:
-                data = json.load(f)
-                # Migration: Convert old string list to dicts with IDs
-                if data and isinstance(data[0], str):
-                    return [{"id": str(i), "text": m, "created_at": "2024-01-01"} for i, m in enumerate(data)]
-                return data
-        except:
-            return []
-
-    def _save_memories(self):
-        with open(MEMORY_FILE, "w") as f:
-            json.dump(self.memories, f, indent=2)
-
-    def get_context(self) -> str:
-        if not self.memories:
+# Retrieval settings for the memory context injected into /chat
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "8"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "300"))
+
+# Existing memories shown to the extractor as possible duplicates of the new snippet
+EXTRACTION_NEIGHBOURS = int(os.getenv("EXTRACTION_NEIGHBOURS", "5"))
+
+SAFE_USER_ID = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def shard_basename(user_id: str) -> str:
+    """Base file name of a user's shard; ids that aren't filesystem-safe are hashed."""
+    if SAFE_USER_ID.match(user_id):
+        return user_id
+    return hashlib.sha256(user_id.encode("utf-8")).hexdigest()
+
+
+class UserMemoryShard:
+    """
+    All memories of one user with their retrieval index, cached in RAM at a version of the shared
+    store. Reads and writes are serialized by a lock; writes go through a store transaction.
+    """
+
+    def __init__(self, user_id: str, store: SQLiteMemoryStore):
+        self.user_id = user_id
+        self.store = store
+        self.version = 0
+        self._lock = threading.RLock()
+        self._reset([])
+        self.reload()
+
+    @property
+    def memories(self) -> List[dict]:
+        with self._lock:
+            return list(self._by_id.values())
+
+    def _reset(self, memories: List[dict]):
+        self.index = MemoryIndex()
+        self.dedup = NearDuplicateIndex()
+        self._by_id: Dict[str, dict] = {}
+        for m in memories:
+            self._index_memory(m)
+
+    def _index_memory(self, memory: dict):
+        self._by_id[memory['id']] = memory
+        self.index.add(memory['id'], memory['text'])
+        self.dedup.add(memory['id'], memory['text'])
+
+    def reload(self):
+        version, memories = self.store.load(self.user_id)
+        with self._lock:
+            self._reset(memories)
+            self.version = version
+
+    def _apply(self, changes: Tuple[int, List[dict], List[str]]):
+        """Applies another worker's changes to the indexes in place instead of rebuilding them."""
+        _version, added, deleted = changes
+        for memory_id in deleted + [m['id'] for m in added]:
+            if self._by_id.pop(memory_id, None) is not None:
+                self.index.remove(memory_id)
+                self.dedup.remove(memory_id)
+        for memory in added:
+            self._index_memory(memory)
+
+    def refresh(self):
+        """Catches up with changes another worker made to this user's memories since the shard's version."""
+        with self._lock:
+            if self.store.version(self.user_id) == self.version:
+                return
+            # After a rolled-back write (version -1) RAM can't be trusted: rebuild
+            changes = self.store.changes(self.user_id, self.version) if self.version >= 0 else None
+            if changes is None:
+                self.reload()
+            else:
+                self._apply(changes)
+                self.version = changes[0]
+
+    @contextmanager
+    def _write(self):
+        """Store transaction with the shard brought up to date first (so dedup sees other workers' writes)."""
+        with self._lock:
+            try:
+                with self.store.transaction(self.user_id) as tx:
+                    if tx.version != self.version:
+                        changes = tx.changes(self.version) if self.version >= 0 else None
+                        if changes is None:
+                            self._reset(tx.load())
+                        else:
+                            self._apply(changes)
+                    yield tx
+                self.version = tx.version
+            except BaseException:
+                # The transaction rolled back: drop whatever was applied in RAM
+                self.version = -1
+                raise
+
+    def search(self, query: str, k: int = MEMORY_TOP_K) -> List[dict]:
+        """Returns the k memories most relevant to the query, best first."""
+        with self._lock:
+            return [self._by_id[memory_id] for memory_id, _score in self.index.search(query, k)]
+
+    def get_context(self, query: str, k: int = MEMORY_TOP_K, token_budget: int = MEMORY_TOKEN_BUDGET) -> str:
+        """Builds the memory block for a prompt from the memories relevant to the query."""
+        header = "LONG TERM MEMORY (Facts about the user):"
+        lines = []
+        used = estimate_tokens(header)
+        for m in self.search(query, k):
+            line = f"- {m['text']}"
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
             return ""
-        return "LONG TERM MEMORY (Facts about the user):\n" + "\n".join([f"- {m['text']}" for m in self.memories])
+        return header + "\n" + "\n".join(lines)
 
     def get_all(self):
         return self.memories
 
+    def snapshot(self) -> Tuple[int, List[dict]]:
+        """All memories together with the version they belong to."""
+        with self._lock:
+            return self.version, list(self._by_id.values())
+
     def delete(self, memory_id: str):
-        original_count = len(self.memories)
-        self.memories = [m for m in self.memories if m['id'] != memory_id]
-        if len(self.memories) < original_count:
-            self._save_memories()
-            return True
-        return False
-
-    def extract_memories(self, chat_history: List[dict]):
+        with self._write() as tx:
+            if memory_id not in self._by_id:
+                return False
+            tx.delete(memory_id)
+            del self._by_id[memory_id]
+            self.index.remove(memory_id)
+            self.dedup.remove(memory_id)
+        return True
+
+    def add_facts(self, facts: List[str]) -> List[dict]:
+        """Stores facts that aren't already known (or near-duplicates of one), returning the new memories."""
+        added = []
+        with self._write() as tx:
+            for fact in facts:
+                if not isinstance(fact, str) or not fact.strip():
+                    continue
+                duplicate_id = self.dedup.find_duplicate(fact)
+                if duplicate_id is not None:
+                    print(f"🧠 Skipping near-duplicate memory: {fact!r} ~ {self._by_id[duplicate_id]['text']!r}")
+                    continue
+                memory = {
+                    "id": uuid.uuid4().hex,
+                    "text": fact,
+                    "created_at": str(time.time())
+                }
+                tx.add(memory)
+                self._index_memory(memory)
+                added.append(memory)
+        return added
+
+
+class MemoryService:
+    """
+    Long-term memory partitioned by user, stored in a SQLite database shared by every worker
+    process. Each worker keeps up to MEMORY_CACHE_SIZE user shards in an LRU cache and checks
+    the user's version counter on every access, so a change made by any worker is seen by all;
+    a shard catches up by applying only the rows changed since its version.
+
+    Every method may read or write SQLite (and wait on another worker's write lock), so async
+    callers run them off the event loop with asyncio.to_thread.
+    """
+
+    def __init__(self, directory: str = MEMORY_DIR, cache_size: int = MEMORY_CACHE_SIZE, legacy_file: str = MEMORY_FILE,
+                 db_path: str = MEMORY_DB_PATH):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.legacy_file = legacy_file
+        self._shards: "OrderedDict[str, UserMemoryShard]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.store = SQLiteMemoryStore(db_path or os.path.join(directory, "memories.sqlite3"))
+
+    def shard(self, user_id: str) -> UserMemoryShard:
+        """Returns the user's up-to-date shard, loading it on first use and evicting the least recently used one."""
+        with self._lock:
+            shard = self._shards.get(user_id)
+            if shard is not None:
+                self._shards.move_to_end(user_id)
+        if shard is not None:
+            shard.refresh()
+            return shard
+        self.version(user_id)
+        shard = UserMemoryShard(user_id, self.store)
+        with self._lock:
+            shard = self._shards.setdefault(user_id, shard)
+            self._shards.move_to_end(user_id)
+            while len(self._shards) > self.cache_size:
+                self._shards.popitem(last=False)
+        return shard
+
+    def _migrate(self, user_id: str):
+        """Imports a user's file-based shard (snapshot + log, or an older JSON file) into the database once."""
+        base_path = os.path.join(self.directory, shard_basename(user_id))
+        # The pre-log per-user file, and the single global file for the default user
+        legacy_paths = [f"{base_path}.json"]
+        if user_id == DEFAULT_USER_ID:
+            legacy_paths.append(self.legacy_file)
+        log_store = MemoryLogStore(base_path, legacy_paths)
+        if not any(os.path.exists(p) for p in [log_store.snapshot_path, log_store.log_path, *legacy_paths]):
+            return
+        memories = log_store.load()
+        with self.store.transaction(user_id) as tx:
+            # Another worker may have migrated this user meanwhile
+            if tx.version == 0:
+                for memory in memories:
+                    tx.add(memory)
+                tx.changed = True
+                print(f"📦 Migrated {len(memories)} memories of {user_id} into {self.store.path}")
+
+    def version(self, user_id: str) -> int:
+        """Current version of the user's memories (one indexed read), importing file-based shards first."""
+        version = self.store.version(user_id)
+        if version == 0:
+            self._migrate(user_id)
+            version = self.store.version(user_id)
+        return version
+
+    def get_context(self, user_id: str, query: str) -> str:
+        return self.shard(user_id).get_context(query)
+
+    def search(self, user_id: str, query: str, k: int = MEMORY_TOP_K) -> List[dict]:
+        return self.shard(user_id).search(query, k)
+
+    def add_facts(self, user_id: str, facts: List[str]) -> List[dict]:
+        return self.shard(user_id).add_facts(facts)
+
+    def get_all(self, user_id: str):
+        return self.shard(user_id).get_all()
+
+    def get_all_versioned(self, user_id: str) -> Tuple[int, List[dict]]:
+        return self.shard(user_id).snapshot()
+
+    def page(self, user_id: str, cursor: int, limit: int) -> Tuple[int, List[dict], Optional[int]]:
+        """One page of memories read straight from the store (no shard or index is built for it)."""
+        self.version(user_id)
+        return self.store.page(user_id, cursor, limit)
+
+    def changes(self, user_id: str, since: int) -> Optional[Tuple[int, List[dict], List[str]]]:
+        self.version(user_id)
+        return self.store.changes(user_id, since)
+
+    def delete(self, user_id: str, memory_id: str):
+        return self.shard(user_id).delete(memory_id)
+
+    async def extract_memories(self, user_id: str, chat_history: List[dict]):
         """
         Analyzes the chat to find new permanent facts about the user.
         """
         if not chat_history:
             return
-
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        
         # We only care about the last exchange usually
-        last_exchange = chat_history[-2:] 
-        conversation_text = "\n".join([f"{msg['role']}: {msg['parts'][0]['text']}" for msg in last_exchange])
+        await self.extract_memories_batch([(user_id, chat_history[-2:])])
 
-        prompt = f"""
-        Analyze this conversation snippet for PERMANENT facts about the User (dates, names, preferences, hobbies, job, health info).
-        
-        Conversation:
+    async def extract_memories_batch(self, batch: List[Tuple[str, List[dict]]]):
+        """
+        Extracts new permanent facts from several conversation snippets (possibly of different
+        users) with a single LLM call.
+        """
+        batch = [(user_id, turns) for user_id, turns in batch if turns]
+        if not batch:
+            return
+
+        model = model_registry.generative(json_mode=True)
+
+        sections = []
+        for i, (user_id, turns) in enumerate(batch):
+            conversation_text = "\n".join([f"{msg['role']}: {msg['parts'][0]['text']}" for msg in turns])
+            neighbours = await asyncio.to_thread(self.search, user_id, conversation_text, EXTRACTION_NEIGHBOURS)
+            related = [m['text'] for m in neighbours]
+            sections.append(f"""
+        Conversation {i}:
         {conversation_text}
 
-        Existing Memories:
-        {json.dumps(self.memories)}
+        Possibly Related Existing Memories for Conversation {i}:
+        {json.dumps(related)}
+        """)
 
+        prompt = f"""
+        Analyze each conversation snippet below for PERMANENT facts about its User (dates, names, preferences, hobbies, job, health info).
+        Each conversation belongs to a different user; never mix facts between conversations.
+        {"".join(sections)}
         Task:
-        1. Identify any NEW facts that are not already in Existing Memories.
+        1. Identify any NEW facts that are not already in that conversation's existing memories.
         2. Ignore trivial things (e.g., "User said hello", "User asked about the weather").
-        3. Return strictly a JSON list of strings. Example: ["User owns a cat named Luna", "User finds rain relaxing"].
-        4. If no new facts, return [].
+        3. Return strictly a JSON object mapping each conversation number to a list of strings.
+           Example: {{"0": ["User owns a cat named Luna"], "1": []}}.
+        4. Use an empty list for conversations without new facts.
         """
 
         try:
-            response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-            new_facts = json.loads(response.text)
-            
-            if new_facts:
-                import time
-                print(f"🧠 New Memories Extracted: {new_facts}")
-                # Convert strings to memory objects
-                for fact in new_facts:
-                    # Check duplication by text
-                    if not any(m['text'] == fact for m in self.memories):
-                        self.memories.append({
-                            "id": str(int(time.time() * 1000)),
-                            "text": fact,
-                            "created_at": str(time.time())
-                        })
-                self._save_memories()
-                
+            response = await llm_executor.generate("memory_extraction", model, prompt)
+            results = json.loads(response.text)
+            if isinstance(results, list) and len(batch) == 1:
+                results = {"0": results}
+
+            for i, (user_id, _turns) in enumerate(batch):
+                new_facts = results.get(str(i)) or []
+                if new_facts:
+                    print(f"🧠 New Memories Extracted: {new_facts}")
+                    await asyncio.to_thread(self.add_facts, user_id, new_facts)
+
         except Exception as e:
             print(f"Memory extraction failed: {e}")
@@ -0,0 +1,280 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager, suppress
+from typing import List, Optional, Tuple
+
+# SQLite synchronous mode: NORMAL (WAL default, may lose the last commits on power loss) or FULL
+MEMORY_DB_SYNCHRONOUS = os.getenv("MEMORY_DB_SYNCHRONOUS", "NORMAL").upper()
+# Seconds a write waits for another worker's transaction before failing
+MEMORY_DB_BUSY_TIMEOUT = float(os.getenv("MEMORY_DB_BUSY_TIMEOUT", "5"))
+# Deletions are remembered for this many versions; older delta requests must refetch everything
+MEMORY_TOMBSTONE_VERSIONS = int(os.getenv("MEMORY_TOMBSTONE_VERSIONS", "1000"))
+
+
+def _fsync_dir(directory: str):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path: str, data):
+    """
+    Writes JSON to a temp file, fsyncs it and renames it over `path`. The temp file is unique
+    per write, so concurrent writers (other threads or worker processes) never share one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    _fsync_dir(directory)
+
+
+class MemoryLogStore:
+    """
+    Read-only loader for the file-based shards that predate SQLiteMemoryStore, used once per user
+    to migrate them: `<base>.snapshot.json` plus the operations replayed from `<base>.log`, or
+    an older single JSON file. Log records carry a sequence number; those already folded into
+    the snapshot are skipped, and a torn final record from a crash mid-append is ignored.
+    """
+
+    def __init__(self, base_path: str, legacy_paths: Optional[List[str]] = None):
+        self.snapshot_path = f"{base_path}.snapshot.json"
+        self.log_path = f"{base_path}.log"
+        self.legacy_paths = legacy_paths or []
+
+    def load(self) -> List[dict]:
+        """Returns the shard's memories: snapshot plus replayed log tail (or a legacy file's contents)."""
+        memories = {}
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot.get("seq", 0)
+            memories = {m['id']: m for m in snapshot.get("memories", [])}
+        elif not os.path.exists(self.log_path):
+            legacy = self._load_legacy()
+            if legacy is not None:
+                return legacy
+
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("incomplete record")
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append; everything before it is intact
+                        break
+                    if record["seq"] <= snapshot_seq:
+                        continue
+                    if record["op"] == "add":
+                        memories[record["memory"]["id"]] = record["memory"]
+                    elif record["op"] == "delete":
+                        memories.pop(record["id"], None)
+        return list(memories.values())
+
+    def _load_legacy(self) -> Optional[List[dict]]:
+        for path in self.legacy_paths:
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Skipping unreadable legacy memory file {path}: {e}")
+                continue
+            # Migration: Convert old string list to dicts with IDs
+            if data and isinstance(data[0], str):
+                return [{"id": str(i), "text": m, "created_at": "2024-01-01"} for i, m in enumerate(data)]
+            return data
+        return None
+
+
+class MemoryTransaction:
+    """
+    Changes to one user's memories inside a write transaction (see SQLiteMemoryStore.transaction).
+    Added rows and deletion tombstones are stamped with the version the transaction commits as.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, user_id: str, version: int):
+        self._conn = conn
+        self.user_id = user_id
+        self.version = version
+        self.changed = False
+
+    def load(self) -> List[dict]:
+        return SQLiteMemoryStore._select(self._conn, self.user_id)
+
+    def changes(self, since: int) -> Optional[Tuple[int, List[dict], List[str]]]:
+        """What other writers changed between version `since` and this transaction (see SQLiteMemoryStore.changes)."""
+        return SQLiteMemoryStore._changes(self._conn, self.user_id, since, self.version)
+
+    def add(self, memory: dict):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO memories (user_id, id, text, created_at, version) VALUES (?, ?, ?, ?, ?)",
+            (self.user_id, memory["id"], memory["text"], memory.get("created_at", ""), self.version + 1),
+        )
+        self._conn.execute("DELETE FROM memory_tombstones WHERE user_id = ? AND id = ?", (self.user_id, memory["id"]))
+        self.changed = True
+
+    def delete(self, memory_id: str) -> bool:
+        cursor = self._conn.execute("DELETE FROM memories WHERE user_id = ? AND id = ?", (self.user_id, memory_id))
+        if cursor.rowcount == 0:
+            return False
+        self._conn.execute(
+            "INSERT OR REPLACE INTO memory_tombstones (user_id, id, version) VALUES (?, ?, ?)",
+            (self.user_id, memory_id, self.version + 1),
+        )
+        self.changed = True
+        return True
+
+
+class SQLiteMemoryStore:
+    """
+    Memories of every user in one SQLite database in WAL mode, shared by all worker processes
+    of a node. Each user has a version counter that is bumped in the same transaction as every
+    change, so a worker can keep a user's shard in RAM and rebuild it only when the version
+    moved. Writes take SQLite's write lock (BEGIN IMMEDIATE), which serializes them across
+    processes; readers never block. Rows and tombstones carry the version that wrote them, so
+    clients can page through a user's memories and fetch only what changed since a version.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = MEMORY_DB_BUSY_TIMEOUT, synchronous: str = MEMORY_DB_SYNCHRONOUS):
+        if synchronous not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise ValueError(f"Unknown MEMORY_DB_SYNCHRONOUS: {synchronous}")
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memories ("
+            "user_id TEXT NOT NULL, id TEXT NOT NULL, text TEXT NOT NULL, created_at TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory_versions (user_id TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory_tombstones ("
+            "user_id TEXT NOT NULL, id TEXT NOT NULL, version INTEGER NOT NULL, PRIMARY KEY (user_id, id))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(memories)")}
+        if "version" not in columns:
+            # Databases created before deltas: existing rows predate every version a client can know
+            self._conn.execute("ALTER TABLE memories ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS memories_user_version ON memories (user_id, version)")
+
+    @staticmethod
+    def _select(conn: sqlite3.Connection, user_id: str) -> List[dict]:
+        rows = conn.execute(
+            "SELECT id, text, created_at FROM memories WHERE user_id = ? ORDER BY rowid", (user_id,)
+        ).fetchall()
+        return [{"id": r[0], "text": r[1], "created_at": r[2]} for r in rows]
+
+    @staticmethod
+    def _version(conn: sqlite3.Connection, user_id: str) -> int:
+        row = conn.execute("SELECT version FROM memory_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def version(self, user_id: str) -> int:
+        """Current version of a user's memories (0 if never written); one indexed read."""
+        with self._lock:
+            return self._version(self._conn, user_id)
+
+    def load(self, user_id: str) -> Tuple[int, List[dict]]:
+        """A user's memories and the version they belong to, read from one consistent snapshot."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                return self._version(self._conn, user_id), self._select(self._conn, user_id)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def page(self, user_id: str, after: int, limit: int) -> Tuple[int, List[dict], Optional[int]]:
+        """Up to `limit` memories following position `after` (0 = start), their version and the next position."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                version = self._version(self._conn, user_id)
+                rows = self._conn.execute(
+                    "SELECT rowid, id, text, created_at FROM memories WHERE user_id = ? AND rowid > ? "
+                    "ORDER BY rowid LIMIT ?", (user_id, after, limit + 1)
+                ).fetchall()
+            finally:
+                self._conn.execute("COMMIT")
+        next_after = rows[limit - 1][0] if len(rows) > limit else None
+        return version, [{"id": r[1], "text": r[2], "created_at": r[3]} for r in rows[:limit]], next_after
+
+    @staticmethod
+    def _changes(conn: sqlite3.Connection, user_id: str, since: int,
+                 version: int) -> Optional[Tuple[int, List[dict], List[str]]]:
+        if since > version or since < version - MEMORY_TOMBSTONE_VERSIONS:
+            return None
+        added = conn.execute(
+            "SELECT id, text, created_at FROM memories WHERE user_id = ? AND version > ? ORDER BY rowid",
+            (user_id, since),
+        ).fetchall()
+        deleted = conn.execute(
+            "SELECT id FROM memory_tombstones WHERE user_id = ? AND version > ?", (user_id, since)
+        ).fetchall()
+        return version, [{"id": r[0], "text": r[1], "created_at": r[2]} for r in added], [r[0] for r in deleted]
+
+    def changes(self, user_id: str, since: int) -> Optional[Tuple[int, List[dict], List[str]]]:
+        """
+        Memories added and ids deleted after version `since`, with the current version; None when
+        `since` is older than the remembered deletions (or unknown), and the caller must start over.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                return self._changes(self._conn, user_id, since, self._version(self._conn, user_id))
+            finally:
+                self._conn.execute("COMMIT")
+
+    @contextmanager
+    def transaction(self, user_id: str):
+        """Write transaction on one user's memories; the version is bumped on commit if anything changed."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tx = MemoryTransaction(self._conn, user_id, self._version(self._conn, user_id))
+                yield tx
+                if tx.changed:
+                    tx.version += 1
+                    self._conn.execute(
+                        "INSERT INTO memory_versions (user_id, version) VALUES (?, ?) "
+                        "ON CONFLICT (user_id) DO UPDATE SET version = excluded.version",
+                        (user_id, tx.version),
+                    )
+                    self._conn.execute(
+                        "DELETE FROM memory_tombstones WHERE user_id = ? AND version <= ?",
+                        (user_id, tx.version - MEMORY_TOMBSTONE_VERSIONS),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
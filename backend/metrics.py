@@ -0,0 +1,293 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Fraction of requests that record a per-request trace (0 = off, 1 = every request)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# Finished traces kept for GET /traces
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+# Print every finished trace as one JSON line
+TRACE_LOG = os.getenv("TRACE_LOG", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (Prometheus semantics)."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    """A gauge (or counter) read from existing state when /metrics is scraped."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Dict[Tuple, float]],
+                 labelnames: Tuple[str, ...] = (), type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = labelnames
+        self.type = type
+
+    def render(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Metric {self.name} failed: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {float(v)}" for key, v in values.items()]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, fn, labelnames: Tuple[str, ...] = (), type: str = "gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, fn, labelnames, type))
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Metrics shared across the backend ---
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "serene_http_request_duration_seconds", "Request latency including the streamed body",
+    ("endpoint", "method", "status"))
+HTTP_FIRST_BYTE_SECONDS = registry.histogram(
+    "serene_http_time_to_first_byte_seconds", "Time until the first body bytes are sent", ("endpoint",))
+CHAT_STAGE_SECONDS = registry.histogram(
+    "serene_chat_stage_duration_seconds", "Time spent in each stage of /chat", ("stage",))
+CHAT_TURNS = registry.counter(
+    "serene_chat_turns_total", "Chat turns by transport and outcome (completed, fallback, disconnected)",
+    ("transport", "outcome"))
+GRAPH_NODE_SECONDS = registry.histogram(
+    "serene_graph_node_duration_seconds", "Agent graph node latency", ("node",))
+LLM_QUEUE_SECONDS = registry.histogram(
+    "serene_llm_queue_wait_seconds", "Wait for an LLM execution slot", ("endpoint",))
+LLM_CALL_SECONDS = registry.histogram(
+    "serene_llm_call_duration_seconds", "LLM call latency once admitted", ("endpoint", "node"))
+LLM_FIRST_TOKEN_SECONDS = registry.histogram(
+    "serene_llm_time_to_first_token_seconds", "Streaming LLM time to first token", ("endpoint", "node"))
+LLM_PROMPT_TOKENS = registry.counter(
+    "serene_llm_prompt_tokens_total", "Prompt tokens reported by the model", ("endpoint", "node"))
+LLM_COMPLETION_TOKENS = registry.counter(
+    "serene_llm_completion_tokens_total", "Completion tokens reported by the model", ("endpoint", "node"))
+LLM_ERRORS = registry.counter(
+    "serene_llm_errors_total", "Failed LLM calls by error type", ("endpoint", "error"))
+LLM_RETRIES = registry.counter(
+    "serene_llm_retries_total", "LLM calls retried after a failure", ("endpoint",))
+LLM_HEDGES = registry.counter(
+    "serene_llm_hedged_requests_total", "Duplicate LLM requests sent for calls slower than their p95", ("endpoint",))
+
+# Graph node currently executing, used to label LLM metrics
+current_node: contextvars.ContextVar[str] = contextvars.ContextVar("current_node", default="")
+
+
+# --- Tracing ---
+
+class Trace:
+    """Spans of one sampled request."""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[dict] = []
+
+    def add_span(self, name: str, start: float, duration: float, **attributes):
+        self.spans.append({
+            "name": name,
+            "offset_ms": round((start - self.start) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            **attributes,
+        })
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "spans": sorted(self.spans, key=lambda s: s["offset_ms"]),
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+recent_traces: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def start_trace(name: str, sample_rate: float = TRACE_SAMPLE_RATE) -> Optional[Trace]:
+    """Starts a trace for the current request if it is sampled."""
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return None
+    trace = Trace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: Optional[Trace]):
+    if trace is None:
+        return
+    trace.duration = time.perf_counter() - trace.start
+    recent_traces.append(trace.to_dict())
+    if TRACE_LOG:
+        print(json.dumps({"trace": trace.to_dict()}))
+
+
+@contextmanager
+def span(name: str, histogram: Optional[Histogram] = None, **labels):
+    """Times a block into `histogram` and, when the request is traced, records it as a span."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if histogram is not None:
+            histogram.observe(duration, **labels)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, start, duration, **labels)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency (until the last body byte, so streamed replies count
+    in full), time to first byte and status per route, and starting sampled traces.
+    """
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        trace = start_trace(f"{scope['method']} {scope['path']}", self.sample_rate)
+        state = {"status": 500, "first_byte": False}
+
+        def endpoint() -> str:
+            route = scope.get("route")
+            return getattr(route, "path", None) or "unmatched"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if trace is not None:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace.trace_id.encode())]
+            elif message["type"] == "http.response.body" and not state["first_byte"] and message.get("body"):
+                state["first_byte"] = True
+                HTTP_FIRST_BYTE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 499: the client went away before the reply was complete (see CancelOnDisconnectMiddleware)
+            status = "499" if scope.get("client_disconnected") else str(state["status"])
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, endpoint=endpoint(), method=scope["method"], status=status
+            )
+            finish_trace(trace)
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import google.generativeai as genai
+
+MODEL_TEXT = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Build the shared clients and open the connection on startup instead of on the first request
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+MODEL_WARMUP_TIMEOUT = float(os.getenv("MODEL_WARMUP_TIMEOUT", "10"))
+
+
+def find_api_key() -> Optional[str]:
+    return os.getenv("VITE_GOOGLE_AI_KEY") or os.getenv("GOOGLE_AI_KEY") or os.getenv("GEMINI_API_KEY")
+
+
+class ModelRegistry:
+    """
+    Lazily built model clients, one per configuration, shared by main, agent_service and memory_service.
+    genai is configured once, so every GenerativeModel goes through the same default client and
+    its kept-alive channel instead of setting up a new one per request.
+    """
+
+    def __init__(self, model_name: str = MODEL_TEXT):
+        self.model_name = model_name
+        self._api_key: Optional[str] = None
+        self._configured = False
+        self._models: Dict[Tuple[str, bool], genai.GenerativeModel] = {}
+        self._chat_models: Dict[Tuple[str, float], object] = {}
+        self._lock = threading.Lock()
+        self._generative_factory = None
+        self._chat_factory = None
+        self.warm = False
+
+    def configure(self, api_key: str):
+        """Sets the API key; nothing is constructed until a model is first asked for."""
+        with self._lock:
+            self._api_key = api_key
+            self._configured = False
+            self._models.clear()
+            self._chat_models.clear()
+
+    def override(self, generative_factory=None, chat_factory=None):
+        """
+        Builds clients with the given factories instead of the real SDKs (used by the offline
+        benchmark's fake Gemini). generative_factory(model_name, json_mode), chat_factory(model_name, temperature).
+        """
+        with self._lock:
+            self._generative_factory = generative_factory
+            self._chat_factory = chat_factory
+            self._models.clear()
+            self._chat_models.clear()
+
+    def _ensure_configured(self):
+        if not self._configured:
+            genai.configure(api_key=self._api_key or find_api_key())
+            self._configured = True
+
+    def generative(self, json_mode: bool = False, model_name: Optional[str] = None) -> genai.GenerativeModel:
+        """Shared `genai.GenerativeModel`, in plain text or JSON response mode."""
+        key = (model_name or self.model_name, json_mode)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None and self._generative_factory is not None:
+                    model = self._models[key] = self._generative_factory(key[0], json_mode)
+                elif model is None:
+                    self._ensure_configured()
+                    config = {"response_mime_type": "application/json"} if json_mode else None
+                    model = self._models[key] = genai.GenerativeModel(model_name=key[0], generation_config=config)
+        return model
+
+    def chat(self, temperature: float = 0.7, model_name: Optional[str] = None):
+        """Shared LangChain chat model for the agent graph."""
+        key = (model_name or self.model_name, temperature)
+        llm = self._chat_models.get(key)
+        if llm is None:
+            with self._lock:
+                llm = self._chat_models.get(key)
+                if llm is None and self._chat_factory is not None:
+                    llm = self._chat_models[key] = self._chat_factory(key[0], temperature)
+                elif llm is None:
+                    # Imported here: langchain_google_genai alone takes over a second to import
+                    from langchain_google_genai import ChatGoogleGenerativeAI
+                    # max_retries=1 turns off the SDK's own retries; llm_executor retries with its deadline
+                    llm = self._chat_models[key] = ChatGoogleGenerativeAI(
+                        model=key[0], google_api_key=self._api_key or find_api_key(), temperature=temperature,
+                        max_retries=1,
+                    )
+        return llm
+
+    async def warmup(self):
+        """Builds the common clients and makes one cheap request so the connection is open."""
+        try:
+            text_model = self.generative()
+            self.generative(json_mode=True)
+            self.chat()
+            await asyncio.wait_for(text_model.count_tokens_async("warmup"), MODEL_WARMUP_TIMEOUT)
+            self.warm = True
+            print("🔥 Model clients warmed up")
+        except (Exception, asyncio.TimeoutError) as e:
+            print(f"Model warmup failed (clients will connect on first use): {e}")
+
+    def stats(self) -> dict:
+        return {
+            "generative_models": len(self._models),
+            "chat_models": len(self._chat_models),
+            "warm": self.warm,
+        }
+
+
+# Shared registry used by main, agent_service and memory_service
+model_registry = ModelRegistry()
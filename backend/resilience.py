@@ -0,0 +1,206 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+# --- Deadlines: seconds from the call until its answer (streams: until the first chunk) ---
+LLM_DEFAULT_DEADLINE = float(os.getenv("LLM_DEFAULT_DEADLINE", "20"))
+ENDPOINT_DEADLINES = {
+    "chat": 25,
+    "crisis": 12,
+    "analyze_sentiment": 10,
+    "clinical_summary": 45,
+    "wellness_assessment": 45,
+    "assessment_questions": 30,
+    # Background work, nobody is waiting on it
+    "memory_extraction": 60,
+    "conversation_summary": 60,
+    "content_pool": 60,
+}
+# Longest silence between two chunks of a stream
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "15"))
+
+# --- Retries (exponential backoff with full jitter) ---
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.25"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+
+# --- Hedging: a duplicate request once the first is slower than the endpoint's recent p95 ---
+LLM_HEDGING = os.getenv("LLM_HEDGING", "1") == "1"
+HEDGE_ENDPOINTS = set(os.getenv(
+    "LLM_HEDGE_ENDPOINTS",
+    "analyze_sentiment,analyze_sentiment_batch,daily_insight,journal_prompt,task_insight,task_breakdown,"
+    "analyze_thought_pattern,assessment_questions",
+).split(","))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.05"))
+# At most this share of an endpoint's calls may be hedged
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+
+# --- Circuit breaker ---
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Upstream failures worth retrying (and that count against the circuit breaker).
+# ResourceExhausted (429) is a TooManyRequests.
+RETRYABLE_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def endpoint_deadline(endpoint: str) -> float:
+    return ENDPOINT_DEADLINES.get(endpoint, LLM_DEFAULT_DEADLINE)
+
+
+def is_retryable(e: BaseException) -> bool:
+    return isinstance(e, RETRYABLE_ERRORS)
+
+
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE_DELAY, cap: float = LLM_RETRY_MAX_DELAY) -> float:
+    """Full-jitter backoff before retry number `attempt` (0-based), so retries of many requests spread out."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Stops calling Gemini after `failures` consecutive upstream failures. While open, calls fail
+    immediately (endpoints fall back to cached or local answers); after `cooldown` seconds one
+    probe call is let through, and its success closes the breaker again.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.probing:
+            # The probe failed: stay open for another cooldown
+            self.probing = False
+            self.opened_at = time.monotonic()
+        elif self.opened_at is None and self.consecutive_failures >= self.failures:
+            self.trips += 1
+            self.opened_at = time.monotonic()
+            print(f"⚡ LLM circuit breaker open for {self.cooldown:.0f}s after {self.consecutive_failures} failures")
+
+    def release_probe(self):
+        """The probe ended without telling anything about upstream health (e.g. it was cancelled)."""
+        self.probing = False
+
+
+class LatencyTracker:
+    """Recent successful call latencies per endpoint, for the hedging delay."""
+
+    def __init__(self, window: int = 256):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self.calls: Dict[str, int] = {}
+        self.hedges: Dict[str, int] = {}
+
+    def observe(self, endpoint: str, seconds: float):
+        if endpoint not in self._samples:
+            self._samples[endpoint] = deque(maxlen=self.window)
+        self._samples[endpoint].append(seconds)
+
+    def percentile(self, endpoint: str, q: float) -> Optional[float]:
+        samples = self._samples.get(endpoint)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """When to send a duplicate request, or None when the endpoint isn't hedged (yet)."""
+        if not LLM_HEDGING or endpoint not in HEDGE_ENDPOINTS:
+            return None
+        samples = self._samples.get(endpoint)
+        if samples is None or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(LLM_HEDGE_MIN_DELAY, self.percentile(endpoint, 0.95))
+
+    def hedge_allowed(self, endpoint: str) -> bool:
+        return self.hedges.get(endpoint, 0) < LLM_HEDGE_BUDGET * self.calls.get(endpoint, 0)
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    Cancels the request handler as soon as the client disconnects, so an abandoned request stops
+    waiting on (and paying for) its LLM calls. Starlette only does this for streamed bodies.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        handler = asyncio.current_task()
+        messages: asyncio.Queue = asyncio.Queue()
+        state = {"disconnected": False, "responded": False}
+
+        async def watch():
+            # Reads the connection ahead of the app: body messages are passed on, a disconnect cancels it
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    if not state["responded"]:
+                        state["disconnected"] = True
+                        scope["client_disconnected"] = True
+                        handler.cancel()
+                    return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["responded"] = True
+            await send(message)
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await self.app(scope, messages.get, send_wrapper)
+        except asyncio.CancelledError:
+            if not state["disconnected"]:
+                raise
+            handler.uncancel()
+        finally:
+            watcher.cancel()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # 'memory' or 'sqlite'
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_key(endpoint: str, *parts) -> str:
+    """Cache key that ignores case, punctuation and spacing differences in the inputs."""
+    normalized = []
+    for part in parts:
+        text = "" if part is None else str(part)
+        text = _PUNCTUATION.sub(" ", text.lower())
+        normalized.append(_WHITESPACE.sub(" ", text).strip())
+    digest = hashlib.sha256("\x1f".join(normalized).encode("utf-8")).hexdigest()
+    return f"{endpoint}:{digest}"
+
+
+class InMemoryCacheBackend:
+    """Size-bounded LRU of key -> (pool of answers, expiry)."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            pool, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(pool)
+
+    def set(self, key: str, pool: List[str], ttl: float):
+        with self._lock:
+            self._entries[key] = (list(pool), time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """On-disk cache that survives restarts; LRU eviction by last access time."""
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, pool TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[List[str]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT pool, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+
+    def set(self, key: str, pool: List[str], ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, pool, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(pool), now + ttl, now),
+            )
+            overflow = len(self) - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE key IN "
+                    "(SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)", (overflow,)
+                )
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class CachePolicy:
+    """How long answers of one endpoint live, and how many distinct answers to rotate between."""
+
+    def __init__(self, ttl: float, pool_size: int = 1):
+        self.ttl = ttl
+        self.pool_size = pool_size
+
+
+class ResponseCache:
+    """
+    Caches generated answers per endpoint and normalized input.
+    With pool_size > 1 the cache keeps generating until it holds that many distinct answers
+    for a key, then serves a random one, so repeated prompts don't always read the same.
+    """
+
+    def __init__(self, backend, policies: Dict[str, CachePolicy]):
+        self.backend = backend
+        self.policies = policies
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.fallbacks: Dict[str, int] = {}
+
+    async def get_or_generate(self, endpoint: str, key_parts: tuple, generate: Callable[[], Awaitable[str]]) -> str:
+        policy = self.policies.get(endpoint)
+        if policy is None:
+            return await generate()
+        key = normalize_key(endpoint, *key_parts)
+        pool = self.backend.get(key) or []
+        if len(pool) >= policy.pool_size:
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+            return random.choice(pool)
+
+        self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+        try:
+            answer = await generate()
+        except Exception:
+            if not pool:
+                raise
+            # The LLM failed but the pool isn't full yet: an answer we already have beats an error
+            self.fallbacks[endpoint] = self.fallbacks.get(endpoint, 0) + 1
+            return random.choice(pool)
+        if answer and answer not in pool:
+            pool.append(answer)
+            self.backend.set(key, pool, policy.ttl)
+        return answer
+
+    def stats(self) -> dict:
+        endpoints = {}
+        for endpoint in self.policies:
+            hits, misses = self.hits.get(endpoint, 0), self.misses.get(endpoint, 0)
+            total = hits + misses
+            endpoints[endpoint] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / total, 3) if total else 0.0,
+                "fallbacks": self.fallbacks.get(endpoint, 0),
+            }
+        return {"entries": len(self.backend), "endpoints": endpoints}
+
+
+def create_cache_backend(kind: str = RESPONSE_CACHE_BACKEND):
+    if kind == "sqlite":
+        return SQLiteCacheBackend()
+    if kind == "memory":
+        return InMemoryCacheBackend()
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {kind}")
@@ -0,0 +1,153 @@
+import math
+import os
+import re
+from typing import Dict, List, Tuple
+
+# Below this confidence the local result is handed to Gemini instead
+SENTIMENT_CONFIDENCE_THRESHOLD = float(os.getenv("SENTIMENT_CONFIDENCE_THRESHOLD", "0.6"))
+
+# Packing limits for batch analysis: prompt tokens and texts per LLM call
+SENTIMENT_BATCH_CHUNK_TOKENS = int(os.getenv("SENTIMENT_BATCH_CHUNK_TOKENS", "6000"))
+SENTIMENT_BATCH_CHUNK_ITEMS = int(os.getenv("SENTIMENT_BATCH_CHUNK_ITEMS", "40"))
+# Chunks of one batch request in flight at once, so a large batch can't fill the LLM queue ahead of /chat
+SENTIMENT_BATCH_CONCURRENCY = int(os.getenv("SENTIMENT_BATCH_CONCURRENCY", "2"))
+
+# Valence per word, roughly -3 (very negative) .. +3 (very positive)
+VALENCE: Dict[str, float] = {
+    # negative
+    "anxious": -2.0, "anxiety": -2.0, "worried": -1.8, "worry": -1.6, "nervous": -1.5, "panic": -2.6,
+    "panicking": -2.6, "scared": -2.0, "afraid": -2.0, "fear": -2.0, "terrified": -2.8, "stressed": -1.9,
+    "stress": -1.6, "overwhelmed": -2.2, "overwhelming": -2.0, "sad": -2.1, "unhappy": -2.0, "depressed": -2.7,
+    "depressing": -2.4, "down": -1.2, "miserable": -2.7, "hopeless": -2.8, "worthless": -2.8, "empty": -1.8,
+    "lonely": -2.1, "alone": -1.4, "isolated": -1.9, "cry": -1.8, "crying": -1.9, "cried": -1.8, "tears": -1.4,
+    "hurt": -2.0, "hurting": -2.1, "pain": -2.0, "painful": -2.1, "angry": -2.2, "anger": -2.1, "mad": -1.8,
+    "furious": -2.7, "annoyed": -1.5, "frustrated": -1.9, "frustrating": -1.8, "irritated": -1.6, "hate": -2.6,
+    "awful": -2.5, "terrible": -2.6, "horrible": -2.6, "bad": -1.8, "worse": -2.0, "worst": -2.7, "tired": -1.3,
+    "exhausted": -2.0, "drained": -1.9, "burnout": -2.2, "burned": -1.2, "sick": -1.6, "guilty": -1.9,
+    "ashamed": -2.1, "shame": -2.1, "embarrassed": -1.6, "failure": -2.3, "failed": -2.0, "fail": -1.9,
+    "stuck": -1.5, "lost": -1.5, "confused": -1.2, "numb": -1.7, "restless": -1.3, "insecure": -1.7,
+    "rejected": -2.1, "betrayed": -2.4, "grief": -2.4, "grieving": -2.4, "disappointed": -1.9, "upset": -1.9,
+    "struggling": -1.9, "struggle": -1.6, "suicidal": -3.0, "die": -2.5, "dying": -2.5, "kill": -2.8,
+    # positive
+    "happy": 2.2, "happier": 2.0, "joy": 2.5, "joyful": 2.5, "glad": 1.8, "great": 2.1, "good": 1.6,
+    "better": 1.4, "best": 2.2, "amazing": 2.6, "awesome": 2.5, "wonderful": 2.6, "fantastic": 2.6,
+    "excited": 2.1, "exciting": 2.0, "calm": 1.7, "relaxed": 1.9, "peaceful": 2.1, "peace": 1.9,
+    "grateful": 2.3, "thankful": 2.2, "gratitude": 2.2, "hopeful": 2.1, "hope": 1.6, "optimistic": 2.0,
+    "proud": 2.1, "confident": 1.9, "love": 2.4, "loved": 2.3, "loving": 2.2, "enjoy": 1.8, "enjoyed": 1.9,
+    "fun": 1.8, "content": 1.5, "satisfied": 1.7, "relieved": 1.8, "relief": 1.7, "safe": 1.5, "strong": 1.4,
+    "energized": 1.9, "motivated": 1.9, "productive": 1.6, "accomplished": 2.0, "rested": 1.5, "smile": 1.7,
+    "smiling": 1.8, "laugh": 1.9, "laughing": 2.0, "nice": 1.5, "supported": 1.8, "okay": 0.6, "ok": 0.5,
+    "fine": 0.6, "well": 0.8,
+}
+
+# Emotion tags surfaced to the frontend
+EMOTIONS: Dict[str, str] = {
+    "anxious": "Anxious", "anxiety": "Anxious", "worried": "Anxious", "worry": "Anxious", "nervous": "Anxious",
+    "panic": "Anxious", "panicking": "Anxious", "scared": "Fearful", "afraid": "Fearful", "fear": "Fearful",
+    "terrified": "Fearful", "stressed": "Stressed", "stress": "Stressed", "overwhelmed": "Overwhelmed",
+    "overwhelming": "Overwhelmed", "sad": "Sad", "unhappy": "Sad", "depressed": "Sad", "miserable": "Sad",
+    "down": "Sad", "cry": "Sad", "crying": "Sad", "cried": "Sad", "tears": "Sad", "grief": "Grieving",
+    "grieving": "Grieving", "hopeless": "Hopeless", "worthless": "Hopeless", "empty": "Empty", "numb": "Empty",
+    "lonely": "Lonely", "alone": "Lonely", "isolated": "Lonely", "rejected": "Lonely", "angry": "Angry",
+    "anger": "Angry", "mad": "Angry", "furious": "Angry", "hate": "Angry", "annoyed": "Frustrated",
+    "frustrated": "Frustrated", "frustrating": "Frustrated", "irritated": "Frustrated", "stuck": "Frustrated",
+    "tired": "Tired", "exhausted": "Tired", "drained": "Tired", "burnout": "Tired", "guilty": "Guilty",
+    "ashamed": "Ashamed", "shame": "Ashamed", "embarrassed": "Ashamed", "disappointed": "Disappointed",
+    "happy": "Happy", "happier": "Happy", "joy": "Happy", "joyful": "Happy", "glad": "Happy", "fun": "Happy",
+    "laugh": "Happy", "laughing": "Happy", "smile": "Happy", "excited": "Excited", "exciting": "Excited",
+    "energized": "Excited", "calm": "Calm", "relaxed": "Calm", "peaceful": "Calm", "peace": "Calm",
+    "rested": "Calm", "grateful": "Grateful", "thankful": "Grateful", "gratitude": "Grateful",
+    "hopeful": "Hopeful", "hope": "Hopeful", "optimistic": "Hopeful", "proud": "Proud", "accomplished": "Proud",
+    "confident": "Confident", "strong": "Confident", "love": "Loved", "loved": "Loved", "supported": "Loved",
+    "relieved": "Relieved", "relief": "Relieved", "motivated": "Motivated", "productive": "Motivated",
+}
+
+NEGATIONS = {"not", "no", "never", "cannot", "cant", "can't", "dont", "don't", "doesnt", "doesn't", "didnt",
+             "didn't", "isnt", "isn't", "wasnt", "wasn't", "arent", "aren't", "wont", "won't", "nothing",
+             "hardly", "without", "nor", "neither"}
+INTENSIFIERS = {"very": 1.3, "really": 1.25, "so": 1.2, "extremely": 1.5, "incredibly": 1.45, "super": 1.3,
+                "totally": 1.3, "completely": 1.4, "absolutely": 1.4, "deeply": 1.35, "too": 1.2, "truly": 1.25}
+DIMINISHERS = {"slightly": 0.6, "somewhat": 0.7, "kinda": 0.7, "kind": 0.8, "sort": 0.8, "little": 0.75,
+               "bit": 0.75, "fairly": 0.85, "mildly": 0.6, "barely": 0.5}
+NEGATION_WINDOW = 3
+NEGATION_FACTOR = -0.74
+CONTRAST_WORDS = {"but", "however", "though", "although", "yet"}
+
+TOKEN_RE = re.compile(r"[a-z']+")
+
+
+def score_text(text: str) -> dict:
+    """
+    Lexicon-based sentiment with negation, intensifier and contrast handling.
+    Returns score (-1..1), label, emotions and a confidence (0..1) in the result.
+    """
+    tokens = TOKEN_RE.findall(text.lower())
+    # The clause after the last contrast word ("..., but ...") outweighs everything before it
+    last_contrast = max((i for i, token in enumerate(tokens) if token in CONTRAST_WORDS), default=-1)
+
+    total = 0.0
+    hits = 0
+    positive = negative = 0.0
+    emotions: List[str] = []
+    for i, token in enumerate(tokens):
+        valence = VALENCE.get(token)
+        if valence is None:
+            continue
+        modifier = 1.0
+        if i > 0:
+            prev = tokens[i - 1]
+            modifier *= INTENSIFIERS.get(prev, 1.0) * DIMINISHERS.get(prev, 1.0)
+        window = tokens[max(0, i - NEGATION_WINDOW):i]
+        negated = any(w in NEGATIONS for w in window)
+        if negated:
+            modifier *= NEGATION_FACTOR
+        if last_contrast >= 0:
+            modifier *= 1.5 if i > last_contrast else 0.5
+        value = valence * modifier
+        total += value
+        hits += 1
+        if value > 0:
+            positive += value
+        else:
+            negative -= value
+        emotion = EMOTIONS.get(token)
+        if emotion and not negated and emotion not in emotions:
+            emotions.append(emotion)
+
+    score = total / math.sqrt(total * total + 15) if hits else 0.0
+    if score >= 0.2:
+        label = "Positive"
+    elif score <= -0.2:
+        label = "Negative"
+    else:
+        label = "Neutral"
+
+    # Confidence grows with evidence and shrinks when positive and negative cues conflict
+    evidence = min(1.0, (positive + negative) / 3.0)
+    agreement = abs(positive - negative) / (positive + negative) if hits else 0.0
+    confidence = evidence * (0.4 + 0.6 * agreement) if hits else 0.0
+
+    return {
+        "score": round(score, 3),
+        "label": label,
+        "emotions": emotions[:4],
+        "confidence": round(confidence, 3),
+    }
+
+
+def pack_chunks(items: List[Tuple[int, str]], max_tokens: int = SENTIMENT_BATCH_CHUNK_TOKENS,
+                max_items: int = SENTIMENT_BATCH_CHUNK_ITEMS) -> List[List[Tuple[int, str]]]:
+    """Greedily packs (index, text) pairs into as few chunks as the token and item limits allow."""
+    chunks: List[List[Tuple[int, str]]] = []
+    current: List[Tuple[int, str]] = []
+    used = 0
+    for index, text in items:
+        cost = len(text) // 4 + 8
+        if current and (used + cost > max_tokens or len(current) >= max_items):
+            chunks.append(current)
+            current, used = [], 0
+        current.append((index, text))
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# Seconds a finished call's result is still handed to identical requests (0 = only while in flight)
+SINGLE_FLIGHT_WINDOW = float(os.getenv("SINGLE_FLIGHT_WINDOW", "2"))
+
+
+def prompt_key(endpoint: str, prompt: str) -> str:
+    """Coalescing key of an exact prompt sent by one endpoint."""
+    return f"{endpoint}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}"
+
+
+class Flight:
+    """One upstream call and every request waiting on it; chunks are kept so late joiners can replay them."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.chunks: List = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def replay(self) -> AsyncIterator:
+        """Every chunk from the first, then the live ones until the call ends."""
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent LLM calls: the first request for a key starts the call,
+    requests with the same key join it instead of calling Gemini again, and all get its result.
+    Successful results stay joinable for `window` seconds after the call ends; failures are not shared
+    with later requests. When every waiting request goes away, the call is cancelled.
+    """
+
+    def __init__(self, window: float = SINGLE_FLIGHT_WINDOW):
+        self.window = window
+        self._flights: Dict[str, Flight] = {}
+        self.leaders: Dict[str, int] = {}
+        self.joined: Dict[str, int] = {}
+
+    def _join(self, endpoint: str, key: str, source: Callable[[], AsyncIterator]) -> Flight:
+        flight = self._flights.get(key)
+        if flight is not None and flight.done and (flight.error is not None or time.monotonic() - flight.finished_at > self.window):
+            flight = None
+        if flight is not None:
+            self.joined[endpoint] = self.joined.get(endpoint, 0) + 1
+            return flight
+        self.leaders[endpoint] = self.leaders.get(endpoint, 0) + 1
+        flight = self._flights[key] = Flight(endpoint)
+        flight.task = asyncio.create_task(self._run(key, flight, source))
+        return flight
+
+    async def _run(self, key: str, flight: Flight, source: Callable[[], AsyncIterator]):
+        try:
+            async for chunk in source():
+                flight.chunks.append(chunk)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.finished_at = time.monotonic()
+            flight.notify()
+            if flight.error is not None or self.window <= 0:
+                self._forget(key, flight)
+            else:
+                asyncio.get_running_loop().call_later(self.window, self._forget, key, flight)
+
+    def _forget(self, key: str, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def stream(self, endpoint: str, key: str, source: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Chunks of the shared call for `key`; `source()` opens the upstream stream if none is running."""
+        flight = self._join(endpoint, key, source)
+        flight.subscribers += 1
+        try:
+            async for chunk in flight.replay():
+                yield chunk
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Everyone waiting on it left (e.g. clients disconnected): stop paying for the call
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    async def do(self, endpoint: str, key: str, fn: Callable[[], Awaitable]):
+        """Result of the shared call for `key`; `fn()` makes the upstream call if none is running."""
+        async def source():
+            yield await fn()
+
+        result = None
+        async for result in self.stream(endpoint, key, source):
+            pass
+        return result
+
+    def stats(self) -> dict:
+        endpoints = {}
+        for endpoint in set(self.leaders) | set(self.joined):
+            leaders, joined = self.leaders.get(endpoint, 0), self.joined.get(endpoint, 0)
+            endpoints[endpoint] = {
+                "upstream_calls": leaders,
+                "coalesced": joined,
+                "coalesced_rate": round(joined / (leaders + joined), 3),
+            }
+        return {
+            "window_seconds": self.window,
+            "in_flight": sum(1 for f in self._flights.values() if not f.done),
+            "endpoints": endpoints,
+        }
@@ -0,0 +1,101 @@
+"""
+LLMExecutor slot bookkeeping. Run from the backend directory:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_service  # noqa: E402
+from llm_service import LLMExecutor, LLMSaturatedError, LLMTimeoutError  # noqa: E402
+
+
+def test_cancel_while_queued_releases_the_queue_and_permits():
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=1, endpoint_limits={"chat": 2}, max_queue=4, queue_timeout=5)
+        holder_in = asyncio.Event()
+        holder_out = asyncio.Event()
+
+        async def hold():
+            async with executor.slot("chat"):
+                holder_in.set()
+                await holder_out.wait()
+
+        holder = asyncio.create_task(hold())
+        await holder_in.wait()
+        # Gets the endpoint permit, then queues on the global semaphore
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        assert executor.waiting == 1
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+        assert executor.waiting == 0
+        holder_out.set()
+        await holder
+        assert executor.in_flight == 0
+        assert executor._endpoint_semaphore("chat")._value == 2
+        assert executor._global._value == 1
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_releases_the_queue_and_permits():
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=1, endpoint_limits={"chat": 2}, max_queue=4, queue_timeout=0.05)
+        async with executor.slot("chat"):
+            try:
+                async with executor.slot("chat"):
+                    raise AssertionError("second slot should not be granted")
+            except LLMSaturatedError:
+                pass
+            assert executor.waiting == 0
+        assert executor._endpoint_semaphore("chat")._value == 2
+        assert executor._global._value == 1
+
+    asyncio.run(scenario())
+
+
+class SlowLLM:
+    """Chat model stand-in that answers after `delay` seconds."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def ainvoke(self, messages, **kwargs):
+        await asyncio.sleep(self.delay)
+        return "ok"
+
+    async def astream(self, messages, **kwargs):
+        await asyncio.sleep(self.delay)
+        yield "ok"
+
+
+def test_deadline_spent_queueing_is_saturation_not_a_breaker_failure(monkeypatch):
+    deadlines = {"clinical_summary": 2.0, "chat": 0.1}
+    monkeypatch.setattr(llm_service, "endpoint_deadline", deadlines.get)
+
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=1, max_queue=4, queue_timeout=15)
+        # Holds the only global slot longer than a chat call's deadline
+        holder = asyncio.create_task(executor.invoke("clinical_summary", SlowLLM(0.4), []))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LLMSaturatedError):
+            await executor.invoke("chat", SlowLLM(0), [])
+        with pytest.raises(LLMSaturatedError):
+            async for _ in executor.stream("chat", SlowLLM(0), []):
+                pass
+        assert executor.breaker.consecutive_failures == 0
+        assert executor.waiting == 0
+        assert await holder == "ok"
+
+        # A call that got its slot and then missed the deadline is still an upstream failure
+        with pytest.raises(LLMTimeoutError):
+            await executor.invoke("chat", SlowLLM(0.5), [])
+        assert executor.breaker.consecutive_failures == 1
+
+    asyncio.run(scenario())
@@ -1,12 +1,11 @@
 import React, { useEffect, useState, useRef } from 'react';
 import { X, Mic, MicOff, Volume2, CheckCircle2 } from 'lucide-react';
-import { sendMessageToBackendStream } from '../services/geminiService';
+import { sendMessageToBackendStream, chatConversationId } from '../services/geminiService';
 import { ChatMessage } from '../types';
 
 interface LiveVoiceSessionProps {
   onClose: () => void;
   categories: string[];
-  history: ChatMessage[];
   onAddMessage: (role: 'user' | 'model', text: string) => void;
   tasks: any[];
 }
@@ -14,7 +13,6 @@ interface LiveVoiceSessionProps {
 const LiveVoiceSession: React.FC<LiveVoiceSessionProps> = ({
   onClose,
   categories,
-  history,
   onAddMessage
 }) => {
   const [status, setStatus] = useState<'listening' | 'processing' | 'speaking' | 'idle'>('idle');
@@ -129,10 +127,6 @@ const LiveVoiceSession: React.FC<LiveVoiceSessionProps> = ({
     };
     onAddMessage(userMsg);
 
-    // Construct history logic
-    const apiHistory = history.map(h => ({ role: h.role, parts: [{ text: h.text }] }));
-    apiHistory.push({ role: 'user', parts: [{ text: text }] });
-
     const userContext = `The user is in 'Voice Mode'. Keep responses shorter (1-2 sentences), conversational, and warm. Avoid markdown.`;
 
     // 2. Add Bot Message Placeholder
@@ -149,7 +143,9 @@ const LiveVoiceSession: React.FC<LiveVoiceSessionProps> = ({
 
     try {
       await sendMessageToBackendStream(
-        apiHistory.length > 5 ? apiHistory.slice(-5) : apiHistory,
+        // Same backend conversation as the text chat, so voice turns share its history
+        chatConversationId(),
+        text,
         userContext,
         (chunk) => {
           fullResponse += chunk;
@@ -2,6 +2,7 @@
 import React, { createContext, useContext, useEffect, useState } from 'react';
 import { User, onAuthStateChanged, signOut as firebaseSignOut } from 'firebase/auth';
 import { auth, isConfigValid } from '../firebaseConfig';
+import { setBackendUser } from '../services/geminiService';
 import { AlertTriangle, Terminal } from 'lucide-react';
 
 interface AuthContextType {
@@ -31,6 +32,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
     const unsubscribe = onAuthStateChanged(auth, (user) => {
       setCurrentUser(user);
+      setBackendUser(user);
       setLoading(false);
     });
     return unsubscribe;
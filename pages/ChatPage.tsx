@@ -1,6 +1,6 @@
 
 import React, { useState, useRef, useEffect } from 'react';
-import { sendMessageToBackendStream, generateTaskBreakdown, analyzeSentiment } from '../services/geminiService';
+import { sendMessageToBackendStream, chatConversationId, generateTaskBreakdown, analyzeSentiment } from '../services/geminiService';
 import { ChatMessage, Task } from '../types';
 import { Send, Mic, Bot, ArrowLeft, Sparkles, User } from 'lucide-react';
 import LiveVoiceSession from '../components/LiveVoiceSession';
@@ -82,17 +82,7 @@ const ChatPage: React.FC<ChatPageProps> = ({
 
       const categoryContext = `\nThe user has defined the following task categories: ${categories.join(", ")}. ${reflectionContext}`;
 
-      // 3. Prepare History
-      const validHistory = messages
-        .filter(m => (m.role === 'user' || m.role === 'model') && m.text && m.text.trim().length > 0)
-        .map(m => ({
-          role: m.role,
-          parts: [{ text: m.text }]
-        }));
-
-      validHistory.push({ role: 'user', parts: [{ text: userMsg.text }] });
-
-      // 4. Create Placeholder Bot Message
+      // 3. Create Placeholder Bot Message
       const botMsgId = (Date.now() + 1).toString();
       const botMsg: ChatMessage = {
         id: botMsgId,
@@ -103,11 +93,12 @@ const ChatPage: React.FC<ChatPageProps> = ({
       // We add it immediately so the user sees the "Thinking..." or empty bubble
       onAddMessage(botMsg);
 
-      // 5. Stream Response
+      // 4. Stream Response (the backend keeps the history of this conversation)
       let accumulatedText = "";
 
       await sendMessageToBackendStream(
-        validHistory.slice(0, -1),
+        chatConversationId(),
+        userMsg.text,
         categoryContext,
         (chunk) => {
           accumulatedText += chunk;
@@ -182,7 +173,6 @@ const ChatPage: React.FC<ChatPageProps> = ({
         onClose={handleVoiceClose}
         onTaskCreated={onTaskCreated}
         categories={categories}
-        history={messages}
         onAddMessage={onAddMessage}
         tasks={tasks}
       />
@@ -1,8 +1,23 @@
 
+import type { User } from "firebase/auth";
 import { AssessmentResult, SentimentAnalysis, ChatMessage } from "../types";
 
 const API_BASE_URL = "http://localhost:8000";
 
+// Signed-in Firebase user; the backend verifies their ID token and scopes memories and sessions by its uid
+let backendUser: User | null = null;
+
+export function setBackendUser(user: User | null) {
+  backendUser = user;
+}
+
+async function userHeaders(): Promise<Record<string, string>> {
+  if (!backendUser) return {};
+  // Cached by the Firebase SDK and refreshed shortly before it expires
+  const token = await backendUser.getIdToken();
+  return { 'Authorization': `Bearer ${token}` };
+}
+
 // --- Helper: Crisis Detection (Client-Side Safety) ---
 export function detectCrisis(text: string): boolean {
   if (!text) return false;
@@ -30,16 +45,29 @@ async function postData(endpoint: string, data: any) {
 
 // --- Chat Functionality (Streaming) ---
 
+// The chat history is one ongoing conversation per user; the backend keeps it (with a rolling
+// summary) under this id, so each turn only sends the new message
+export function chatConversationId(): string {
+  const key = `chatConversationId:${backendUser?.uid ?? 'anonymous'}`;
+  let id = localStorage.getItem(key);
+  if (!id) {
+    id = crypto.randomUUID();
+    localStorage.setItem(key, id);
+  }
+  return id;
+}
+
 export async function sendMessageToBackendStream(
-  messages: ChatMessage[],
+  conversationId: string,
+  message: string,
   userContext: string,
   onChunk: (text: string) => void
 ): Promise<{ functionCalls?: any[] }> {
   try {
     const response = await fetch(`${API_BASE_URL}/chat`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ messages, user_context: userContext })
+      headers: { 'Content-Type': 'application/json', ...(await userHeaders()) },
+      body: JSON.stringify({ conversation_id: conversationId, message, user_context: userContext })
     });
 
     if (!response.body) throw new Error("No response body");
@@ -81,6 +109,37 @@ export async function analyzeSentiment(text: string): Promise<SentimentAnalysis>
   }
 }
 
+// Scores many texts in one request; onResult fires per text as the backend streams NDJSON lines
+export async function analyzeSentimentBatch(
+  texts: string[],
+  onResult: (index: number, result: SentimentAnalysis) => void
+): Promise<void> {
+  const response = await fetch(`${API_BASE_URL}/analyze-sentiment/batch`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ texts })
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`API Error: ${response.statusText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (value) buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop() || "";
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const item = JSON.parse(line);
+      onResult(item.index, { keywords: [], ...item.result });
+    }
+    if (done) break;
+  }
+}
+
 export async function generateTaskBreakdown(taskTitle: string): Promise<string> {
   try {
     const data = await postData('/generate-task-breakdown', { task_title: taskTitle });
@@ -123,7 +182,7 @@ export async function getMemories(): Promise<{ id: string, text: string, created
     const data = await postData('/memories', {}); // Using POST for consistency or switching to GET if preferred, backend defined GET though. Wait, backend defined GET. postData uses POST.
     // Correction: Backend defined @app.get('/memories'). postData helper is hardcoded to POST.
     // I need a getData helper or use fetch directly.
-    const response = await fetch(`${API_BASE_URL}/memories`);
+    const response = await fetch(`${API_BASE_URL}/memories`, { headers: await userHeaders() });
     if (!response.ok) throw new Error("Failed to fetch memories");
     const json = await response.json();
     return json.memories;
@@ -136,7 +195,8 @@ export async function getMemories(): Promise<{ id: string, text: string, created
 export async function deleteMemory(memoryId: string): Promise<boolean> {
   try {
     const response = await fetch(`${API_BASE_URL}/memories/${memoryId}`, {
-      method: 'DELETE'
+      method: 'DELETE',
+      headers: await userHeaders()
     });
     if (!response.ok) throw new Error("Failed to delete memory");
     const json = await response.json();
@@ -151,16 +211,46 @@ export async function generateClinicalSummary(
   moodHistory: any[],
   journalHistory: any[],
   tasks: any[],
-  userName: string
+  userName: string,
+  onChunk?: (text: string) => void
 ): Promise<string> {
   try {
-    const response = await postData('/clinical-summary', {
-      mood_history: moodHistory.slice(-20),
-      journal_history: journalHistory.slice(-5).map(j => ({ date: new Date(j.timestamp).toLocaleDateString(), content: j.content.substring(0, 150) + "..." })),
-      tasks: tasks, // Backend can handle full or partial, let's send what we have or simplify if needed
-      user_name: userName
+    // The backend condenses the full history into a compact digest before prompting
+    const payload = {
+      mood_history: moodHistory,
+      journal_history: journalHistory.map(j => ({ timestamp: j.timestamp, title: j.title, content: j.content })),
+      tasks: tasks,
+      user_name: userName,
+      stream: !!onChunk
+    };
+    if (!onChunk) {
+      const response = await postData('/clinical-summary', payload);
+      return response.text;
+    }
+
+    const response = await fetch(`${API_BASE_URL}/clinical-summary`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(payload)
     });
-    return response.text;
+    if (!response.ok || !response.body) throw new Error(`API Error: ${response.statusText}`);
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let text = "";
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      const chunk = decoder.decode(value, { stream: true });
+      // A record separator starts the error frame the backend sends when the report fails mid-stream
+      const errorAt = chunk.indexOf('\x1e');
+      if (errorAt !== -1) {
+        if (errorAt > 0) onChunk(chunk.slice(0, errorAt));
+        throw new Error("Report stream was cut off");
+      }
+      text += chunk;
+      onChunk(chunk);
+    }
+    return text;
   } catch (e) {
     console.error("Summary generation failed", e);
     return "Unable to generate AI summary at this time.";
@@ -174,8 +264,8 @@ export async function generateAssessmentQuestions(
 ): Promise<string[]> {
   try {
     const response = await postData('/assessment-questions', {
-      mood_history: moodHistory.slice(-5),
-      journal_history: journalHistory.slice(-3).map(j => j.content),
+      mood_history: moodHistory,
+      journal_history: journalHistory.map(j => ({ timestamp: j.timestamp, title: j.title, content: j.content })),
       tasks: tasks
     });
     return JSON.parse(response.questions);
@@ -196,8 +286,8 @@ export async function generateWellnessAssessment(
 ): Promise<AssessmentResult> {
   try {
     const response = await postData('/wellness-assessment', {
-      mood_history: moodHistory.slice(-10),
-      journal_history: journalHistory.slice(-5).map(j => ({ title: j.title, content: j.content })),
+      mood_history: moodHistory,
+      journal_history: journalHistory.map(j => ({ timestamp: j.timestamp, title: j.title, content: j.content })),
       tasks: tasks,
       qa_pairs: qaPairs
     });